@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*
+# python3
+# innovalie - LJK
+"""
+Benchmarks des étapes de l'analyse sprof
+
+Mesure, sur les fichiers de test (test/) et sur des enregistrements synthétiques
+(sprof.synthetic) :
+    - lecture des fichiers radar (RadarFile, .rda et .rad)
+    - RadarData (lissage et recherche des bornes), et find_sprint_start seul
+    - Sprint : lissage, points aberrants, fit du modèle
+    - PFV, ajout des lignes au PFVDataset et export csv, recherche de l'athlète
+
+Pour chaque benchmark : le meilleur temps sur --repeat mesures (moins sensible à la
+charge de la machine), divisé par le nombre d'éléments traités.
+Les temps par sprint dépendent des kernels utilisés (numba ou numpy, cf
+settings KERNEL_BACKEND) : le backend est affiché et sauvegardé avec la référence.
+Les résultats peuvent être sauvegardés comme référence (--save), et comparés à cette
+référence : le script échoue (code retour 1) si un benchmark est plus lent que la
+référence de plus de --max-slowdown (ratio).
+
+Usage :
+    python sprof_bench.py --save                 # mesure, et sauvegarde la référence
+    python sprof_bench.py [--max-slowdown 1.25] # mesure, et compare à la référence
+    python sprof_bench.py -k sprint --synthetic 500
+    SPROF_KERNEL_BACKEND=numpy python sprof_bench.py -k sprint
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import timeit
+import warnings
+import numpy as np
+from sprof.settings import PROJECT_DIR, PFV_ANALYSE_DIR
+from sprof.radar_file import RadarFile
+from sprof.radar_data import RadarData
+from sprof.sprint import Sprint
+from sprof.pfv import PFV
+from sprof.analyse import Analyse
+from sprof.pfv_dataset import PFVDataset
+from sprof.athlete import get_athlete_values, get_athlete_ds
+from sprof.synthetic import write_corpus
+from sprof.kernels import BACKEND
+
+TEST_DIR = os.path.join(PROJECT_DIR, 'test')
+BASELINE_FILE = os.path.join(PFV_ANALYSE_DIR, 'sprof_bench_baseline.json')
+
+# ------- Données --------
+
+class Corpus:
+    """ Données pré-calculées pour un jeu de fichiers : chaque benchmark ne mesure
+    que son étape
+    """
+    def __init__(self, name, files):
+        self.name = name
+        self.files = files
+        self.rda_files = [f for f in files if f.endswith('.rda')]
+        self.rad_files = [f[:-4]+'.rad' for f in files if os.path.exists(f[:-4]+'.rad')]
+        self.rfs = [RadarFile(f) for f in files]
+        self.rds = []
+        self.sprints_in = []
+        self.sprints = []
+        self.athletes = []
+        self.analyses = []
+        for (file, rf) in zip(files, self.rfs):
+            rd = RadarData(rf.T, rf.V, rf.title)
+            if rd.data_error:
+                continue
+            (T, V) = rd.extract_sprint()
+            s = Sprint(T, V, rd.title)
+            (mass, stature) = get_athlete_values(file)
+            pfv = PFV(v_max=s.v_max, tau=s.tau, duration=s.duration, mass=mass, stature=stature)
+            self.rds.append(rd)
+            self.sprints_in.append((T, V, rd.title))
+            self.sprints.append(s)
+            self.athletes.append((mass, stature))
+            self.analyses.append(Analyse(radar_file=rf, radar_data=rd, sprint=s, pfv=pfv))
+
+def get_benchmarks(corpus, tmp_dir):
+    """ Retourne la liste des benchmarks du corpus : (nom, fonction, nb d'éléments)
+    """
+    c = corpus
+    export_file = os.path.join(tmp_dir, c.name+'_pfv.csv')
+
+    def build_dataset():
+        ds = PFVDataset(c.name)
+        for a in c.analyses:
+            ds.add_row_from_analyse(a)
+        ds.export_csv(export_file)
+
+    benchmarks = [
+        ('radar_file_rda', lambda: [RadarFile(f) for f in c.rda_files], len(c.rda_files)),
+        ('radar_file_rad', lambda: [RadarFile(f) for f in c.rad_files], len(c.rad_files)),
+        ('radar_data', lambda: [RadarData(rf.T, rf.V, rf.title) for rf in c.rfs], len(c.rfs)),
+        ('find_sprint_start', lambda: [rd.find_sprint_start() for rd in c.rds], len(c.rds)),
+        ('sprint', lambda: [Sprint(T, V, title) for (T, V, title) in c.sprints_in], len(c.sprints_in)),
+        ('sprint_no_outliers', lambda: [Sprint(T, V, title, outliers=False) for (T, V, title) in c.sprints_in], len(c.sprints_in)),
+        ('sprint_smooth', lambda: [s._smooth(s.V_sprint) for s in c.sprints], len(c.sprints)),
+        ('sprint_fit', lambda: [s.compute_f_velocity_params(s.T_sprint_acc, s.V_sprint_acc) for s in c.sprints], len(c.sprints)),
+        ('pfv', lambda: [PFV(v_max=s.v_max, tau=s.tau, duration=s.duration, mass=m, stature=st)
+                         for (s, (m, st)) in zip(c.sprints, c.athletes)], len(c.sprints)),
+        ('pfv_dataset', build_dataset, len(c.analyses)),
+        ('athlete', lambda: [get_athlete_values(f) for f in c.files], len(c.files)),
+    ]
+    return [(f"{c.name}.{name}", func, n) for (name, func, n) in benchmarks if n > 0]
+
+# ------- Méthodes --------
+
+def run(benchmarks, repeat, pattern=""):
+    """ Retourne un dictionnaire nom : temps par élément (s)
+    """
+    results = {}
+    for (name, func, n) in benchmarks:
+        if pattern and pattern not in name:
+            continue
+        with contextlib.redirect_stdout(io.StringIO()):
+            timer = timeit.Timer(func)
+            # nombre d'appels pour une mesure d'au moins 0.2 s
+            (number, t) = timer.autorange()
+            best = min(timer.repeat(repeat=repeat, number=number))/number
+        results[name] = best/n
+        print(f"{name:<36}{n:>6}{best/n*1000:>12.3f}", flush=True)
+    return results
+
+def compare(results, baseline, max_slowdown):
+    """ Compare à la référence. Retourne le nombre de benchmarks trop lents
+    """
+    errors = 0
+    print(f"\n{'benchmark':<36}{'ref (ms)':>12}{'ms':>12}{'ratio':>8}")
+    for (name, t) in results.items():
+        if name not in baseline:
+            print(f"{name:<36}{'-':>12}{t*1000:>12.3f}")
+            continue
+        ratio = t/baseline[name]
+        status = ""
+        if ratio > max_slowdown:
+            status = "  ERREUR : plus lent"
+            errors += 1
+        print(f"{name:<36}{baseline[name]*1000:>12.3f}{t*1000:>12.3f}{ratio:>8.2f}{status}")
+    return errors
+
+# ------  Main --------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmarks de l'analyse sprof")
+    parser.add_argument('--save', action='store_true', help="Sauvegarder les résultats comme référence")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="Fichier de référence (json)")
+    parser.add_argument('--max-slowdown', type=float, default=1.25, help="Ratio de ralentissement toléré")
+    parser.add_argument('--repeat', type=int, default=5, help="Nombre de mesures par benchmark")
+    parser.add_argument('--synthetic', type=int, default=200, help="Nombre d'enregistrements synthétiques (0 : aucun)")
+    parser.add_argument('-k', dest='pattern', default="", help="Seulement les benchmarks contenant ce texte")
+    args = parser.parse_args()
+
+    # DataFrame.append, utilisé par PFVDataset
+    warnings.simplefilter('ignore', FutureWarning)
+
+    with tempfile.TemporaryDirectory(prefix="sprof_bench_") as tmp_dir:
+        print("Préparation des données ...", flush=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            get_athlete_ds() # chargé une seule fois par process
+            corpora = [Corpus('test', sorted(glob.glob(os.path.join(TEST_DIR, '*.rda'))))]
+            if args.synthetic:
+                files = write_corpus(os.path.join(tmp_dir, 'synth'), args.synthetic, seed=0)
+                corpora.append(Corpus('synthetic', files))
+
+        print(f"\nKernels : {BACKEND}")
+        print(f"{'benchmark':<36}{'n':>6}{'ms/élément':>12}")
+        results = {}
+        for corpus in corpora:
+            results.update(run(get_benchmarks(corpus, tmp_dir), args.repeat, args.pattern))
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({'python':platform.python_version(), 'numpy':np.__version__,
+                       'kernel_backend':BACKEND, 'results':results}, f, indent=2)
+        print(f"\nRéférence sauvegardée : {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('kernel_backend', 'numpy') != BACKEND:
+            print(f"\nATTENTION : référence mesurée avec les kernels {baseline.get('kernel_backend', 'numpy')}")
+        errors = compare(results, baseline['results'], args.max_slowdown)
+        sys.exit(1 if errors else 0)
+    else:
+        print(f"\nPas de référence ({args.baseline}), utiliser --save")
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*
+# python3
+# innovalie - LJK
+"""
+Vérification des kernels numériques (sprof.kernels) : les versions vectorisées et
+compilées donnent les mêmes résultats que les boucles de référence, et le fit les mêmes
+paramètres que scipy leastsq.
+
+Les kernels sont comparés sur les fichiers test/*.rda, des sprints synthétiques avec
+points aberrants et des enregistrements très courts, pour chaque backend disponible
+(numpy, et numba s'il est installé). Le script échoue (code retour 1) si une différence
+est trouvée.
+
+Usage :
+    python sprof_check_kernels.py [--backend numpy]
+"""
+import argparse
+import sys
+from sprof.kernels import check_kernels, get_check_recordings, get_backend
+
+# ------  Main --------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Vérification des kernels numériques")
+    parser.add_argument('--backend', choices=('numpy', 'numba'), action='append',
+                        help='Backend vérifié (défaut : tous ceux disponibles)')
+    args = parser.parse_args()
+
+    backends = args.backend or ['numpy'] + (['numba'] if get_backend('auto') == 'numba' else [])
+    recordings = get_check_recordings()
+    n_errors = 0
+    for backend in backends:
+        errors = check_kernels(recordings, backend)
+        print(f"{backend} : vérification sur {len(recordings)} enregistrements, {len(errors)} différence(s)")
+        for (name, error) in errors[:20]:
+            print(f"\t{name} : {error}")
+        n_errors += len(errors)
+    sys.exit(1 if n_errors else 0)
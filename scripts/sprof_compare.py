@@ -6,10 +6,13 @@ Scripts de comparaison de 2 datasets calculés :
  - avec ou sans outliers, 
  - avec ou sans auto-bounds
  - Résultats manuels (fournis par FCG) vs calculés
+
+Pour comparer toutes les variantes en une fois (lecture unique des fichiers, analyses en
+parallèle, statistiques d'erreur et temps) : python sprof/manual_compare.py
 """
 from sprof.pfv_dataset import build_PFV_DS_from_files
 from sprof.radar_file import params_get_files
-import pandas as pd
+from sprof.manual_compare import read_manual
 from sprof.settings import PFV_ANALYSE_DIR
 from datetime import datetime
 import os
@@ -23,10 +26,9 @@ def save_df_to_csv(df, title):
 
 def compare_to_manual(files,title,auto,outliers):
 
-    manual_file="/Users/bligny/Projects/innovalie/sources_git/sprof/data/analyse_manuelle_juillet2019.csv"
-    df_man=pd.read_csv(manual_file, decimal=",") # manual analyses
+    df_man=read_manual() # manual analyses
 
-    ds=build_PFV_DS_from_files(files,title, auto=auto, outliers=outliers)
+    ds=build_PFV_DS_from_files(files,title, auto=auto, outliers=outliers, workers=os.cpu_count())
     df_diff=ds.compare(df_man)
     
     print(ds)
@@ -44,8 +46,7 @@ def analyse():
 # bien utiliser -e rad dans les params, sinon ça rime à rien
 # compare prepared data files (=.rad) results with excel sheet results
 # même résultats attendus. diff : pas la stature, et pente un peu diff excel vs python
-# il faut aussi qu'il y ait exactement le même nombre de ligne.
-# Bref. il faudrait être sur de comparer les bonnes lignes. A améliorer.
+# les lignes sont associées par le titre du sprint
 def manual_vs_nodefaults(files):
     
     title='manual_vs_nodefaults'
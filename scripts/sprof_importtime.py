@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*
+# python3
+# innovalie - LJK
+"""
+Garde-fou sur le temps d'import des modules sprof (python -X importtime)
+
+Importer sprof ne doit charger ni matplotlib, ni pandas, ni scipy : ils sont importés
+à la première utilisation (graphiques, dataset, calculs). Pour chaque module, le script
+mesure le temps d'import cumulé dans un nouveau process python, et échoue (code retour
+1) si un module lourd est importé ou si le temps dépasse le budget.
+
+Usage :
+    python sprof_importtime.py [--budget 400] [--repeat 3]
+"""
+import argparse
+import subprocess
+import sys
+
+# modules "point d'entrée" : les outils en ligne de commande et les workers
+MODULES = ('sprof.radar_file', 'sprof.radar_data', 'sprof.sprint', 'sprof.pfv',
+           'sprof.analyse', 'sprof.pfv_dataset', 'sprof.radar_watcher')
+
+# ne doivent pas être importés avec sprof
+HEAVY_MODULES = ('matplotlib', 'pandas', 'scipy')
+
+# ------- Méthodes --------
+
+def import_time(module):
+    """ Retourne le temps d'import cumulé (ms) de module, et la liste des modules
+    importés, dans un nouveau process python
+    """
+    cmd = [sys.executable, '-X', 'importtime', '-c', f"import {module}"]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Import de {module} impossible :\n{result.stderr}")
+
+    total = 0
+    imported = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if line.startswith('import time:') and '|' in line:
+            fields = line[len('import time:'):].split('|')
+            name = fields[2].strip()
+            if not fields[1].strip().isdigit():
+                continue # ligne de titre
+            imported.append(name)
+            if name == module:
+                total = int(fields[1])/1000
+    return total, imported
+
+def check(budget, repeat):
+    errors = 0
+    print(f"{'module':<22}{'temps (ms)':>12}")
+    for module in MODULES:
+        # le minimum sur plusieurs mesures : moins sensible à la charge de la machine
+        times = []
+        for i in range(repeat):
+            (total, imported) = import_time(module)
+            times.append(total)
+        total = min(times)
+        heavy = sorted({name.split('.')[0] for name in imported if name.split('.')[0] in HEAVY_MODULES})
+        status = "OK"
+        if heavy:
+            status = f"ERREUR : importe {', '.join(heavy)}"
+            errors += 1
+        elif total > budget:
+            status = f"ERREUR : budget de {budget} ms dépassé"
+            errors += 1
+        print(f"{module:<22}{total:>12.1f}   {status}")
+    return errors
+
+# ------  Main --------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Temps d'import des modules sprof")
+    parser.add_argument('--budget', type=float, default=400, help="Temps d'import max par module (ms)")
+    parser.add_argument('--repeat', type=int, default=3, help="Nombre de mesures par module")
+    args = parser.parse_args()
+
+    errors = check(args.budget, args.repeat)
+    sys.exit(1 if errors else 0)
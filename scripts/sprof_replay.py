@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*
+# python3
+# innovalie - LJK
+"""
+Rejoue des enregistrements radar, point par point, dans le détecteur en ligne
+(sprof.online.OnlineDetector), et mesure la latence de détection.
+
+Les points sont envoyés à leur heure (temps réel, --speed 1), plus vite (--speed 20),
+ou sans attente (--speed 0). Pour chaque évènement :
+    - retard sur les données : temps de l'évènement - temps de référence, donné par
+      l'analyse du fichier complet (RadarData : début du sprint, vitesse max lissée,
+      fin du sprint)
+    - temps de calcul : délai entre l'arrivée du point et l'évènement
+Les valeurs provisoires (v_max, tau) sont comparées à celles de Sprint.
+
+Usage :
+    python sprof_replay.py                       # fichiers test/*.rda, sans attente
+    python sprof_replay.py --speed 1 -f "../test/Juillet Alexandre 1.rda"
+    cat "../test/Juillet Alexandre 1.rda" | python sprof_replay.py --pipe --speed 5
+"""
+import argparse
+import contextlib
+import glob
+import io
+import os
+import sys
+import time
+import numpy as np
+from sprof.settings import PROJECT_DIR
+from sprof.radar_file import RadarFile
+from sprof.radar_data import RadarData
+from sprof.sprint import Sprint
+from sprof.online import OnlineDetector, read_samples
+
+TEST_DIR = os.path.join(PROJECT_DIR, 'test')
+
+# évènement : (attribut de RadarData donnant l'indice de référence)
+REFERENCES = {'start':'i_start_sprint', 'top_speed':'i_vs_max', 'end':'i_end_sprint'}
+
+# ------- Méthodes --------
+
+def replay(samples, detector, speed=0.0):
+    """ Envoie les points (t, v) au détecteur, à la vitesse speed (0 : sans attente).
+    Retourne la liste des évènements, avec le temps de calcul ('compute', s)
+    """
+    events = []
+    t_first = None
+    wall_start = time.perf_counter()
+    for (t, v) in samples:
+        if t_first is None:
+            t_first = t
+        if speed > 0:
+            delay = wall_start+(t-t_first)/speed-time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        arrival = time.perf_counter()
+        new_events = detector.feed(t, v)
+        for event in new_events:
+            event['compute'] = time.perf_counter()-arrival
+            print(f"  {event['event']:9s} t={event['time']:6.2f} s  "
+                  + ", ".join(f"{k} {event[k]}" for k in ('t_start', 'v_max', 'tau') if k in event))
+        events += new_events
+    for event in detector.close():
+        event['compute'] = 0.0
+        print(f"  {event['event']:9s} t={event['time']:6.2f} s  (fin des données)")
+        events.append(event)
+    return events
+
+def get_reference(file):
+    """ Temps de référence des évènements, et paramètres du sprint, par l'analyse du
+    fichier complet. None si pas de sprint
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        rf = RadarFile(file)
+        rd = RadarData(rf.T, rf.V, rf.title)
+        if rd.data_error:
+            return None
+        s = Sprint(*rd.extract_sprint(), rd.title)
+    times = {event:rd.T[getattr(rd, attr)] for (event, attr) in REFERENCES.items()}
+    return (rf, times, {'v_max':s.v_max, 'tau':s.tau})
+
+def print_stats(title, values, unit, factor=1):
+    if values:
+        values = np.array(values)*factor
+        print(f"{title:28s} : moyenne {values.mean():7.2f}, p50 {np.percentile(values,50):7.2f}, "
+              f"p95 {np.percentile(values,95):7.2f}, max {values.max():7.2f} {unit}")
+
+def replay_files(files, speed):
+    latencies = {event:[] for event in REFERENCES}
+    computes = []
+    errors = {'v_max':[], 'tau':[]}
+    for file in files:
+        reference = get_reference(file)
+        if reference is None:
+            print(f"{os.path.basename(file)} : pas de sprint, ignoré")
+            continue
+        (rf, times, params) = reference
+        print(f"{rf.title} : {rf.n} points")
+        events = replay(zip(rf.T.tolist(), rf.V.tolist()), OnlineDetector(rf.sample_rate), speed)
+        for event in events:
+            computes.append(event['compute'])
+            if event['event'] in latencies:
+                latencies[event['event']].append(event['time']-times[event['event']])
+            if event['event'] == 'end':
+                for k in errors:
+                    errors[k].append(abs(event[k]-params[k]))
+
+    print(f"\n{len(files)} fichiers, vitesse {speed or 'max'}")
+    for (event, values) in latencies.items():
+        print_stats(f"retard {event}", values, "s")
+    print_stats("temps de calcul", computes, "µs", 1e6)
+    for (k, values) in errors.items():
+        print_stats(f"écart {k} provisoire/Sprint", values, "")
+
+# ------  Main --------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Rejoue des enregistrements radar dans le détecteur en ligne")
+    parser.add_argument('--file', '-f', action='append', help='Fichier .rda ou .rad (plusieurs possibles)')
+    parser.add_argument('--speed', '-s', type=float, default=0, help='1 : temps réel, 0 : sans attente')
+    parser.add_argument('--pipe', action='store_true', help='Points lus sur l\'entrée standard')
+    parser.add_argument('--sample-rate', type=float, default=RadarFile.DEF_SAMPLE_RATE)
+    args = parser.parse_args()
+
+    if args.pipe:
+        events = replay(read_samples(sys.stdin, args.sample_rate), OnlineDetector(args.sample_rate), args.speed)
+        print_stats("temps de calcul", [e['compute'] for e in events], "µs", 1e6)
+    else:
+        replay_files(args.file or sorted(glob.glob(os.path.join(TEST_DIR, '*.rda'))), args.speed)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*
+# python3
+# innovalie - LJK
+"""
+Client de test pour les résultats publiés par le radar watcher (cf result_publisher.py)
+Affiche chaque analyse reçue, et mesure la latence de bout en bout : délai entre la
+publication par le watcher et la réception par le client (même machine, même horloge).
+
+Usage :
+    python sprof_subscribe.py [--host 127.0.0.1] [--port 8765]
+        se connecte au watcher en cours, ctrl C pour arrêter et afficher les latences
+    python sprof_subscribe.py --selftest 200
+        lance un publisher local, publie 200 messages et mesure les latences
+"""
+import argparse
+import http.client
+import json
+import threading
+import time
+import numpy as np
+from sprof.result_publisher import ResultPublisher
+from sprof.settings import WATCHER_PUBLISH_HOST, WATCHER_PUBLISH_PORT
+
+# ------- Méthodes --------
+
+def read_events(host, port, path=ResultPublisher.EVENTS_PATH):
+    """ Iterateur : retourne les messages (dict) reçus sur le flux d'évènements
+    """
+    conn = http.client.HTTPConnection(host, port)
+    conn.request('GET', path)
+    response = conn.getresponse()
+    for line in response:
+        line = line.decode('utf-8').rstrip('\r\n')
+        if line.startswith('data:'):
+            yield json.loads(line[5:])
+
+def print_latencies(latencies):
+    if latencies:
+        lat = np.array(latencies)*1000
+        print(f"\n{len(lat)} messages - latence (ms) : moyenne {lat.mean():.2f}, "
+              f"p50 {np.percentile(lat,50):.2f}, p95 {np.percentile(lat,95):.2f}, max {lat.max():.2f}")
+
+def subscribe(host, port):
+    """ Affiche les résultats publiés par le watcher. Les messages rejoués (publiés
+    avant la connexion) ne sont pas pris en compte dans les latences.
+    """
+    latencies = []
+    t_connect = time.time()
+    print(f"Connexion à http://{host}:{port}{ResultPublisher.EVENTS_PATH}")
+    try:
+        for msg in read_events(host, port):
+            values = msg['values']
+            print(f"{msg['id']} - {values.get('name')} : V0 {values.get('V0')} m/s, "
+                  f"F0 {values.get('F0_kg')} N/kg, P max {values.get('Pmax_kg')} W/kg")
+            if msg['time'] >= t_connect:
+                latencies.append(time.time()-msg['time'])
+    except KeyboardInterrupt:
+        pass
+    print_latencies(latencies)
+
+def selftest(n_messages, period=0.01):
+    """ Publie n_messages sur un port libre, et mesure la latence de réception
+    """
+    publisher = ResultPublisher(port=0)
+    publisher.start()
+    # 2 messages déjà publiés : ils doivent être rejoués à la connexion
+    publisher.publish({'name':'Replay 1'})
+    publisher.publish({'name':'Replay 2'})
+
+    def publish_all():
+        time.sleep(0.2) # laisse le temps au client de se connecter
+        for i in range(n_messages):
+            publisher.publish({'name':f"Test {i}", 'V0':8.5, 'F0_kg':7.2, 'Pmax_kg':15.3})
+            time.sleep(period)
+
+    threading.Thread(target=publish_all, daemon=True).start()
+
+    latencies = []
+    n_replay = 0
+    for msg in read_events(publisher.host, publisher.port):
+        if msg['values']['name'].startswith('Replay'):
+            n_replay += 1
+        else:
+            latencies.append(time.time()-msg['time'])
+        if len(latencies) == n_messages:
+            break
+    publisher.stop()
+
+    print(f"{n_replay} messages rejoués à la connexion")
+    print_latencies(latencies)
+
+# ------  Main --------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Client de test des résultats publiés par le radar watcher")
+    parser.add_argument('--host', default=WATCHER_PUBLISH_HOST)
+    parser.add_argument('--port', type=int, default=WATCHER_PUBLISH_PORT)
+    parser.add_argument('--selftest', type=int, default=0, help='Nombre de messages pour le test local')
+    args = parser.parse_args()
+
+    if args.selftest:
+        selftest(args.selftest)
+    else:
+        subscribe(args.host, args.port)
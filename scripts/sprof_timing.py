@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*
+# python3
+# innovalie - LJK
+"""
+Temps passé dans chaque étape de l'analyse, sur les fichiers radar d'un répertoire
+
+Analyse les fichiers avec l'instrumentation activée (sprof.instrument), puis affiche
+pour chaque étape (parse, detect, extract, sprint, smooth, fit, athlete, pfv) : le nombre
+d'appels, le temps total, p50, p95 et max, et les compteurs (itérations du fit, points
+enlevés).
+Sauvegarde dans PFV_ANALYSE_DIR (ou --out) :
+    - yymmdd_timing.jsonl : une ligne json par fichier analysé
+    - yymmdd_timing_summary.json : le résumé par étape
+    - avec --profile, un profil cProfile par étape : yymmdd_timing_<étape>.prof
+
+Usage :
+    python sprof_timing.py [-d dir] [-p pattern] [--repeat 1] [--profile] [--out dir]
+"""
+import argparse
+import os
+import time
+from datetime import datetime
+from sprof.settings import RADAR_DATA_DIR, PFV_ANALYSE_DIR
+from sprof.radar_file import search_radar_files
+from sprof.analyse import build_analyse_from_file
+from sprof.instrument import timers
+
+# ------  Main --------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Temps par étape de l'analyse des fichiers radar")
+    parser.add_argument('--dir', '-d', default=RADAR_DATA_DIR, help='Répertoire contenant les données')
+    parser.add_argument('--pattern', '-p', default="", help='Le nom du fichier contient ce pattern')
+    parser.add_argument('--ext', '-e', default="", help='Forcer l\'extention du fichier (rad ou rda)')
+    parser.add_argument('--repeat', type=int, default=1, help="Nombre d'analyses de chaque fichier")
+    parser.add_argument('--profile', action='store_true', help="Profil cProfile de chaque étape")
+    parser.add_argument('--out', default=PFV_ANALYSE_DIR, help="Répertoire des fichiers de résultats")
+    args = parser.parse_args()
+
+    prefix = os.path.join(args.out, datetime.now().strftime("%y%m%d")+"_timing")
+    jsonl_file = prefix+".jsonl"
+    if os.path.exists(jsonl_file):
+        os.remove(jsonl_file)
+
+    timers.enabled = True
+    timers.profile = args.profile
+    timers.jsonl_file = jsonl_file
+
+    files = list(search_radar_files(dir=args.dir, pattern=args.pattern, ext=args.ext))
+    start_time = time.perf_counter()
+    for i in range(args.repeat):
+        for file in files:
+            build_analyse_from_file(file)
+    print(f"\n{len(files)} fichier(s) x {args.repeat} analysé(s) en {time.perf_counter()-start_time:.2f} s")
+
+    timers.print_summary()
+    timers.export_summary(prefix+"_summary.json")
+    print(f"\nRésultats : {jsonl_file}, {prefix}_summary.json")
+    if args.profile:
+        for file in timers.dump_profiles(prefix):
+            print(f"Profil : {file}")
@@ -11,26 +11,76 @@ from sprof.radar_data import RadarData
 from sprof.sprint import Sprint
 from sprof.pfv import PFV
 from sprof.athlete import get_athlete_values
-from sprof.utils import bisect_left
-
-import matplotlib.pyplot as plt
+from sprof.utils import bisect_left, get_pyplot
+from sprof.instrument import timers
+from sprof.settings import EXPORT_TIMES, EXPORT_DISTANCES
 
 # ------ Analyse Builder ----------------------------------------------------------------
 def build_analyse_from_file(file, auto=True, outliers=True, pression=None, temp=None):
+    timers.start_file(file)
+    with timers.stage('parse'):
+        rf = RadarFile(file)
+    a = build_analyse_from_RF(rf, auto=auto, outliers=outliers, pression=pression, temp=temp)
+    timers.end_file()
+    return a
+
+def analyse_file(file, auto=True, outliers=True, pression=None, temp=None):
+    """ Analyse of the radar file, as a compact result (AnalyseResult, None if the
+        analyse failed) : the arrays of the analyse are released when it returns
+    """
+    a = build_analyse_from_file(file, auto=auto, outliers=outliers, pression=pression, temp=temp)
+    return AnalyseResult(a) if a else None
+
+def build_analyse_from_RF(rf, auto=True, outliers=True, pression=None, temp=None):
+    """ Build the analyse of an already loaded RadarFile.
+        (the same file can be analysed with several options, without reading it again)
+    """
+    with timers.stage('detect'):
+        rd = RadarData(rf.T,rf.V,rf.title, auto=auto)
+    return build_analyse_from_RD(rf, rd, outliers=outliers, pression=pression, temp=temp)
+
+def build_analyses_from_segments(rf, auto=True, outliers=True, pression=None, temp=None, chunk_size=None):
+    """ Analyses of all the sprints of a long recording (cf segmentation.py), one per
+        segment. The failed analyses are None
+    """
+    return list(iter_analyses_from_segments(rf, auto=auto, outliers=outliers, pression=pression,
+                                            temp=temp, chunk_size=chunk_size))
+
+def iter_analyses_from_segments(rf, auto=True, outliers=True, pression=None, temp=None, chunk_size=None):
+    """ Generator of the analyses of build_analyses_from_segments.
+        chunk_size : the file is read by chunks (rf built with load_data=False, cf
+        RadarFile.iter_chunks), for the recordings too long to be loaded
+    """
+    from sprof.segmentation import find_segments, iter_segments
+    if chunk_size:
+        segments = iter_segments(rf.iter_chunks(chunk_size), rf.title)
+    else:
+        with timers.stage('segment'):
+            segments = find_segments(rf.T, rf.V, rf.title)
+    for seg in segments:
+        with timers.stage('detect'):
+            rd = seg.radar_data(auto=auto)
+        yield build_analyse_from_RD(rf, rd, outliers=outliers, pression=pression, temp=temp)
+
+def build_analyse_from_RD(rf, rd, outliers=True, pression=None, temp=None):
+    """ Build the analyse of the RadarData rd, from the RadarFile rf
+    """
     a=None
-    rf = RadarFile(file)
-    rd = RadarData(rf.T,rf.V,rf.title, auto=auto)
-    
     if not(rd.data_error):
     
-        (Tsprint,Vsprint)=rd.extract_sprint()
-        s = Sprint(Tsprint, Vsprint, rd.title, outliers=outliers)
+        with timers.stage('extract'):
+            (Tsprint,Vsprint)=rd.extract_sprint()
+        with timers.stage('sprint'):
+            s = Sprint(Tsprint, Vsprint, rd.title, outliers=outliers)
+        timers.count('sprint', 'outliers', s.n_out)
     
         # Get athlete stature and mass
         # Faire une fonction dans 
-        (mass,stature)=get_athlete_values(file)
+        with timers.stage('athlete'):
+            (mass,stature)=get_athlete_values(rf.filename)
     
-        pfv = PFV(v_max=s.v_max, tau=s.tau, duration = s.duration, mass=mass, \
+        with timers.stage('pfv'):
+            pfv = PFV(v_max=s.v_max, tau=s.tau, duration = s.duration, mass=mass, \
                                     stature=stature, pression=pression,temp=temp)
                                 
         a=Analyse(radar_file=rf,radar_data=rd,sprint=s,pfv=pfv)
@@ -67,6 +117,7 @@ class Analyse:
         # same scale for all plots
         # v from 0 to 10 m/s
         # t from i start -1 to i start + 6
+        plt = get_pyplot()
 
         rd = self.radar_data
         s = self.sprint
@@ -172,6 +223,7 @@ class Analyse:
         self.print_data_quality()
 
     def plot_analyse(self):
+        plt = get_pyplot()
         plt.figure(figsize = (9, 7))
         self.plot_normalize()
         plt.legend(('V mesure','V sprint','V smooth', 'V model'))
@@ -181,6 +233,63 @@ class Analyse:
         vmax_diff=round(self.sprint.v_max-self.sprint.vs_max,2)
         return(self.sprint.title,round(self.sprint.plateau_duration,2),vmax_diff)
         #print(f"{self.sprint.title}, plateau : {self.sprint.plateau_duration:.2f}, Ecart : {vmax_diff}")
+
+    def result(self):
+        return AnalyseResult(self)
+
+# ------ AnalyseResult Class ------------------------------------------------------------
+
+class AnalyseResult:
+    """ Compact result of an analyse : scalars only, without the arrays and the objects
+        (RadarFile, RadarData, Sprint, PFV) of the Analyse
+    """
+    # PFV attributes, as PFV.simp_vars
+    PFV_FIELDS = ('v_max', 'tau', 'mass', 'duration', 'temp', 'pression', 'stature', 'drag_coef',
+                  'F0', 'V0', 'Pmax', 'F0_kg', 'Pmax_kg', 'sfv', 'RF_peak', 'DRF', 'top_speed')
+    QUALITY_FIELDS = ('points_out', 'plateau_duration', 'vmax_diff', 'curves_gap')
+    __slots__ = (('file', 'title', 'delay', 'converged', 'n_points', 'i_start_sprint', 'i_end_sprint',
+                  't_start', 't_end', 'times', 'distances') + PFV_FIELDS + QUALITY_FIELDS)
+
+    def __init__(self, a, file=None, bounds=None):
+        """ a : Analyse. file, bounds (i_start_sprint, i_end_sprint) : if the analyse
+            was built without its RadarFile, RadarData
+        """
+        s = a.sprint
+        self.file = a.radar_file.filename if a.radar_file else file
+        self.title = s.title
+        # fit and pfv
+        for name in self.PFV_FIELDS:
+            setattr(self, name, getattr(a.pfv, name))
+        self.delay = s.delay
+        self.converged = bool(s.converged) # False : bad fit, to filter
+        # sprint bounds in the recording
+        rd = a.radar_data
+        (self.i_start_sprint, self.i_end_sprint) = (rd.i_start_sprint, rd.i_end_sprint) if rd else (bounds or (0, 0))
+        self.t_start = float(s.T_sprint_in[0])
+        self.t_end = float(s.T_sprint_in[-1])
+        self.n_points = s.n
+        for name in self.QUALITY_FIELDS:
+            setattr(self, name, getattr(a, name))
+        # split times by distance, and distances by time (as the dataset : strings)
+        self.times = {distance:a.pfv.str_time_distance(distance) for distance in EXPORT_TIMES}
+        self.distances = {time:a.pfv.str_distance_time(time) for time in EXPORT_DISTANCES}
+
+    def __repr__(self):
+        return (f"AnalyseResult({self.title!r}, v_max {self.v_max:.2f} m/s, tau {self.tau:.2f} s, "
+                f"F0 {self.F0:.2f} N, V0 {self.V0:.2f} m/s)")
+
+    def values(self):
+        """ Dictionnary of the values, pfv values rounded as PFV.simp_vars, and name :
+            sprint title (dataset row values, without the splits)
+        """
+        values = {name:round(v, 2) if isinstance(v, float) else v
+                  for (name, v) in ((name, getattr(self, name)) for name in self.PFV_FIELDS)}
+        values.update({name:getattr(self, name) for name in self.QUALITY_FIELDS})
+        values['name'] = self.title
+        return values
+
+    def as_dict(self):
+        return {name:getattr(self, name) for name in self.__slots__}
         
 # ------ Main ---------------------------------------------------------------------------
 if __name__ == "__main__":
@@ -209,5 +318,25 @@ if __name__ == "__main__":
         for res in table:
             print(f"{res[0]}\t{res[1]}\t{res[2]}")
         
+    def results_memory():
+        """ Memory kept by the analyses, and by their compact results
+        python analyse.py -p ju
+        """
+        import contextlib
+        import io
+        import tracemalloc
+        files = list(params_get_files())
+        with contextlib.redirect_stdout(io.StringIO()):
+            analyse_file(files[0]) # imports and caches, not counted
+        for (name, build) in (("Analyse", build_analyse_from_file), ("AnalyseResult", analyse_file)):
+            with contextlib.redirect_stdout(io.StringIO()):
+                tracemalloc.start()
+                kept = [build(file) for file in files]
+                memory = tracemalloc.get_traced_memory()[0]
+                tracemalloc.stop()
+            print(f"{name} : {memory/1000/max(1, len(kept)):.1f} Ko par fichier")
+        print(kept[0])
+
     #analyse_many() 
+    #results_memory()
     analyse_one()
\ No newline at end of file
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*
+# python3
+# Author : LJK - Laboratoire Jean Kuntzmann - C. Bligny
+"""
+Radar files inside zip and tar archives, read without extracting them.
+
+A file of an archive is given by the archive path followed by its path in the archive :
+    /data/sessions/2019-07.zip/Juillet/Juillet Alexandre 1.rda
+and is accepted wherever a file name is (RadarFile, search_radar_files dir, dataset
+builders, ...). The members are streamed to the parser : no temporary file.
+
+The archives opened are kept, one handle per thread and per process (the members of an
+archive are read in parallel by the processes of build_PFV_DS_from_files). zip : direct
+access to each member. tar : the archive is scanned once, then the members are read in
+their order (compressed tar : no backward seek, prefer zip for the parallel analyses).
+
+    files = list_members("/data/sessions/2019-07.zip")
+    ds = build_PFV_DS_from_files(files, workers=4)
+"""
+
+import io
+import os
+import threading
+import time
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+RADAR_EXTENSIONS = ('.rad', '.rda')
+
+# ------ Paths --------------------------------------------------------------------------
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_EXTENSIONS) and os.path.isfile(path)
+
+def split_path(path):
+    """ Returns (archive, member) of a path in an archive, member : '/' separated
+        ('' for the archive itself). (None, None) if the path is not in an archive
+    """
+    path = os.path.normpath(path)
+    parts = path.split(os.sep)
+    for k in range(1, len(parts)+1):
+        archive = os.sep.join(parts[:k]) or os.sep
+        if archive.lower().endswith(ARCHIVE_EXTENSIONS) and os.path.isfile(archive):
+            return (archive, "/".join(parts[k:]))
+    return (None, None)
+
+def member_path(archive, member):
+    """ Path of the member (name in the archive) of archive
+    """
+    return os.path.join(archive, *member.split("/"))
+
+# ------ Archive Class ------------------------------------------------------------------
+
+class Archive:
+
+    def __init__(self, path):
+        """ Opens the zip or tar archive path, and lists its files
+        """
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        if path.lower().endswith('.zip'):
+            import zipfile
+            self.zip = zipfile.ZipFile(path)
+            self.tar = None
+            self.members = {info.filename.rstrip('/'):info for info in self.zip.infolist() if not info.is_dir()}
+        else:
+            import tarfile
+            self.zip = None
+            self.tar = tarfile.open(path)
+            # names without the leading "./" (tar -C dir .)
+            self.members = {(info.name[2:] if info.name.startswith("./") else info.name):info
+                            for info in self.tar.getmembers() if info.isfile()}
+        # directories, with their entries
+        self.dirs = {"":set()}
+        for name in self.members:
+            parts = name.split("/")
+            for k in range(len(parts)):
+                self.dirs.setdefault("/".join(parts[:k]), set()).add(parts[k])
+
+    def close(self):
+        (self.zip or self.tar).close()
+
+    def open(self, member):
+        """ Binary stream of the member
+        """
+        if self.zip:
+            return self.zip.open(self.members[member])
+        return self.tar.extractfile(self.members[member])
+
+    def getsize(self, member):
+        info = self.members[member]
+        return info.file_size if self.zip else info.size
+
+    def getmtime(self, member):
+        info = self.members[member]
+        return time.mktime(info.date_time+(0, 0, -1)) if self.zip else info.mtime
+
+    def listdir(self, dir=""):
+        return sorted(self.dirs.get(dir.strip("/"), ()))
+
+# archives opened, by thread : {path:Archive}
+_local = threading.local()
+
+def get_archive(path):
+    """ Returns the Archive of path, opened once per thread (again if modified)
+    """
+    archives = getattr(_local, 'archives', None)
+    if archives is None:
+        archives = _local.archives = {}
+    archive = archives.get(path)
+    if archive is None or archive.mtime != os.path.getmtime(path):
+        if archive is not None:
+            archive.close()
+        archive = archives[path] = Archive(path)
+    return archive
+
+def close_archives():
+    for archive in getattr(_local, 'archives', {}).values():
+        archive.close()
+    _local.archives = {}
+
+# ------ Files functions : files on disk, or in an archive ------------------------------
+
+def _get_member(path):
+    (archive, member) = split_path(path)
+    if archive is None:
+        return (None, None)
+    return (get_archive(archive), member)
+
+def isfile(path):
+    if os.path.isfile(path):
+        return True
+    (archive, member) = _get_member(path)
+    return archive is not None and member in archive.members
+
+def isdir(path):
+    if os.path.isdir(path):
+        return True
+    (archive, member) = _get_member(path)
+    return archive is not None and member in archive.dirs
+
+def listdir(path):
+    """ Entries of a directory, or of a directory of an archive (the archive itself :
+        its root)
+    """
+    if os.path.isdir(path):
+        return os.listdir(path)
+    (archive, member) = _get_member(path)
+    if archive is None:
+        raise FileNotFoundError(path)
+    return archive.listdir(member)
+
+def open_file(path, mode='r'):
+    """ Opens a file, or a file of an archive. mode : 'r' (text, as open) or 'rb'
+    """
+    if os.path.isfile(path):
+        return open(path, mode)
+    (archive, member) = _get_member(path)
+    if archive is None or member not in archive.members:
+        raise FileNotFoundError(path)
+    stream = archive.open(member)
+    return stream if 'b' in mode else io.TextIOWrapper(stream)
+
+def getsize(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    (archive, member) = _get_member(path)
+    return archive.getsize(member)
+
+def getmtime(path):
+    if os.path.isfile(path):
+        return os.path.getmtime(path)
+    (archive, member) = _get_member(path)
+    return archive.getmtime(member)
+
+def list_members(path, ext=RADAR_EXTENSIONS):
+    """ Paths of the files of the archive path (or of a directory of the archive, and
+        its subdirectories) with the extensions ext, in the archive order
+    """
+    (archive, member) = _get_member(path)
+    if archive is None:
+        raise FileNotFoundError(path)
+    prefix = member+"/" if member else ""
+    return [member_path(archive.path, name) for name in archive.members
+            if name.startswith(prefix) and name.endswith(ext) and not os.path.basename(name).startswith('.')]
+
+# ------ Main ---------------------------------------------------------------------------
+if __name__ == "__main__":
+    # dataset of a zip archive : extracted first, or read directly
+    # python archive.py [n_files] [workers]
+    import sys
+    import contextlib
+    import tempfile
+    import zipfile
+    from sprof.synthetic import write_corpus
+    from sprof.pfv_dataset import build_PFV_DS_from_files
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    with tempfile.TemporaryDirectory() as dir:
+        files = write_corpus(os.path.join(dir, "session"), n, seed=0, ext=('.rda',))
+        zip_file = os.path.join(dir, "session.zip")
+        with zipfile.ZipFile(zip_file, 'w', zipfile.ZIP_DEFLATED) as z:
+            for file in files:
+                z.write(file, os.path.join("session", os.path.basename(file)))
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            start_time = time.perf_counter()
+            with zipfile.ZipFile(zip_file) as z:
+                z.extractall(os.path.join(dir, "extracted"))
+            extracted = sorted(os.path.join(dir, "extracted", "session", f) for f in os.listdir(os.path.join(dir, "extracted", "session")))
+            t_extract = time.perf_counter()-start_time
+            ds_disk = build_PFV_DS_from_files(extracted, workers=workers)
+            t_disk = time.perf_counter()-start_time
+
+            start_time = time.perf_counter()
+            members = sorted(list_members(zip_file))
+            ds_zip = build_PFV_DS_from_files(members, workers=workers)
+            t_zip = time.perf_counter()-start_time
+
+        print(f"{len(members)} fichiers, {workers} processus")
+        print(f"Extraction puis analyse : {t_disk:.2f} s (extraction {t_extract:.2f} s)")
+        print(f"Lecture dans l'archive : {t_zip:.2f} s")
+        print(f"Mêmes résultats : {ds_disk.datas.equals(ds_zip.datas)}")
+        print(members[0])
@@ -10,7 +10,6 @@ name pattern.
 
 from sprof.utils import str_isin, str_eq, print_obj_attr
 from sprof.settings import ATHLETE_DATA_DIR, ATHLETE_DATA_FILE, CSV_ATHLETE_SEPARATOR
-import pandas as pd
 import os
 
 # ------ Utils --------------------------------------------------------------------------
@@ -42,9 +41,27 @@ def build_athlete(pattern):
         - if an athlete name (and only one) is included in the file name
         - insensible à la casse et aux accents ou autres caractères speciaux
     """
-    ds = AthleteDS()
+    ds = get_athlete_ds()
     a = ds.find_athlete(pattern)
     return a
+
+# athlete datasets already loaded, key : data file. value : (file mtime, dataset)
+_athlete_ds_cache = {}
+
+def get_athlete_ds(datafile=None):
+    """
+    Returns the athlete dataset, loaded only once for a given data file and kept in memory
+    (warm cache shared by all the analyses of the process).
+    The dataset is loaded again if the data file was modified.
+    """
+    if not datafile:
+        datafile = AthleteDS.DATA_FILE
+    mtime = os.path.getmtime(datafile)
+    cached = _athlete_ds_cache.get(datafile)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, AthleteDS(datafile))
+        _athlete_ds_cache[datafile] = cached
+    return cached[1]
     
 # ------ Athlete Class ------------------------------------------------------------------
 class Athlete():
@@ -95,6 +112,7 @@ class AthleteDS():
     def __init__(self, datafile=None, debug=False):
         # init the self.datas attribute as a panda dataframe containing all the athletes
         # datas
+        import pandas as pd
         
         if (datafile):
             self.datas=pd.read_csv(datafile,sep=CSV_ATHLETE_SEPARATOR)
@@ -142,6 +160,7 @@ class AthleteDS():
         Same pb will arise if an athlete get a month name (juillet), or any other string 
         included in the file name.
         """
+        import pandas as pd
         rows=[] # c'est quel type?$
         a = None
     
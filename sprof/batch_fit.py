@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*
+# python3
+# Author : LJK - Laboratoire Jean Kuntzmann - C. Bligny
+"""
+Fit the velocity model of many sprints at once.
+
+Each Sprint fits v_max*(1-exp((T[0]+delay-t)/tau)) with its own leastsq call : for a
+season of recordings, thousands of small fits. fit_batch packs the (T, V) segments into
+padded arrays (one row per segment, with a mask), and runs the same Levenberg-Marquardt
+as the compiled kernel (kernels_numba.py) on all the rows together, each row with its own
+damping and convergence flag.
+
+The sprints remove their outliers between the fits (Sprint.fit_steps) : fit_sprints runs
+the first fit of all the sprints in one batch, then the fits needed after the outliers
+removal, in smaller batches.
+
+    sprints = [Sprint(T, V, title, fit=False) for (T, V, title) in ...]
+    fit_sprints(sprints)
+"""
+
+import contextlib
+import io
+import numpy as np
+from sprof.radar_file import RadarFile
+from sprof.radar_data import RadarData
+from sprof.sprint import Sprint
+from sprof.pfv import PFV
+from sprof.athlete import get_athlete_values
+from sprof.instrument import timers
+
+MAX_ITER = 200
+TOL = 1e-12
+
+# ------ Batch Levenberg-Marquardt ------------------------------------------------------
+
+def pack(segments):
+    """ Returns the padded arrays (T, V, mask) of the segments : list of (T, V).
+        Padding : last time of the segment, velocity 0, masked
+    """
+    n = max((len(T) for (T, V) in segments), default=0)
+    T_pad = np.zeros((len(segments), n))
+    V_pad = np.zeros((len(segments), n))
+    mask = np.zeros((len(segments), n), dtype=bool)
+    for (k, (T, V)) in enumerate(segments):
+        m = len(T)
+        T_pad[k, :m] = T
+        T_pad[k, m:] = T[-1] if m else 0
+        V_pad[k, :m] = V
+        mask[k, :m] = True
+    return (T_pad, V_pad, mask)
+
+def _residuals(T, V, mask, t_start, p):
+    e = np.exp((t_start[:,None]+p[:,2,None]-T)/p[:,1,None])
+    return (e, np.where(mask, p[:,0,None]*(1-e)-V, 0))
+
+def _cost(T, V, mask, t_start, p):
+    with np.errstate(over='ignore', invalid='ignore'):
+        (e, r) = _residuals(T, V, mask, t_start, p)
+        cost = np.sum(r*r, axis=1)
+    return np.where((p[:,1] > 0) & np.isfinite(cost), cost, np.inf)
+
+def _solve(M, b):
+    """ Solutions of the 3x3 systems M x = b. Singular systems : NaN
+    """
+    x = np.full(b.shape, np.nan)
+    det = np.linalg.det(M)
+    ok = np.isfinite(det) & (det != 0)
+    if ok.any():
+        x[ok] = np.linalg.solve(M[ok], b[ok][...,None])[...,0]
+    return x
+
+def fit_batch(segments, v_max=8.0, tau=1.0, delay=0.0, max_iter=MAX_ITER, tol=TOL):
+    """ Fit the velocity model on all the segments : list of (T, V) arrays.
+        Returns (v_max, tau, delay, converged) arrays, one value per segment.
+        converged : False if max_iter was reached, or if the fit stopped without progress
+        (singular normal equations, damping above 1e12) : bad fits, to filter
+    """
+    k = len(segments)
+    if k == 0:
+        return (np.empty(0), np.empty(0), np.empty(0), np.empty(0, dtype=bool))
+    (T, V, mask) = pack(segments)
+    t_start = T[:,0]
+    p = np.tile(np.array([v_max, tau, delay], dtype=float), (k, 1))
+    cost = _cost(T, V, mask, t_start, p)
+    lam = np.full(k, 1e-3)
+    done = np.zeros(k, dtype=bool)
+    converged = np.zeros(k, dtype=bool)
+    update = np.ones(k, dtype=bool) # rows whose normal equations must be computed
+    iterations = np.zeros(k, dtype=int) # accepted steps
+    A = np.zeros((k, 3, 3))
+    g = np.zeros((k, 3))
+
+    # each step is accepted, or rejected with more damping (24 times at most in a row)
+    for it in range(max_iter*25):
+        active = ~done
+        if not active.any():
+            break
+        # normal equations J^T J, J^T r, for the rows whose params changed
+        rows = np.flatnonzero(update & active)
+        if len(rows):
+            pr = p[rows]
+            with np.errstate(over='ignore', invalid='ignore'):
+                (e, r) = _residuals(T[rows], V[rows], mask[rows], t_start[rows], pr)
+                u = (t_start[rows,None]+pr[:,2,None]-T[rows])/pr[:,1,None]
+                # jacobian columns (masked : e, r are 0 on the padding)
+                e = np.where(mask[rows], e, 0)
+                J = (np.where(mask[rows], 1-e, 0), pr[:,0,None]*e*u/pr[:,1,None], -pr[:,0,None]*e/pr[:,1,None])
+            for a in range(3):
+                g[rows,a] = np.sum(J[a]*r, axis=1)
+                for b in range(a, 3):
+                    A[rows,a,b] = A[rows,b,a] = np.sum(J[a]*J[b], axis=1)
+            update[rows] = False
+
+        # one damped step for each active row
+        rows = np.flatnonzero(active)
+        M = A[rows].copy()
+        M[:, (0,1,2), (0,1,2)] += lam[rows,None]*A[rows][:, (0,1,2), (0,1,2)]
+        step = _solve(M, -g[rows])
+        singular = np.isnan(step).any(axis=1)
+        q = p[rows]+np.nan_to_num(step)
+        new_cost = _cost(T[rows], V[rows], mask[rows], t_start[rows], q)
+        accept = ~singular & (new_cost <= cost[rows])
+
+        # accepted : new params, less damping. Converged if no more progress
+        acc = rows[accept]
+        small = ((cost[acc]-new_cost[accept] <= tol*cost[acc]) |
+                 (np.abs(step[accept]).max(axis=1) <= tol*(np.abs(q[accept]).max(axis=1)+tol)))
+        p[acc] = q[accept]
+        cost[acc] = new_cost[accept]
+        lam[acc] = np.maximum(lam[acc]/10, 1e-12)
+        update[acc] = True
+        converged[acc[small]] = True
+        done[acc[small]] = True
+
+        # rejected : more damping, same normal equations. Stalled or singular : stopped,
+        # not converged
+        rej = rows[~accept & ~singular]
+        lam[rej] *= 10
+        done[rej[lam[rej] > 1e12]] = True
+        done[rows[singular]] = True
+
+        iterations[acc] += 1
+        over = np.flatnonzero(~done & (iterations >= max_iter))
+        done[over] = True
+
+    return (p[:,0], p[:,1], p[:,2], converged)
+
+# ------ Sprints ------------------------------------------------------------------------
+
+def fit_sprints(sprints):
+    """ Fit the model of the sprints built with fit=False, removing the outliers as
+        Sprint does (outliers option of each sprint) : the fits of the same step run in
+        one batch. Returns the converged flags of the last fit of each sprint (also set
+        as Sprint.converged)
+    """
+    steps = {}
+    requests = {}
+    converged = np.zeros(len(sprints), dtype=bool)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for (k, s) in enumerate(sprints):
+            if s.n == 0:
+                continue
+            steps[k] = s.fit_steps(s.outliers)
+            requests[k] = next(steps[k])
+        while requests:
+            keys = list(requests)
+            with timers.stage('fit'):
+                (v_max, tau, delay, conv) = fit_batch([requests[k] for k in keys])
+            requests = {}
+            for (j, k) in enumerate(keys):
+                converged[k] = sprints[k].converged = bool(conv[j])
+                try:
+                    requests[k] = steps[k].send((v_max[j], tau[j], delay[j]))
+                except StopIteration:
+                    pass
+    return converged
+
+def build_analyses_from_RFs(rfs, auto=True, outliers=True, pression=None, temp=None):
+    """ As analyse.build_analyse_from_RF, for all the RadarFile rfs, with the sprints
+        fitted together. Returns the list of the analyses (None if the analyse failed)
+    """
+    from sprof.analyse import Analyse
+    items = []
+    for rf in rfs:
+        with timers.stage('detect'):
+            rd = RadarData(rf.T, rf.V, rf.title, auto=auto)
+        s = None
+        if not rd.data_error:
+            with timers.stage('extract'):
+                (T, V) = rd.extract_sprint()
+            with timers.stage('sprint'):
+                s = Sprint(T, V, rd.title, outliers=outliers, fit=False)
+        items.append((rf, rd, s))
+
+    fit_sprints([s for (rf, rd, s) in items if s is not None])
+
+    analyses = []
+    for (rf, rd, s) in items:
+        if s is None:
+            analyses.append(None)
+            continue
+        timers.count('sprint', 'outliers', s.n_out)
+        with timers.stage('athlete'):
+            (mass, stature) = get_athlete_values(rf.filename)
+        with timers.stage('pfv'):
+            pfv = PFV(v_max=s.v_max, tau=s.tau, duration=s.duration, mass=mass,
+                      stature=stature, pression=pression, temp=temp)
+        analyses.append(Analyse(radar_file=rf, radar_data=rd, sprint=s, pfv=pfv))
+    return analyses
+
+def build_results_from_files(files, auto=True, outliers=True, pression=None, temp=None):
+    """ As build_analyses_from_RFs, for the radar files, returning compact results
+        (analyse.AnalyseResult, None if the analyse failed). Only the sprints are kept
+        until the fit : the RadarFile and RadarData are released after the detection,
+        each sprint after its result
+    """
+    from sprof.analyse import Analyse, AnalyseResult
+    items = []
+    for file in files:
+        with timers.stage('parse'):
+            rf = RadarFile(file)
+        with timers.stage('detect'):
+            rd = RadarData(rf.T, rf.V, rf.title, auto=auto)
+        s = None
+        if not rd.data_error:
+            with timers.stage('extract'):
+                (T, V) = rd.extract_sprint()
+            with timers.stage('sprint'):
+                s = Sprint(T, V, rd.title, outliers=outliers, fit=False)
+        items.append((file, (rd.i_start_sprint, rd.i_end_sprint), s))
+
+    fit_sprints([s for (file, bounds, s) in items if s is not None])
+
+    results = []
+    for (k, (file, bounds, s)) in enumerate(items):
+        items[k] = None
+        if s is None:
+            results.append(None)
+            continue
+        timers.count('sprint', 'outliers', s.n_out)
+        with timers.stage('athlete'):
+            (mass, stature) = get_athlete_values(file)
+        with timers.stage('pfv'):
+            pfv = PFV(v_max=s.v_max, tau=s.tau, duration=s.duration, mass=mass,
+                      stature=stature, pression=pression, temp=temp)
+        results.append(AnalyseResult(Analyse(sprint=s, pfv=pfv), file=file, bounds=bounds))
+    return results
+
+# ------ Main ---------------------------------------------------------------------------
+if __name__ == "__main__":
+    # compare to the fit of each sprint, on synthetic sprints
+    # python batch_fit.py [n]
+    import sys
+    import time
+    from sprof.synthetic import random_params, generate
+    from sprof.kernels import NUMPY_KERNELS
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    (T, V, out) = generate(random_params(n, seed=0), seed=0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        sprints_in = []
+        for k in range(n):
+            rd = RadarData(T, V[k], f"synth {k}")
+            if not rd.data_error:
+                sprints_in.append(rd.extract_sprint())
+        start_time = time.perf_counter()
+        sprints = [Sprint(Ts, Vs, outliers=True) for (Ts, Vs) in sprints_in]
+        t_one = time.perf_counter()-start_time
+        start_time = time.perf_counter()
+        batch = [Sprint(Ts, Vs, outliers=True, fit=False) for (Ts, Vs) in sprints_in]
+        converged = fit_sprints(batch)
+        t_batch = time.perf_counter()-start_time
+
+    diff = np.array([[abs(a.v_max-b.v_max), abs(a.tau-b.tau), abs(a.delay-b.delay)] for (a, b) in zip(sprints, batch)])
+    print(f"{len(sprints)} sprints : un par un {t_one:.2f} s, en batch {t_batch:.2f} s")
+    print(f"Convergence : {converged.sum()}/{len(converged)}. Ecart max v_max {diff[:,0].max():.2e}, tau {diff[:,1].max():.2e}, delay {diff[:,2].max():.2e}")
+    print(f"Points aberrants différents : {sum(a.n_out != b.n_out for (a, b) in zip(sprints, batch))}")
+
+    # fit only, one step
+    segments = [(s.T_sprint_acc, s.V_sprint_acc) for s in sprints]
+    start_time = time.perf_counter()
+    one = [NUMPY_KERNELS['fit_velocity'](*seg) for seg in segments]
+    t_one = time.perf_counter()-start_time
+    start_time = time.perf_counter()
+    (v_max, tau, delay, converged) = fit_batch(segments)
+    t_batch = time.perf_counter()-start_time
+    print(f"Fit seul : leastsq {t_one*1000:.1f} ms, batch {t_batch*1000:.1f} ms, écart max v_max "
+          f"{max(abs(o[0]-v) for (o, v) in zip(one, v_max)):.2e}")
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*
+# python3
+# Author : LJK - Laboratoire Jean Kuntzmann - C. Bligny
+"""
+Sensitivity of the results to the sprint bounds, used by move_bound.py.
+
+The results (v_max, tau, V0, F0_kg, Pmax_kg, sfv) are computed in a background process
+for a lattice of sprint start and end of acceleration around the automatic bounds, so
+they are available at once while the bounds are dragged.
+
+Lattice keys are radar data indexes, as the bounds are set by sample (bisect_left) :
+    - i_start : sprint start index (RadarData.set_i_start_sprint)
+    - k_end : index of the last point before the end of acceleration time, None for the
+      end computed by Sprint
+The rows (one per start) closest to the automatic start are computed first. A missing
+point can be computed directly (add), and the lattice moved around new bounds (refine).
+"""
+
+import contextlib
+import copy
+import io
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from sprof.sprint import Sprint
+from sprof.pfv import PFV
+from sprof.utils import bisect_left
+
+# lattice half size, in radar data points
+LATTICE_START_POINTS = 15
+LATTICE_END_POINTS = 25
+
+VALUES = ('v_max', 'tau', 'V0', 'F0_kg', 'Pmax_kg', 'sfv')
+
+# ------ Computation, in the worker process ---------------------------------------------
+
+def get_index(T, t):
+    """ Lattice index for the time t : last point before t (as set by the bounds)
+    """
+    return bisect_left(T, t)
+
+def get_index_time(T, k):
+    """ A time giving the lattice index k
+    """
+    if k+1 < len(T):
+        return (T[k]+T[k+1])/2
+    return T[k]+(T[k]-T[k-1])/2
+
+def get_values(s, mass, stature):
+    """ Returns the results of the sprint s, as a dictionnary
+    """
+    # same PFV parameters as MoveBound
+    p = PFV(v_max=s.v_max, tau=s.tau, duration=4, mass=mass, stature=stature, pression=760)
+    return {'v_max':s.v_max, 'tau':s.tau, 'V0':p.V0, 'F0_kg':p.F0_kg, 'Pmax_kg':p.Pmax_kg, 'sfv':p.sfv}
+
+def build_sprint(radar_data, i_start):
+    """ Sprint of the radar data, starting at i_start
+    """
+    rd = copy.copy(radar_data)
+    rd.set_i_start_sprint(i_start)
+    (T, V) = rd.extract_sprint()
+    return Sprint(T, V, rd.title)
+
+def set_end(s, T, k_end):
+    """ Returns a copy of the sprint s, with the end of acceleration k_end
+    """
+    if k_end is None:
+        return s
+    s = copy.copy(s)
+    s.set_end_acc(get_index_time(T, k_end))
+    return s
+
+def compute_row(radar_data, i_start, k_ends, mass, stature):
+    """ Returns (i_start, {k_end : values}) for all the end of acceleration k_ends
+    """
+    row = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        s = build_sprint(radar_data, i_start)
+        for k_end in (None,)+tuple(k_ends):
+            row[k_end] = get_values(set_end(s, radar_data.T, k_end), mass, stature)
+    return (i_start, row)
+
+# ------ BoundLattice Class -------------------------------------------------------------
+
+class BoundLattice:
+
+    def __init__(self, radar_data, i_end, mass=None, stature=None):
+        """ radar_data : with the automatic sprint start. i_end : radar data index of the
+            end of acceleration
+        """
+        self.rd = radar_data
+        self.mass = mass
+        self.stature = stature
+        self.values = {} # (i_start, k_end) : values
+        self.submitted = set() # keys sent to the background process
+        self.lock = threading.Lock()
+        self.executor = None
+        self.center = (radar_data.i_start_sprint, i_end)
+
+    def start(self):
+        # spawn : no copy of the parent (matplotlib figures ...)
+        ctx = multiprocessing.get_context('spawn')
+        self.executor = ProcessPoolExecutor(max_workers=1, mp_context=ctx)
+        self.refine(*self.center)
+
+    def stop(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def refine(self, i_start, i_end):
+        """ Compute the lattice around (i_start, i_end), closest rows first
+        """
+        if not self.executor:
+            return
+        n = self.rd.n
+        starts = sorted(range(max(0, i_start-LATTICE_START_POINTS), min(n, i_start+LATTICE_START_POINTS+1)),
+                        key=lambda i: abs(i-i_start))
+        k_ends = [k for k in range(i_end-LATTICE_END_POINTS, i_end+LATTICE_END_POINTS+1) if 0 < k < n]
+        for i in starts:
+            missing = [k for k in k_ends if (i, k) not in self.submitted]
+            if missing or (i, None) not in self.submitted:
+                self.submitted.update((i, k) for k in [None]+missing)
+                try:
+                    future = self.executor.submit(compute_row, self.rd, i, missing, self.mass, self.stature)
+                except RuntimeError as error:
+                    # broken pool : the values will be computed when needed
+                    print(f"ERREUR calcul des bornes en arrière plan : {error!r}")
+                    self.executor = None
+                    return
+                future.add_done_callback(self._add_row)
+
+    def _add_row(self, future):
+        if future.cancelled() or future.exception():
+            return
+        (i_start, row) = future.result()
+        with self.lock:
+            for (k_end, values) in row.items():
+                self.values[(i_start, k_end)] = values
+
+    def add(self, i_start, k_end, values):
+        with self.lock:
+            self.values[(i_start, k_end)] = values
+        self.submitted.add((i_start, k_end))
+
+    def lookup(self, i_start, k_end):
+        """ Returns (values, exact) : the values of the lattice point, or of the nearest
+            computed point (exact=False). (None, False) if nothing computed yet.
+        """
+        with self.lock:
+            if (i_start, k_end) in self.values:
+                return (self.values[(i_start, k_end)], True)
+            if not self.values:
+                return (None, False)
+            # nearest point, same kind of end (computed or set)
+            keys = [key for key in self.values if (key[1] is None) == (k_end is None)] or list(self.values)
+            key = min(keys, key=lambda key: abs(key[0]-i_start)+abs((key[1] or 0)-(k_end or 0)))
+            return (self.values[key], False)
+
+# ------ Main ---------------------------------------------------------------------------
+if __name__ == "__main__":
+    # compute a lattice, and check some points
+    # python bound_lattice.py -p alex1
+    import time
+    from sprof.radar_file import params_get_file
+    from sprof.radar_data import build_RD_from_file
+    from sprof.athlete import get_athlete_values
+
+    rd = build_RD_from_file(params_get_file())
+    (mass, stature) = get_athlete_values(rd.title)
+    s = build_sprint(rd, rd.i_start_sprint)
+    i_end = get_index(rd.T, s.T_sprint[s.i_end_acc])
+
+    lattice = BoundLattice(rd, i_end, mass, stature)
+    start_time = time.time()
+    lattice.start()
+    while len(lattice.values) < (2*LATTICE_START_POINTS+1)*(2*LATTICE_END_POINTS+2):
+        time.sleep(0.5)
+        print(f"{time.time()-start_time:.1f} s : {len(lattice.values)} points")
+    lattice.stop()
+
+    # compare to a direct computation
+    for (i, k) in ((rd.i_start_sprint, None), (rd.i_start_sprint+3, i_end-5), (rd.i_start_sprint-2, i_end+7)):
+        (values, exact) = lattice.lookup(i, k)
+        direct = get_values(set_end(build_sprint(rd, i), rd.T, k), mass, stature)
+        print(f"start {i}, end {k} : {values == direct}, F0 {values['F0_kg']:.2f} (direct {direct['F0_kg']:.2f})")
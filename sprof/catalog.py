@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*
+# python3
+# Author : LJK - Laboratoire Jean Kuntzmann - C. Bligny
+"""
+Persistent catalog of the radar files (SQLite), for one or more directory trees.
+
+search_radar_files lists the directory and simplifies every file name at each call. The
+catalog keeps, for each radar file (.rad, .rda) :
+    - athlete : normalized name token (simplified file name without the trial number)
+    - trial : trial number, ending the file name (several digits allowed)
+    - search_name : simplified file name with its extension, where the search patterns
+      are searched, as search_radar_files
+    - title, date (yyyy-mm-dd hh:mm:ss), sample rate and points number (estimated from
+      the file size : only the header is read, RadarFile header_only)
+    - file mtime and size
+and each directory mtime. refresh only lists the directories whose mtime changed (file
+added, removed or renamed), and reads the new or modified files of these directories.
+A file rewritten in place does not change its directory mtime : refresh(full=True).
+
+The queries are answered from the index :
+    catalog = RadarCatalog()
+    catalog.refresh(dir)
+    files = catalog.search("alex12", root=dir)    # "alex" in the file name, and trial 12
+    files = catalog.search(athlete="alex", date_from="2019-07-01")
+"""
+
+import os
+import re
+import sqlite3
+from datetime import datetime
+from sprof.utils import str_simplify
+from sprof.settings import CATALOG_FILE
+
+RADAR_EXTENSIONS = ('.rad', '.rda')
+SCHEMA_VERSION = 2
+READ_WORKERS = 8 # threads reading the files headers
+
+# file name : athlete part, and trial number at the end
+TRIAL_REGEX = re.compile(r"^(.*?)\s*(\d+)$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    ext TEXT NOT NULL,
+    simple_name TEXT NOT NULL,
+    search_name TEXT NOT NULL,
+    athlete TEXT NOT NULL,
+    trial INTEGER,
+    title TEXT,
+    date TEXT,
+    sample_rate REAL,
+    n_points INTEGER,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+CREATE INDEX IF NOT EXISTS files_athlete ON files (athlete, trial);
+CREATE INDEX IF NOT EXISTS files_date ON files (date);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+CREATE TABLE IF NOT EXISTS athletes (
+    athlete TEXT PRIMARY KEY
+);
+"""
+
+# ------ Names and metadata -------------------------------------------------------------
+
+def parse_name(name):
+    """ Returns (simplified name, athlete token, trial number or None) of a file name,
+        without extension. Ex : "Juillet Alexandre 12" -> ("juillet alexandre 12",
+        "juillet alexandre", 12)
+    """
+    simple_name = " ".join(str_simplify(name).split())
+    match = TRIAL_REGEX.match(simple_name)
+    if match:
+        return (simple_name, match.group(1), int(match.group(2)))
+    return (simple_name, simple_name, None)
+
+def parse_pattern(pattern):
+    """ Returns (simplified pattern, trial or None) of a search pattern, as
+        search_radar_files : "alex2" -> ("alex", 2), "e 1" -> ("e ", 1). Several digits :
+        trial number ("alex12" -> ("alex", 12))
+    """
+    match = re.match(r"^(.*?)(\d+)$", pattern)
+    if match:
+        return (str_simplify(match.group(1)), int(match.group(2)))
+    return (str_simplify(pattern), None)
+
+def format_date(date):
+    """ RadarFile date (header string or datetime) as "yyyy-mm-dd hh:mm:ss"
+    """
+    if isinstance(date, datetime):
+        return date.strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        return datetime.strptime(date, "%m/%d/%Y - %H:%M:%S").strftime("%Y-%m-%d %H:%M:%S")
+    except (TypeError, ValueError):
+        return None
+
+def read_metadata(paths, workers=None):
+    """ Returns the catalog values read in the header of the radar files : title, date,
+        sample_rate, n_points (one dictionnary per file)
+    """
+    from sprof.radar_file import read_metadata as read_headers
+    values = read_headers(paths, workers)
+    for v in values:
+        v['date'] = format_date(v['date'])
+    return values
+
+# ------ RadarCatalog Class -------------------------------------------------------------
+
+class RadarCatalog:
+
+    def __init__(self, db_file=None):
+        """ db_file : SQLite file (default : settings CATALOG_FILE). ":memory:" : not
+            persistent
+        """
+        self.db_file = db_file or CATALOG_FILE
+        if self.db_file != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_file)), exist_ok=True)
+        self.db = sqlite3.connect(self.db_file)
+        self._init_schema()
+
+    def _init_schema(self):
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            # older catalog : built again
+            self.db.executescript("DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS dirs; DROP TABLE IF EXISTS athletes;")
+            self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    # ------ Refresh ----------------------------------------------------------------------
+
+    def refresh(self, root, recursive=True, full=False, workers=READ_WORKERS):
+        """ Update the catalog for the directory root (and its subdirectories if
+            recursive). Returns the number of files read. workers : number of threads
+            reading the headers of the new files
+        """
+        root = os.path.abspath(root)
+        n_read = 0
+        dirs = [(root, None)]
+        with self.db:
+            while dirs:
+                (path, parent) = dirs.pop()
+                try:
+                    mtime = os.stat(path).st_mtime
+                except OSError:
+                    self._remove_dir(path)
+                    continue
+                row = self.db.execute("SELECT mtime FROM dirs WHERE path=?", (path,)).fetchone()
+                if row and row[0] == mtime and not full:
+                    # not changed : same files and subdirectories
+                    subdirs = [r[0] for r in self.db.execute("SELECT path FROM dirs WHERE parent=?", (path,))]
+                else:
+                    (n, subdirs) = self._refresh_dir(path, full, workers)
+                    n_read += n
+                    self.db.execute("INSERT OR REPLACE INTO dirs (path, parent, mtime) VALUES (?, ?, ?)",
+                                    (path, parent, mtime))
+                if recursive:
+                    dirs += [(subdir, path) for subdir in subdirs]
+        return n_read
+
+    def _refresh_dir(self, path, full=False, workers=None):
+        """ Lists the directory path : updates its files, and the subdirectories.
+            Returns (number of files read, subdirectories)
+        """
+        known = {r[0]:(r[1], r[2]) for r in self.db.execute("SELECT path, mtime, size FROM files WHERE dir=?", (path,))}
+        found = set()
+        subdirs = []
+        new = [] # (path, name, ext, stat)
+        with os.scandir(path) as entries:
+            for entry in entries:
+                # hidden files (windows ...) ignored, as search_radar_files
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    subdirs.append(entry.path)
+                    continue
+                (name, ext) = os.path.splitext(entry.name)
+                if ext not in RADAR_EXTENSIONS:
+                    continue
+                found.add(entry.path)
+                stat = entry.stat()
+                if not full and known.get(entry.path) == (stat.st_mtime, stat.st_size):
+                    continue
+                new.append((entry.path, name, ext, stat))
+        # headers read in parallel (file system bound)
+        metadata = read_metadata([file for (file, name, ext, stat) in new], workers)
+        for ((file, name, ext, stat), values) in zip(new, metadata):
+            (simple_name, athlete, trial) = parse_name(name)
+            self.db.execute("INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                            (file, path, name, ext, simple_name, str_simplify(name+ext), athlete, trial,
+                             values['title'], values['date'], values['sample_rate'], values['n_points'],
+                             stat.st_mtime, stat.st_size))
+            self.db.execute("INSERT OR IGNORE INTO athletes VALUES (?)", (athlete,))
+        self.db.executemany("DELETE FROM files WHERE path=?", [(p,) for p in known if p not in found])
+        # subdirectories removed
+        for (subdir,) in self.db.execute("SELECT path FROM dirs WHERE parent=?", (path,)).fetchall():
+            if subdir not in subdirs:
+                self._remove_dir(subdir)
+        return (len(new), subdirs)
+
+    def _remove_dir(self, path):
+        """ Removes the directory, its files and subdirectories from the catalog
+        """
+        for (subdir,) in self.db.execute("SELECT path FROM dirs WHERE parent=?", (path,)).fetchall():
+            self._remove_dir(subdir)
+        self.db.execute("DELETE FROM files WHERE dir=?", (path,))
+        self.db.execute("DELETE FROM dirs WHERE path=?", (path,))
+
+    # ------ Queries ----------------------------------------------------------------------
+
+    def search(self, pattern="", ext=None, root=None, recursive=True, athlete=None, trial=None,
+               date_from=None, date_to=None):
+        """ Returns the sorted list of the files :
+            - pattern : as search_radar_files. Simplified pattern in the simplified file
+              name (extension included), and trial number if the pattern ends with
+              digits ("alex2", "e 1"). Several digits : trial number ("alex12"), where
+              search_radar_files only compared the last digit
+            - ext : '.rad', '.rda', or None for both
+            - root : in this directory (and subdirectories if recursive)
+            - athlete : simplified pattern in the athlete token
+            - trial : trial number
+            - date_from, date_to : "yyyy-mm-dd[ hh:mm:ss]", included
+        Files without trial number match all the trials, as search_radar_files
+        """
+        (where, args) = ([], [])
+        if pattern:
+            (pattern, pattern_trial) = parse_pattern(pattern)
+            if pattern:
+                where.append("instr(search_name, ?) > 0")
+                args.append(pattern)
+            if pattern_trial is not None and trial is None:
+                trial = pattern_trial
+        # athlete : searched in the (few) athlete tokens, then files by the index
+        if athlete:
+            where.append("athlete IN (SELECT athlete FROM athletes WHERE instr(athlete, ?) > 0)")
+            args.append(" ".join(str_simplify(athlete).split()))
+        if trial is not None:
+            where.append("(trial IS NULL OR trial = ?)")
+            args.append(int(trial))
+        if ext:
+            where.append("ext = ?")
+            args.append(ext if ext.startswith('.') else '.'+ext)
+        if root:
+            root = os.path.abspath(root)
+            if recursive:
+                # dirs starting with root/ : range on the index
+                where.append("(dir = ? OR (dir >= ? AND dir < ?))")
+                args += [root, root+os.sep, root+chr(ord(os.sep)+1)]
+            else:
+                where.append("dir = ?")
+                args.append(root)
+        if date_from:
+            where.append("date >= ?")
+            args.append(date_from)
+        if date_to:
+            # date only : the whole day
+            where.append("date <= ?")
+            args.append(date_to if len(date_to) > 10 else date_to+" 99")
+        query = "SELECT path FROM files"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        return [r[0] for r in self.db.execute(query+" ORDER BY path", args)]
+
+    def get(self, path):
+        """ Returns the catalog values of a file, as a dictionnary (None if not found)
+        """
+        cursor = self.db.execute("SELECT * FROM files WHERE path=?", (os.path.abspath(path),))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([c[0] for c in cursor.description], row))
+
+# catalog shared by the searches of the process. False : disabled or not available
+_catalog = None
+
+def get_catalog():
+    """ Returns the catalog of the settings file (CATALOG_FILE), None if disabled or
+        not available. Opened once : not retried after a failure
+    """
+    global _catalog
+    if _catalog is None:
+        _catalog = False
+        if CATALOG_FILE:
+            try:
+                _catalog = RadarCatalog(CATALOG_FILE)
+            except (sqlite3.Error, OSError) as error:
+                print(f"WARNING : catalogue des fichiers radar non disponible ({error!r})")
+    return _catalog if _catalog is not False else None
+
+# ------ Main ---------------------------------------------------------------------------
+if __name__ == "__main__":
+    # build a catalog of a synthetic archive, and time the refresh and the searches
+    # python catalog.py [n_files]
+    import sys
+    import tempfile
+    import time
+    from sprof.synthetic import write_corpus
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    with tempfile.TemporaryDirectory() as dir:
+        # athletes in subdirectories, and several trials
+        for k in range(4):
+            write_corpus(os.path.join(dir, f"session{k}"), n//4, prefix=f"Athlete{k}", seed=k, ext=('.rda',))
+        catalog = RadarCatalog(os.path.join(dir, "catalog.sqlite"))
+        for title in ("création", "sans changement"):
+            start_time = time.perf_counter()
+            n_read = catalog.refresh(dir)
+            print(f"Refresh {title} : {n_read} fichiers lus, {(time.perf_counter()-start_time)*1000:.1f} ms")
+        os.remove(os.path.join(dir, "session1", "Athlete1 000001 1.rda"))
+        start_time = time.perf_counter()
+        catalog.refresh(dir)
+        print(f"Refresh après suppression : {len(catalog)} fichiers, {(time.perf_counter()-start_time)*1000:.1f} ms")
+
+        for (title, kwargs) in (("athlete2", {'athlete':"athlete2"}),
+                                ("motif 'athlete3 000012 1'", {'pattern':"athlete3 000012 1"}),
+                                ("essai 1, date du jour", {'trial':1, 'date_from':datetime.now().strftime("%Y-%m-%d")})):
+            start_time = time.perf_counter()
+            files = catalog.search(**kwargs)
+            print(f"Recherche {title} : {len(files)} fichiers, {(time.perf_counter()-start_time)*1000:.2f} ms")
+        catalog.close()
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*
+# python3
+# Author : LJK - Laboratoire Jean Kuntzmann - C. Bligny
+"""
+Corpus of radar recordings stored as binary arrays, for the studies over many sessions.
+
+Loading thousands of small text files just to get their V arrays parses them again each
+time. A RadarCorpus stores all the recordings of a list of files in a directory :
+    T.npy, V.npy : concatenated times and velocities (V : float64, or float32), written
+        in place file by file (memory mapped, sized from the headers)
+    offsets.npy : first point of each recording, and the points number at the end
+    metadata.npy : one row per recording (file, title, date, sample rate, points
+        number, sprint bounds found by RadarData on the stored V, -1 if no sprint)
+The arrays are memory mapped : opening the corpus reads nothing, and the recordings
+read come from the page cache. The T, V arrays of a recording are views (no copy) :
+    corpus = build_corpus_from_dir(data_dir, corpus_dir)
+    corpus = RadarCorpus(corpus_dir)
+    (T, V) = corpus[k]
+    rd = corpus.radar_data(k)
+    v_max = corpus.reduce(np.maximum)
+"""
+
+import contextlib
+import io
+import os
+import numpy as np
+
+# 'U' : sized to the longest value of the corpus (get_metadata_dtype)
+METADATA_DTYPE = [('file', 'U'), ('title', 'U'), ('date', 'U19'), ('sample_rate', 'f8'),
+                  ('n', 'i8'), ('i_start_sprint', 'i8'), ('i_end_sprint', 'i8'), ('vs_max', 'f8')]
+COPY_BLOCK = 1 << 20 # points copied at once when the corpus arrays are resized
+
+# ------ Builders -----------------------------------------------------------------------
+
+def get_metadata_dtype(metadata):
+    """ METADATA_DTYPE, the 'U' fields sized to the longest values of metadata (list
+        of rows) : no truncated file or title
+    """
+    return [(name, f"U{max([len(row[i]) for row in metadata], default=0) or 1}") if type == 'U' else (name, type)
+            for (i, (name, type)) in enumerate(METADATA_DTYPE)]
+
+def _resize(file, array, n):
+    """ Corpus array file (array : its memmap) resized to n points, copied by blocks
+        in a new file. Returns the new memmap
+    """
+    resized = np.lib.format.open_memmap(file+'.tmp', mode='w+', dtype=array.dtype, shape=(n,))
+    for first in range(0, min(n, len(array)), COPY_BLOCK):
+        end = min(first+COPY_BLOCK, n, len(array))
+        resized[first:end] = array[first:end]
+    resized.flush()
+    os.replace(file+'.tmp', file)
+    return resized
+
+def build_corpus(files, dir, dtype=np.float64, detect=True):
+    """ Reads the radar files, and writes their corpus in dir. Returns the RadarCorpus.
+        dtype : velocities type (float32 : half size). detect : sprint bounds found by
+        RadarData (auto) on the stored arrays, as radar_data, else -1.
+        One recording in memory at a time : T and V are written in place, sized from
+        the points numbers of the headers (n_estimate), and resized if the estimate of
+        a .rad file was wrong
+    """
+    from sprof.radar_file import RadarFile, read_metadata
+    from sprof.radar_data import RadarData
+    from sprof.catalog import format_date
+    files = list(files)
+    os.makedirs(dir, exist_ok=True)
+    (T_file, V_file) = (os.path.join(dir, 'T.npy'), os.path.join(dir, 'V.npy'))
+    offsets = [0]
+    metadata = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        capacity = sum(m['n_points'] for m in read_metadata(files))
+        T_corpus = np.lib.format.open_memmap(T_file, mode='w+', dtype=np.float64, shape=(capacity,))
+        V_corpus = np.lib.format.open_memmap(V_file, mode='w+', dtype=dtype, shape=(capacity,))
+        for file in files:
+            rf = RadarFile(file)
+            if rf.n == 0:
+                continue
+            (T, V) = (np.asarray(rf.T, dtype=np.float64), np.asarray(rf.V, dtype=dtype))
+            (first, end) = (offsets[-1], offsets[-1]+len(V))
+            if end > capacity:
+                capacity = max(end, capacity+capacity//2)
+                T_corpus = _resize(T_file, T_corpus, capacity)
+                V_corpus = _resize(V_file, V_corpus, capacity)
+            T_corpus[first:end] = T
+            V_corpus[first:end] = V
+            offsets.append(end)
+            (i_start, i_end, vs_max) = (-1, -1, 0.0)
+            if detect:
+                rd = RadarData(T, V, rf.title)
+                if not rd.data_error:
+                    (i_start, i_end, vs_max) = (rd.i_start_sprint, rd.i_end_sprint, rd.vs_max)
+            metadata.append((file, rf.title, format_date(rf.date) or "", rf.sample_rate, rf.n,
+                             i_start, i_end, vs_max))
+
+    if offsets[-1] != capacity:
+        T_corpus = _resize(T_file, T_corpus, offsets[-1])
+        V_corpus = _resize(V_file, V_corpus, offsets[-1])
+    T_corpus.flush()
+    V_corpus.flush()
+    del T_corpus, V_corpus
+    np.save(os.path.join(dir, 'offsets.npy'), np.array(offsets, dtype=np.int64))
+    np.save(os.path.join(dir, 'metadata.npy'), np.array(metadata, dtype=get_metadata_dtype(metadata)))
+    return RadarCorpus(dir)
+
+def build_corpus_from_dir(data_dir, dir, ext="", dtype=np.float64, detect=True):
+    """ Corpus of the radar files of data_dir (directory, or zip/tar archive). ext :
+        '.rda' (default) or '.rad'
+    """
+    from sprof.radar_file import search_radar_files
+    return build_corpus(sorted(search_radar_files(data_dir, ext=ext)), dir, dtype, detect)
+
+def build_corpus_from_catalog(dir, catalog=None, dtype=np.float64, detect=True, **search):
+    """ Corpus of the files of the catalog (default : settings catalog) found by
+        catalog.search(**search), ex root=data_dir, athlete="alex", ext='.rda'
+    """
+    if catalog is None:
+        from sprof.catalog import get_catalog
+        catalog = get_catalog()
+        if catalog is None:
+            raise ValueError("catalogue des fichiers radar non disponible (settings CATALOG_FILE)")
+    return build_corpus(catalog.search(**search), dir, dtype, detect)
+
+# ------ RadarCorpus Class --------------------------------------------------------------
+
+class RadarCorpus:
+
+    def __init__(self, dir, mmap_mode='r'):
+        """ Opens the corpus written in dir (build_corpus). mmap_mode : as np.load
+            (None : arrays loaded in memory)
+        """
+        self.dir = dir
+        self.T = np.load(os.path.join(dir, 'T.npy'), mmap_mode=mmap_mode)
+        self.V = np.load(os.path.join(dir, 'V.npy'), mmap_mode=mmap_mode)
+        self.offsets = np.load(os.path.join(dir, 'offsets.npy'))
+        self.metadata = np.load(os.path.join(dir, 'metadata.npy'))
+        self._index = None
+
+    def __len__(self):
+        return len(self.metadata)
+
+    def __getitem__(self, k):
+        """ (T, V) of the recording k : views on the corpus arrays
+        """
+        (first, end) = self.offsets[k:k+2]
+        return (self.T[first:end], self.V[first:end])
+
+    def __repr__(self):
+        return f"RadarCorpus({self.dir!r}, {len(self)} enregistrements, {len(self.V)} points)"
+
+    def find(self, title):
+        """ Index of the recording title (or file), None if not found
+        """
+        if self._index is None:
+            self._index = {}
+            for (k, row) in enumerate(self.metadata):
+                self._index.setdefault(row['title'], k)
+                self._index.setdefault(row['file'], k)
+        return self._index.get(title)
+
+    def radar_data(self, k, auto=True):
+        from sprof.radar_data import RadarData
+        (T, V) = self[k]
+        return RadarData(T, V, self.metadata['title'][k], auto=auto)
+
+    def sprint(self, k):
+        """ (T, V) of the sprint of the recording k (bounds found when built, included) :
+            views. None if no sprint
+        """
+        (i_start, i_end) = (self.metadata['i_start_sprint'][k], self.metadata['i_end_sprint'][k])
+        if i_start < 0:
+            return None
+        first = self.offsets[k]
+        return (self.T[first+i_start:first+i_end+1], self.V[first+i_start:first+i_end+1])
+
+    def reduce(self, ufunc, values=None):
+        """ ufunc reduced over each recording (ex np.maximum : max velocity of each
+            recording), in one pass on the values (default V)
+        """
+        values = self.V if values is None else values
+        starts = self.offsets[:-1]
+        result = np.full(len(self), np.nan)
+        not_empty = self.offsets[1:] > starts
+        result[not_empty] = ufunc.reduceat(values, starts[not_empty])
+        return result
+
+# ------ Main ---------------------------------------------------------------------------
+if __name__ == "__main__":
+    # corpus of synthetic files : text files read again, or corpus scan
+    # python corpus.py [n_files]
+    import sys
+    import tempfile
+    import time
+    from sprof.synthetic import write_corpus
+    from sprof.radar_file import RadarFile
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    with tempfile.TemporaryDirectory() as dir:
+        files = write_corpus(os.path.join(dir, "data"), n, seed=0, ext=('.rda',))
+        start_time = time.perf_counter()
+        corpus = build_corpus(files, os.path.join(dir, "corpus"))
+        print(f"Construction : {time.perf_counter()-start_time:.2f} s, {corpus}")
+
+        start_time = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            v_max_files = [RadarFile(file).V.max() for file in files]
+        t_files = time.perf_counter()-start_time
+
+        start_time = time.perf_counter()
+        corpus = RadarCorpus(os.path.join(dir, "corpus"))
+        v_max = corpus.reduce(np.maximum)
+        t_corpus = time.perf_counter()-start_time
+        print(f"V max de chaque enregistrement : fichiers texte {t_files*1000:.0f} ms, "
+              f"corpus {t_corpus*1000:.1f} ms, mêmes valeurs {np.array_equal(v_max, v_max_files)}")
+
+        start_time = time.perf_counter()
+        sprints = [corpus.sprint(k) for k in range(len(corpus))]
+        print(f"Sprints (vues) : {sum(s is not None for s in sprints)} en {(time.perf_counter()-start_time)*1000:.1f} ms, "
+              f"sans copie {np.shares_memory(sprints[0][1], corpus.V)}")
+        k = corpus.find(os.path.basename(files[0])[:-4])
+        with contextlib.redirect_stdout(io.StringIO()):
+            rd = corpus.radar_data(k)
+            rd_file = RadarFile(files[0])
+        print(f"{corpus.metadata[k]['title']} : mêmes données que le fichier {np.array_equal(rd.V, rd_file.V)}, "
+              f"sprint {rd.i_start_sprint}-{rd.i_end_sprint}")
+
+        # float32 : sprints found on the stored velocities, as radar_data
+        corpus = build_corpus(files[:100], os.path.join(dir, "corpus32"), np.float32)
+        with contextlib.redirect_stdout(io.StringIO()):
+            same = all(corpus.radar_data(k).i_start_sprint == corpus.metadata['i_start_sprint'][k] for k in range(len(corpus)))
+        print(f"float32 : {corpus}, mêmes départs que radar_data {same}")
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*
+# python3
+# Author : LJK - Laboratoire Jean Kuntzmann - C. Bligny
+"""
+Instrumentation of the analyse pipeline : per stage timers and counters.
+
+    from sprof.instrument import timers
+    with timers.stage('parse'):
+        rf = RadarFile(file)
+    timers.count('sprint', 'outliers', s.n_out)
+
+Disabled by default (settings INSTRUMENT) : stage() then returns a shared context manager
+that does nothing, and count() returns at once, so the hooks can stay in the code.
+
+When enabled, the registry records for each stage the wall time of each call, the call
+count and the counters (fit iterations, outliers ...). Results are available :
+    - per analysed file, as json lines (start_file / end_file, jsonl_file)
+    - for a batch, as a summary : count, total, p50, p95, max per stage
+Stages can optionally be profiled with cProfile (one profile per stage).
+cf scripts/sprof_timing.py
+"""
+
+import cProfile
+import json
+import threading
+import time
+import numpy as np
+from sprof.settings import INSTRUMENT
+
+# ------ Null stage, used when disabled --------------------------------------------------
+
+class _NullStage:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+# ------ Stage context manager ----------------------------------------------------------
+
+class _Stage:
+
+    def __init__(self, timers, name):
+        self.timers = timers
+        self.name = name
+        self.profile = None
+
+    def __enter__(self):
+        local = self.timers._local
+        # one profiler at a time : nested stages are included in the outer stage profile
+        if self.timers.profile and not getattr(local, 'profiling', False):
+            self.profile = self.timers._get_profile(self.name)
+            local.profiling = True
+            self.profile.enable()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        duration = time.perf_counter() - self.start
+        if self.profile:
+            self.profile.disable()
+            self.timers._local.profiling = False
+        self.timers._add_time(self.name, duration)
+        return False
+
+# ------ Timers Class -------------------------------------------------------------------
+
+class Timers:
+
+    def __init__(self, enabled=False, profile=False, jsonl_file=None):
+
+        self.enabled = enabled
+        self.profile = profile # cProfile each stage
+        self.jsonl_file = jsonl_file # if set, one json line per analysed file
+
+        self.times = {} # stage name : list of call durations (s)
+        self.counters = {} # stage name : {counter name : total}
+        self.profiles = {} # stage name : cProfile.Profile
+        self.records = [] # per file records
+        self._lock = threading.Lock()
+        self._local = threading.local() # current file record, per thread
+
+    # ------ Recording ------------------------------------------------------------------
+
+    def stage(self, name):
+        """ Returns a context manager timing the stage
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def count(self, stage, counter, value=1):
+        """ Add value to the stage counter (fit iterations, outliers ...)
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            counters = self.counters.setdefault(stage, {})
+            counters[counter] = counters.get(counter, 0) + value
+        record = getattr(self._local, 'record', None)
+        if record is not None:
+            counters = record['counters'].setdefault(stage, {})
+            counters[counter] = counters.get(counter, 0) + value
+
+    def start_file(self, file):
+        """ Start the record of a file analyse
+        """
+        if not self.enabled:
+            return
+        self._local.record = {'file':file, 'stages':{}, 'counters':{}, 'start':time.perf_counter()}
+
+    def end_file(self):
+        """ End the record of a file analyse. Write it as a json line if jsonl_file is set
+        """
+        if not self.enabled:
+            return
+        record = getattr(self._local, 'record', None)
+        if record is None:
+            return
+        self._local.record = None
+        record['total'] = round(time.perf_counter() - record.pop('start'), 6)
+        record['stages'] = {k:round(v, 6) for (k,v) in record['stages'].items()}
+        with self._lock:
+            self.records.append(record)
+            if self.jsonl_file:
+                with open(self.jsonl_file, 'a') as f:
+                    f.write(json.dumps(record)+'\n')
+
+    def _add_time(self, name, duration):
+        with self._lock:
+            self.times.setdefault(name, []).append(duration)
+        record = getattr(self._local, 'record', None)
+        if record is not None:
+            record['stages'][name] = record['stages'].get(name, 0.0) + duration
+
+    def _get_profile(self, name):
+        with self._lock:
+            if name not in self.profiles:
+                self.profiles[name] = cProfile.Profile()
+            return self.profiles[name]
+
+    # ------ Results --------------------------------------------------------------------
+
+    def reset(self):
+        with self._lock:
+            self.times = {}
+            self.counters = {}
+            self.profiles = {}
+            self.records = []
+
+    def summary(self):
+        """ Returns a dictionnary, for each stage : call count, total, p50, p95 and max
+            duration of the calls (s), and the stage counters
+        """
+        summary = {}
+        with self._lock:
+            for (name, durations) in self.times.items():
+                d = np.array(durations)
+                summary[name] = {'count':len(d),
+                                 'total':d.sum(),
+                                 'p50':np.percentile(d, 50),
+                                 'p95':np.percentile(d, 95),
+                                 'max':d.max()}
+                summary[name].update(self.counters.get(name, {}))
+            for (name, counters) in self.counters.items():
+                if name not in summary:
+                    summary[name] = dict(counters)
+        return summary
+
+    def print_summary(self):
+        summary = self.summary()
+        print(f"\n{'stage':<10}{'count':>8}{'total (s)':>11}{'p50 (ms)':>10}{'p95 (ms)':>10}{'max (ms)':>10}  counters")
+        for (name, s) in summary.items():
+            counters = ", ".join(f"{k} {v}" for (k,v) in s.items() if k not in ('count','total','p50','p95','max'))
+            if 'count' in s:
+                print(f"{name:<10}{s['count']:>8}{s['total']:>11.3f}{s['p50']*1000:>10.2f}{s['p95']*1000:>10.2f}{s['max']*1000:>10.2f}  {counters}")
+            else:
+                print(f"{name:<10}{'':>49}  {counters}")
+
+    def export_summary(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.summary(), f, indent=2, default=float)
+
+    def dump_profiles(self, prefix):
+        """ Save the cProfile stats, one file per stage : prefix_stage.prof
+            (read them with python -m pstats, or snakeviz)
+        """
+        files = []
+        with self._lock:
+            for (name, profile) in self.profiles.items():
+                file = f"{prefix}_{name}.prof"
+                profile.dump_stats(file)
+                files.append(file)
+        return files
+
+# Registry used by the sprof modules
+timers = Timers(enabled=INSTRUMENT)
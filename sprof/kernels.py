@@ -0,0 +1,439 @@
+# -*- coding: utf-8 -*
+# python3
+# Author : LJK - Laboratoire Jean Kuntzmann - C. Bligny
+"""
+Numeric kernels used by utils.py, vectorized with numpy.
+
+They return the same values as the loops they replace (kept below as reference, *_loop
+functions, for the checks) :
+    - sum_distances : the squares are summed in the same order (cumsum), so the sum is
+      the same to the last bit, not only close (np.sum uses a pairwise sum)
+    - lissage : each iteration of the 3 points filter is computed on slices. The
+      iterated filter is a binomial filter, but the edge rules (first value kept, last
+      value (2*V[n-1]+V[n-2])/3) change all the values after enough iterations : a
+      single convolution does not give the same result
+    - get_inext, get_iprevious : first point out of the gap, found with a boolean mask
+      and argmax
+    - bisect_left, bisect_right : returning lo-1 as the utils functions. x can be an
+      array : batch search with searchsorted
+Also the RadarData sprint start scores (score_sprint_starts), and the Sprint velocity
+model fit (fit_velocity).
+
+Backends (setting KERNEL_BACKEND) : the threshold searches, the scores and the fit have
+compiled versions (kernels_numba.py), used if KERNEL_BACKEND is 'numba' or 'auto' and
+numba is installed. Else (default 'numpy'), the numpy versions. The compiled fit is a Levenberg-Marquardt
+with the same results as scipy leastsq, to the fit tolerance, on the sprint acceleration.
+On a whole recording (sprint bounds not computed, auto=False), the fit is ill-conditioned
+and the two solvers can stop at different points : KERNEL_BACKEND = 'numpy' gives the
+leastsq results.
+
+    python kernels.py   # checks and micro benchmarks, for each available backend
+"""
+
+import bisect
+import functools
+import importlib.util
+import numpy as np
+from sprof.settings import KERNEL_BACKEND
+
+# ------ Kernels ------------------------------------------------------------------------
+
+def sum_distances(V_mesure, V_model):
+    """
+    somme des carrés des écarts à la valeur du modèle (= fonction F)
+    """
+    if len(V_mesure) != len(V_model):
+        print("Somme des carrés à la distance : attention, les vecteurs ne sont pas de la même taille")
+        return 0
+    if len(V_mesure) == 0:
+        return 0
+    D = np.subtract(V_mesure, V_model)
+    # cumsum : same order as a loop, same result
+    return np.cumsum(D*D)[-1]
+
+def lissage(V, n_iter=200):
+    """ Returns a smoothed copy of V : n_iter times the filter
+        (V[i-1] + 2*V[i] + V[i+1])/4, first value kept, last value (2*V[n-1]+V[n-2])/3
+    """
+    # une petite limite au cas où
+    n_iter = min(n_iter, 1000)
+    V_smooth = np.array(V, dtype=float)
+    if len(V_smooth) < 2:
+        return V_smooth
+    V_next = np.empty_like(V_smooth)
+    for i in range(n_iter):
+        V_next[0] = V_smooth[0]
+        V_next[1:-1] = (V_smooth[:-2]+V_smooth[1:-1]*2+V_smooth[2:])/4
+        V_next[-1] = (V_smooth[-1]*2+V_smooth[-2])/3
+        (V_smooth, V_next) = (V_next, V_smooth)
+    return V_smooth
+
+def get_inext(array, i_start, ratio):
+    """ Returns the first index after i_start where the gap to array[i_start] is not
+        < array[i_start]*ratio, or the last index
+    """
+    array = np.asarray(array)
+    value = array[i_start]
+    out = ~(np.abs(array[i_start:-1]-value) < value*ratio)
+    if out.size == 0 or not out.any():
+        return len(array)-1
+    return i_start+int(np.argmax(out))
+
+def get_iprevious(array, i_start, ratio):
+    """ Returns the first index before i_start where the gap to array[i_start] is not
+        < array[i_start]*ratio, or 0
+    """
+    array = np.asarray(array)
+    value = array[i_start]
+    out = ~(np.abs(array[i_start:0:-1]-value) < value*ratio)
+    if out.size == 0 or not out.any():
+        return 0
+    return i_start-int(np.argmax(out))
+
+def _searchsorted(a, x, lo, hi, side):
+    if lo < 0:
+        raise ValueError('lo must be non-negative')
+    if hi is None:
+        hi = len(a)
+    if np.ndim(x) == 0:
+        # one value : the C bisect module is faster than searchsorted
+        search = bisect.bisect_left if side == 'left' else bisect.bisect_right
+        return search(a, x, lo, max(lo, hi))-1
+    return np.searchsorted(np.asarray(a)[lo:hi], x, side=side)+lo-1
+
+def bisect_right(a, x, lo=0, hi=None):
+    """ Index of the last element of the sorted a (between lo and hi) <= x, lo-1 if
+        none. x : value or array
+    """
+    return _searchsorted(a, x, lo, hi, 'right')
+
+def bisect_left(a, x, lo=0, hi=None):
+    """ Index of the last element of the sorted a (between lo and hi) < x, lo-1 if
+        none. x : value or array
+    """
+    return _searchsorted(a, x, lo, hi, 'left')
+
+def score_sprint_starts(T, V, i_start, i_end, i_end_model, tau=0.8):
+    """ Scores of the sprint start candidates i_start <= i < i_end (cf
+        RadarData.find_sprint_start) : sum of the square distances to the mean velocity
+        for the points 0 to i, and to the model velocity vmax*(1-exp((T[i]-t)/tau)) for
+        the points i to i_end_model (vmax : least squares)
+        All the candidates at once. Distance to the mean : cumulative sums, O(n) memory
+        (the sprint can be far in a long recording). Distance to the model : arrays
+        (candidates, model points), masked.
+    """
+    T = np.asarray(T, dtype=float)
+    V = np.asarray(V, dtype=float)
+    I = np.arange(i_start, i_end)
+    if len(I) == 0:
+        return np.empty(0)
+
+    # distance to the mean, points 0..i : sum(D²) - sum(D)²/(i+1), D : gaps to the mean
+    # of all the points (same distance, less cancellation than with V)
+    D = V[:i_end]-np.mean(V[:i_end])
+    S1 = np.cumsum(D)[I]
+    sum_mean = np.cumsum(D*D)[I]-S1*S1/(I+1)
+
+    # distance to the model, points i..i_end_model
+    K = np.arange(i_start, i_end_model+1)
+    after = K[None,:] >= I[:,None]
+    F = np.where(after, 1-np.exp(np.minimum(T[I][:,None]-T[K][None,:], 0)/tau), 0)
+    vmax = (F @ V[K])/np.sum(F*F, axis=1)
+    sum_model = np.sum(np.where(after, (V[K][None,:]-vmax[:,None]*F)**2, 0), axis=1)
+    return sum_mean+sum_model
+
+def fit_velocity(T, V, v_max=8.0, tau=1.0, delay=0.0):
+    """ Least squares fit of the velocity model v_max*(1-exp((T[0]+delay-t)/tau)), from
+        the initial values. Returns (v_max, tau, delay, number of model evaluations,
+        converged)
+    """
+    from scipy.optimize import leastsq
+    t_start = T[0]
+    F = lambda p, t : p[0] * (1-np.exp((t_start + p[2] - t)/p[1]))
+    F_err = lambda p, t, v: F(p, t)-v
+    p_initial = np.array([v_max, tau, delay], dtype=float)
+    p_final, cov, info, msg, success = leastsq(F_err, p_initial, args=(T,V), full_output=True)
+    # leastsq ier 1 to 4 : a solution was found
+    return (p_final[0], p_final[1], p_final[2], info['nfev'], success in (1, 2, 3, 4))
+
+NUMPY_KERNELS = {'get_inext':get_inext, 'get_iprevious':get_iprevious,
+                 'score_sprint_starts':score_sprint_starts, 'fit_velocity':fit_velocity}
+
+# ------ Backend ------------------------------------------------------------------------
+
+def get_backend(name=KERNEL_BACKEND):
+    """ Backend for the setting value name : 'numba' if asked ('numba' or 'auto') and
+        installed, else 'numpy'
+    """
+    if name not in ('auto', 'numpy', 'numba'):
+        raise ValueError(f"KERNEL_BACKEND inconnu : {name} (auto, numpy ou numba)")
+    if name == 'numpy':
+        return 'numpy'
+    if importlib.util.find_spec('numba') is None:
+        if name == 'numba':
+            print("KERNEL_BACKEND : numba n'est pas installé, kernels numpy")
+        return 'numpy'
+    return 'numba'
+
+def get_kernels(backend):
+    """ Dictionnary name : function of the kernels of a backend
+    """
+    kernels = dict(NUMPY_KERNELS)
+    if backend == 'numba':
+        from sprof import kernels_numba
+        kernels.update({name:getattr(kernels_numba, name) for name in NUMPY_KERNELS})
+    return kernels
+
+def _numba_kernel(name):
+    """ Kernel of the numba backend. numba is imported at the first call only : it
+        takes longer to import than sprof
+    """
+    @functools.wraps(NUMPY_KERNELS[name])
+    def kernel(*args, **kwargs):
+        from sprof import kernels_numba
+        return getattr(kernels_numba, name)(*args, **kwargs)
+    return kernel
+
+BACKEND = get_backend()
+if BACKEND == 'numba':
+    get_inext = _numba_kernel('get_inext')
+    get_iprevious = _numba_kernel('get_iprevious')
+    score_sprint_starts = _numba_kernel('score_sprint_starts')
+    fit_velocity = _numba_kernel('fit_velocity')
+
+# ------ Reference implementations (loops), for the checks ------------------------------
+
+def sum_distances_loop(V_mesure, V_model):
+    sum = 0
+    n = len(V_mesure)
+    if ( n != len(V_model) ):
+        print("Somme des carrés à la distance : attention, les vecteurs ne sont pas de la même taille")
+    else:
+        for i in range (0, n):
+            sum=sum+(V_mesure[i]-V_model[i])**2
+    return sum
+
+def _lissage_loop(V):
+    n = len(V)
+    V_start = [V[0],] # pour le début, il ne faut pas atténuer
+    V_end = [(V[n-1]*2+V[n-2])/3,] # en revanche pour la fin, si
+    V_middle = np.array([(V[i-1]+V[i]*2+V[i+1])/4 for i in range(1,n-1)])
+    return np.concatenate((V_start, V_middle, V_end))
+
+def lissage_loop(V, n_iter=200):
+    V_smooth = np.copy(V)
+    for i in range(min(n_iter, 1000)):
+        V_smooth = _lissage_loop(V_smooth)
+    return V_smooth
+
+def get_inext_loop(array,i_start,ratio):
+    value = array[i_start]
+    diff = value*ratio
+    i=i_start
+    imax=len(array) - 1
+    while ( abs(array[i]-value) < diff and i < imax):
+        i+=1
+    return i
+
+def get_iprevious_loop(array,i_start,ratio):
+    value = array[i_start]
+    diff = value*ratio
+    i=i_start
+    while ( abs(array[i]-value) < diff and i > 0):
+        i-=1
+    return i
+
+# from https://github.com/python/cpython/blob/3.7/Lib/bisect.py
+def bisect_right_loop(a, x, lo=0, hi=None):
+    if hi is None:
+        hi = len(a)
+    while lo < hi:
+        mid = (lo+hi)//2
+        if x < a[mid]: hi = mid
+        else: lo = mid+1
+    return lo-1
+
+def bisect_left_loop(a, x, lo=0, hi=None):
+    if hi is None:
+        hi = len(a)
+    while lo < hi:
+        mid = (lo+hi)//2
+        if a[mid] < x: lo = mid+1
+        else: hi = mid
+    return lo-1
+
+def score_sprint_starts_loop(T, V, i_start, i_end, i_end_model, tau=0.8):
+    # RadarData._get_sum_mean_distance + RadarData._get_sum_Vmodel_distance
+    scores = []
+    for i in range(i_start, i_end):
+        mean = V[:i+1].mean()
+        F = np.array([(1-np.exp((T[i]-t)/tau)) for t in T[i:i_end_model+1]])
+        vmax = np.vdot(F, V[i:i_end_model+1])/np.linalg.norm(F)**2
+        scores.append(sum_distances_loop(V[:i+1], np.full(i+1, mean))+sum_distances_loop(V[i:i_end_model+1], vmax*F))
+    return np.array(scores)
+
+# ------ Checks -------------------------------------------------------------------------
+
+def get_test_data(T, V):
+    """ Sprint start candidates and acceleration part of a recording, as found by
+        RadarData, to check the scores and the fit. Returns (i_start, i_end, i_end_model,
+        i_fit), or None
+    """
+    V_smooth = lissage(V, 50)
+    i_end_model = int(np.argmax(V_smooth))
+    i_end = get_iprevious_loop(V_smooth, i_end_model, 0.5)
+    i_start = max(0, i_end-int(2/(T[1]-T[0])))
+    if i_end-i_start < 2:
+        return None
+    i_fit = i_start+int(np.argmin(score_sprint_starts_loop(T, V, i_start, i_end, i_end_model)))
+    return (i_start, i_end, i_end_model, i_fit)
+
+LONG_RECORDING = 20000 # points : scores only, the loops are too slow
+
+def check_long_recording(k, T, V, n_rec, check):
+    """ Long recording, sprint far from the start : scores of some candidates compared
+        to the loop, and memory of score_sprint_starts in O(n)
+    """
+    import tracemalloc
+    n = len(V)
+    V_smooth = lissage(V, 50)
+    i_end_model = int(np.argmax(V_smooth))
+    i_end = get_iprevious_loop(V_smooth, i_end_model, 0.5)
+    i_start = max(0, i_end-int(2/(T[1]-T[0])))
+    if i_end-i_start < 2:
+        return
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    size = tracemalloc.get_traced_memory()[0]
+    scores = k['score_sprint_starts'](T, V, i_start, i_end, i_end_model)
+    peak = tracemalloc.get_traced_memory()[1]-size
+    if not tracing:
+        tracemalloc.stop()
+    for i in np.linspace(i_start, i_end-1, 5).astype(int):
+        check('score_sprint_starts', scores[i-i_start], score_sprint_starts_loop(T, V, i, i+1, i_end_model)[0],
+              (n_rec, i), rtol=1e-9)
+    check('score_sprint_starts memory', peak <= 32*8*n, True, (n_rec, f"pic {peak} octets, {n} points"))
+
+def check_kernels(recordings, backend='numpy', seed=0):
+    """ Compare the kernels of the backend to the loops, and the fit to scipy leastsq,
+        on the recordings : list of (T, V). Recordings longer than LONG_RECORDING :
+        check_long_recording only.
+        Returns the list of the differences found : (kernel, description)
+    """
+    k = get_kernels(backend)
+    rng = np.random.default_rng(seed)
+    errors = []
+
+    def check(name, result, expected, args, rtol=0):
+        same = np.array_equal(result, expected) if rtol == 0 else np.allclose(result, expected, rtol=rtol, atol=rtol)
+        if not same:
+            errors.append((name, f"{args} : {result} != {expected}"))
+
+    for (n_rec, (T, V)) in enumerate(recordings):
+        V = np.asarray(V, dtype=float)
+        n = len(V)
+        if n > LONG_RECORDING:
+            check_long_recording(k, np.asarray(T, dtype=float), V, n_rec, check)
+            continue
+        T_bisect = np.arange(n)*0.01
+        model = V+rng.normal(0, 0.2, n)
+        for m in (n, n//2, 1, 0):
+            check('sum_distances', sum_distances(V[:m], model[:m]), sum_distances_loop(V[:m], model[:m]), (n_rec, m))
+        if n >= 2:
+            for n_iter in (0, 1, 7, 60):
+                check('lissage', lissage(V, n_iter), lissage_loop(V, n_iter), (n_rec, n_iter))
+        for i in list(rng.integers(0, n, 20))+[0, n-1, int(np.argmax(V))]:
+            for ratio in (0, 0.05, 0.2, 0.5, 1, 10):
+                check('get_inext', k['get_inext'](V, i, ratio), get_inext_loop(V, i, ratio), (n_rec, i, ratio))
+                check('get_iprevious', k['get_iprevious'](V, i, ratio), get_iprevious_loop(V, i, ratio), (n_rec, i, ratio))
+        X = np.concatenate((rng.uniform(-1, T_bisect[-1]+1, 20), T_bisect[rng.integers(0, n, 10)]))
+        for (lo, hi) in ((0, None), (n//3, n//2), (n//2, n//2)):
+            for (kernel, loop) in ((bisect_left, bisect_left_loop), (bisect_right, bisect_right_loop)):
+                expected = [loop(T_bisect, x, lo, hi) for x in X]
+                check(kernel.__name__, kernel(T_bisect, X, lo, hi), expected, (n_rec, lo, hi, 'batch'))
+                check(kernel.__name__, [kernel(T_bisect, x, lo, hi) for x in X], expected, (n_rec, lo, hi))
+
+        # scores (same start found) and fit, on the sprint part
+        data = get_test_data(np.asarray(T, dtype=float), V) if n > 10 else None
+        if data is None:
+            continue
+        (i_start, i_end, i_end_model, i_fit) = data
+        scores = k['score_sprint_starts'](T, V, i_start, i_end, i_end_model)
+        expected = score_sprint_starts_loop(T, V, i_start, i_end, i_end_model)
+        check('score_sprint_starts', scores, expected, (n_rec, i_start, i_end), rtol=1e-9)
+        check('score_sprint_starts argmin', np.argmin(scores), np.argmin(expected), (n_rec, i_start, i_end))
+        (T_fit, V_fit) = (T[i_fit:i_end_model+1], V[i_fit:i_end_model+1])
+        check('fit_velocity', k['fit_velocity'](T_fit, V_fit)[:3], NUMPY_KERNELS['fit_velocity'](T_fit, V_fit)[:3],
+              (n_rec, i_fit, i_end_model), rtol=1e-5)
+    return errors
+
+def benchmark(T, V, backend='numpy', repeat=5):
+    """ Micro benchmarks : time (µs) of the loop and of the kernel of the backend, for
+        the recording (T, V). Scores and fit : per sprint
+    """
+    import timeit
+    k = get_kernels(backend)
+    T = np.asarray(T, dtype=float)
+    V = np.asarray(V, dtype=float)
+    V_smooth = lissage(V, 50)
+    model = V_smooth[::-1].copy()
+    i_max = int(np.argmax(V_smooth))
+    (i_start, i_end, i_end_model, i_fit) = get_test_data(T, V)
+    (T_fit, V_fit) = (T[i_fit:i_end_model+1], V[i_fit:i_end_model+1])
+    X = T[::7]+0.005
+    cases = (('sum_distances', lambda: sum_distances_loop(V, model), lambda: sum_distances(V, model)),
+             ('lissage (200)', lambda: lissage_loop(V), lambda: lissage(V)),
+             ('get_inext', lambda: get_inext_loop(V_smooth, i_max, 0.2), lambda: k['get_inext'](V_smooth, i_max, 0.2)),
+             ('get_iprevious', lambda: get_iprevious_loop(V_smooth, i_max, 0.5), lambda: k['get_iprevious'](V_smooth, i_max, 0.5)),
+             ('bisect_left', lambda: bisect_left_loop(T, T[-1]/3), lambda: bisect_left(T, T[-1]/3)),
+             (f'bisect_left x{len(X)}', lambda: [bisect_left_loop(T, x) for x in X], lambda: bisect_left(T, X)),
+             (f'scores x{i_end-i_start}', lambda: score_sprint_starts_loop(T, V, i_start, i_end, i_end_model),
+                                         lambda: k['score_sprint_starts'](T, V, i_start, i_end, i_end_model)),
+             ('fit (leastsq)', lambda: NUMPY_KERNELS['fit_velocity'](T_fit, V_fit), lambda: k['fit_velocity'](T_fit, V_fit)))
+    results = []
+    for (name, loop, kernel) in cases:
+        kernel() # numba : compiled at the first call
+        times = []
+        for func in (loop, kernel):
+            timer = timeit.Timer(func)
+            (number, t) = timer.autorange()
+            times.append(min(timer.repeat(repeat=repeat, number=number))/number*1e6)
+        results.append((name, times[0], times[1]))
+    return results
+
+def get_check_recordings():
+    """ Recordings (T, V) of the kernels checks : test files, synthetic sprints with
+        outliers, very short recordings, and a sprint 30 min after the start
+    """
+    import contextlib
+    import glob
+    import io
+    import os
+    from sprof.settings import PROJECT_DIR
+    from sprof.radar_file import RadarFile
+    from sprof.synthetic import generate_one
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        recordings = [(rf.T, rf.V) for rf in (RadarFile(f) for f in sorted(glob.glob(os.path.join(PROJECT_DIR, 'test', '*.rda'))))]
+    recordings += [generate_one(outlier_rate=0.02, seed=seed) for seed in range(20)]
+    recordings += [(np.arange(n)*0.1, np.array(V)) for (n, V) in ((2, [1., 2.]), (3, [0., 0., 0.]), (4, [5., 5., 5., 5.]))]
+    recordings.append(generate_one(delay=1800, duration=1810, seed=1))
+    return recordings
+
+# ------ Main ---------------------------------------------------------------------------
+if __name__ == "__main__":
+    # checks (cf scripts/sprof_check_kernels.py) and micro benchmarks
+    recordings = get_check_recordings()
+    backends = ['numpy'] + (['numba'] if get_backend('auto') == 'numba' else [])
+    print(f"Backend utilisé (KERNEL_BACKEND = {KERNEL_BACKEND}) : {BACKEND}")
+    for backend in backends:
+        errors = check_kernels(recordings, backend)
+        print(f"\n{backend} : vérification sur {len(recordings)} enregistrements, {len(errors)} différence(s)")
+        for (name, error) in errors[:20]:
+            print(f"\t{name} : {error}")
+
+        print(f"{'kernel':<24}{'boucle (µs)':>14}{backend+' (µs)':>14}{'ratio':>8}")
+        for (name, t_loop, t_kernel) in benchmark(*recordings[0], backend=backend):
+            print(f"{name:<24}{t_loop:>14.1f}{t_kernel:>14.1f}{t_loop/t_kernel:>8.1f}")
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*
+# python3
+# Author : LJK - Laboratoire Jean Kuntzmann - C. Bligny
+"""
+Compiled kernels (numba), used by kernels.py when numba is installed and the setting
+KERNEL_BACKEND is 'auto' or 'numba'. Same functions and results as the numpy kernels.
+
+On ~300 points arrays, the numpy kernels time is mostly the cost of each numpy call :
+the compiled loops avoid it. The functions are compiled at the first call, and cached
+on disk (__pycache__) for the next processes.
+"""
+
+import numpy as np
+from numba import njit
+
+# ------ Threshold searches -------------------------------------------------------------
+
+@njit(cache=True)
+def _get_inext(array, i_start, ratio):
+    value = array[i_start]
+    diff = value*ratio
+    i = i_start
+    imax = len(array)-1
+    while abs(array[i]-value) < diff and i < imax:
+        i += 1
+    return i
+
+@njit(cache=True)
+def _get_iprevious(array, i_start, ratio):
+    value = array[i_start]
+    diff = value*ratio
+    i = i_start
+    while abs(array[i]-value) < diff and i > 0:
+        i -= 1
+    return i
+
+def get_inext(array, i_start, ratio):
+    return _get_inext(np.asarray(array, dtype=np.float64), int(i_start), float(ratio))
+
+def get_iprevious(array, i_start, ratio):
+    return _get_iprevious(np.asarray(array, dtype=np.float64), int(i_start), float(ratio))
+
+# ------ RadarData : sprint start candidates --------------------------------------------
+
+@njit(cache=True)
+def _score_sprint_starts(T, V, i_start, i_end, i_end_model, tau):
+    scores = np.empty(max(0, i_end-i_start))
+    # distance to the mean velocity, points 0 to i : sum of the squares of the gaps to
+    # the mean, updated point by point (Welford)
+    mean = 0.0
+    m2 = 0.0
+    for j in range(i_start):
+        delta = V[j]-mean
+        mean += delta/(j+1)
+        m2 += delta*(V[j]-mean)
+    # exp((T[i]-T[j])/tau) = E_start[i]*E_end[j], relative to T[i_start] (no overflow)
+    E_start = np.exp((T[i_start:i_end]-T[i_start])/tau)
+    E_end = np.exp((T[i_start]-T[i_start:i_end_model+1])/tau)
+    F = np.empty(i_end_model+1-i_start)
+    for i in range(i_start, i_end):
+        delta = V[i]-mean
+        mean += delta/(i+1)
+        m2 += delta*(V[i]-mean)
+        # distance to the model velocity vmax*(1-exp((T[i]-t)/tau)), points i to i_end_model
+        fv = 0.0
+        ff = 0.0
+        for j in range(i, i_end_model+1):
+            f = 1-E_start[i-i_start]*E_end[j-i_start]
+            F[j-i_start] = f
+            fv += f*V[j]
+            ff += f*f
+        vmax = fv/ff
+        score = m2
+        for j in range(i, i_end_model+1):
+            score += (V[j]-vmax*F[j-i_start])**2
+        scores[i-i_start] = score
+    return scores
+
+def score_sprint_starts(T, V, i_start, i_end, i_end_model, tau=0.8):
+    return _score_sprint_starts(np.asarray(T, dtype=np.float64), np.asarray(V, dtype=np.float64),
+                                int(i_start), int(i_end), int(i_end_model), float(tau))
+
+# ------ Sprint : velocity model fit ----------------------------------------------------
+
+@njit(cache=True)
+def _cost(T, V, t_start, a, b, d):
+    cost = 0.0
+    for k in range(len(T)):
+        r = a*(1-np.exp((t_start+d-T[k])/b))-V[k]
+        cost += r*r
+    return cost
+
+@njit(cache=True)
+def _solve3(M, b):
+    """ Solution of the 3x3 system M x = b (Cramer), None if M is singular
+    """
+    det = (M[0,0]*(M[1,1]*M[2,2]-M[1,2]*M[2,1]) - M[0,1]*(M[1,0]*M[2,2]-M[1,2]*M[2,0])
+           + M[0,2]*(M[1,0]*M[2,1]-M[1,1]*M[2,0]))
+    if det == 0 or not np.isfinite(det):
+        return None
+    x = np.empty(3)
+    for c in range(3):
+        Mc = M.copy()
+        Mc[:, c] = b
+        x[c] = (Mc[0,0]*(Mc[1,1]*Mc[2,2]-Mc[1,2]*Mc[2,1]) - Mc[0,1]*(Mc[1,0]*Mc[2,2]-Mc[1,2]*Mc[2,0])
+                + Mc[0,2]*(Mc[1,0]*Mc[2,1]-Mc[1,1]*Mc[2,0]))/det
+    return x
+
+@njit(cache=True)
+def _fit_velocity(T, V, v_max, tau, delay, max_iter, tol):
+    """ Levenberg-Marquardt, 3 parameters, analytical jacobian. converged : False if
+        max_iter was reached, or if the fit stopped without progress (singular normal
+        equations, damping above 1e12)
+    """
+    t_start = T[0]
+    p = np.array([v_max, tau, delay])
+    cost = _cost(T, V, t_start, p[0], p[1], p[2])
+    nfev = 1
+    lam = 1e-3
+    A = np.empty((3, 3))
+    g = np.empty(3)
+    converged = False
+    failed = False
+    for it in range(max_iter):
+        # normal equations J^T J, J^T r
+        A[:] = 0.0
+        g[:] = 0.0
+        for k in range(len(T)):
+            u = (t_start+p[2]-T[k])/p[1]
+            e = np.exp(u)
+            r = p[0]*(1-e)-V[k]
+            J0 = 1-e
+            J1 = p[0]*e*u/p[1]
+            J2 = -p[0]*e/p[1]
+            J = (J0, J1, J2)
+            for m in range(3):
+                g[m] += J[m]*r
+                for l in range(3):
+                    A[m, l] += J[m]*J[l]
+        converged = False
+        while True:
+            M = A.copy()
+            for m in range(3):
+                M[m, m] += lam*A[m, m]
+            step = _solve3(M, -g)
+            if step is None:
+                failed = True
+                break
+            q = p+step
+            new_cost = _cost(T, V, t_start, q[0], q[1], q[2]) if q[1] > 0 else np.inf
+            nfev += 1
+            if new_cost <= cost:
+                lam = max(lam/10, 1e-12)
+                converged = (cost-new_cost <= tol*cost or
+                             np.abs(step).max() <= tol*(np.abs(q).max()+tol))
+                p = q
+                cost = new_cost
+                break
+            lam *= 10
+            if lam > 1e12:
+                failed = True
+                break
+        if converged or failed:
+            break
+    return (p[0], p[1], p[2], nfev, converged)
+
+def fit_velocity(T, V, v_max=8.0, tau=1.0, delay=0.0):
+    return _fit_velocity(np.asarray(T, dtype=np.float64), np.asarray(V, dtype=np.float64),
+                         float(v_max), float(tau), float(delay), 200, 1e-12)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*
+# python3
+# Author : LJK - Laboratoire Jean Kuntzmann - C. Bligny
+"""
+Accuracy and speed of the automatic analyse, compared to the manual analyses
+(data/analyse_manuelle_juillet2019.csv).
+
+The radar files are read once, then all the analyse variants (bounds and outliers
+options, .rad or .rda files) run in the same pool of processes. Sprints are matched on
+the normalized title. For each variant : the error statistics (%) of each metric, and
+the analyse time.
+    python manual_compare.py [-d dir] [--workers 4]
+"""
+
+import contextlib
+import glob
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from sprof.settings import PROJECT_DIR, RADAR_DATA_DIR, PFV_ANALYSE_DIR
+from sprof.radar_file import RadarFile
+from sprof.pfv_dataset import PFVDataset, analyse_RF_row
+
+MANUAL_FILE = os.path.join(PROJECT_DIR, 'data', 'analyse_manuelle_juillet2019.csv')
+
+# Variants : (name, file extension, auto, outliers)
+# the manual analyses were done on the prepared files (.rad), with manual sprint bounds
+VARIANTS = (('nodefaults', '.rad', False, False),
+            ('outliers', '.rad', False, True),
+            ('bounds', '.rad', True, False),
+            ('auto', '.rad', True, True),
+            ('auto_rda', '.rda', True, True))
+
+# ------ Methods ------------------------------------------------------------------------
+
+def read_manual(file=MANUAL_FILE):
+    """ Returns the manual analyses dataframe
+    """
+    import pandas as pd
+    return pd.read_csv(file, decimal=",")
+
+def load_radar_files(dir=RADAR_DATA_DIR, exts=('.rad', '.rda')):
+    """ Read all the radar files of dir, once. Returns a dictionnary ext : list of RadarFile
+    """
+    rfs = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for ext in exts:
+            rfs[ext] = [RadarFile(file) for file in sorted(glob.glob(os.path.join(dir, '*'+ext)))]
+    return rfs
+
+def timed_row(rf, auto, outliers):
+    """ Analyse a RadarFile in a worker process. Returns (row values, duration)
+    """
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        row = analyse_RF_row(rf, auto=auto, outliers=outliers)
+    return (row, time.perf_counter()-start_time)
+
+def warm_up(tasks):
+    """ Worker initializer : runs the tasks (rf, auto, outliers) once, so that the imports
+        and first calls costs are not counted in the time of the first variant
+    """
+    for (rf, auto, outliers) in tasks:
+        timed_row(rf, auto, outliers)
+
+def run_variants(rfs, variants=VARIANTS, workers=None):
+    """ Run all the variants in a pool of processes, warmed up first (one analyse of each
+        variant per process).
+        Returns a dictionnary name : (dataset, analyse time (s) of the variant)
+    """
+    jobs = {}
+    tasks = [(rfs[ext][0], auto, outliers) for (name, ext, auto, outliers) in variants if rfs.get(ext)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=warm_up, initargs=(tasks,)) as executor:
+        for (name, ext, auto, outliers) in variants:
+            jobs[name] = [executor.submit(timed_row, rf, auto, outliers) for rf in rfs.get(ext, [])]
+        results = {}
+        for (name, futures) in jobs.items():
+            rows = [future.result() for future in futures]
+            ds = PFVDataset(name)
+            ds.add_rows([row for (row, duration) in rows])
+            results[name] = (ds, sum(duration for (row, duration) in rows))
+    return results
+
+def error_stats(df_diff):
+    """ Error statistics (%) of each metric, from a PFVDataset.compare dataframe
+    """
+    df = df_diff[PFVDataset.COMPARE_COLS].abs()
+    stats = df.agg(['mean', 'median', 'max']).T
+    stats['rmse'] = (df_diff[PFVDataset.COMPARE_COLS]**2).mean()**0.5
+    stats['n'] = df.count()
+    return stats.round(2)
+
+def compare_variants(results, df_man):
+    """ Returns the summary dataframe : one row per (variant, metric), and the compare
+        dataframes of each variant
+    """
+    import pandas as pd
+    summary = []
+    diffs = {}
+    for (name, (ds, duration)) in results.items():
+        diffs[name] = ds.compare(df_man)
+        stats = error_stats(diffs[name])
+        stats.insert(0, 'variant', name)
+        stats['time (s)'] = round(duration, 3)
+        summary.append(stats)
+    summary = pd.concat(summary).rename_axis('metric').reset_index()
+    return (summary, diffs)
+
+def run_compare(dir=RADAR_DATA_DIR, variants=VARIANTS, workers=None, manual_file=MANUAL_FILE):
+    """ Read the files, run the variants, compare to the manual analyses.
+        Returns (summary, diffs), cf compare_variants
+    """
+    start_time = time.perf_counter()
+    rfs = load_radar_files(dir, exts=tuple({v[1] for v in variants}))
+    load_time = time.perf_counter()-start_time
+    results = run_variants(rfs, variants, workers)
+    run_time = time.perf_counter()-start_time-load_time
+    (summary, diffs) = compare_variants(results, read_manual(manual_file))
+    n_files = sum(len(l) for l in rfs.values())
+    print(f"{n_files} fichiers lus en {load_time:.2f} s, {len(variants)} variantes analysées en {run_time:.2f} s")
+    return (summary, diffs)
+
+# ------ Main ---------------------------------------------------------------------------
+if __name__ == "__main__":
+    import argparse
+    import pandas as pd
+    from datetime import datetime
+
+    parser = argparse.ArgumentParser(description="Comparaison aux analyses manuelles")
+    parser.add_argument('--dir', '-d', default=RADAR_DATA_DIR, help='Répertoire contenant les données')
+    parser.add_argument('--workers', type=int, default=None, help='Nombre de process')
+    parser.add_argument('--save', action='store_true', help=f"Sauvegarder les résultats dans {PFV_ANALYSE_DIR}")
+    args = parser.parse_args()
+
+    (summary, diffs) = run_compare(args.dir, workers=args.workers)
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 200):
+        print(summary)
+
+    if args.save:
+        prefix = os.path.join(PFV_ANALYSE_DIR, datetime.now().strftime("%y%m%d")+'_manual_compare')
+        summary.to_csv(prefix+'.csv', index=None)
+        for (name, df_diff) in diffs.items():
+            df_diff.to_csv(f"{prefix}_{name}.csv", index=None)
+        print(f"Résultats sauvegardés : {prefix}*.csv")
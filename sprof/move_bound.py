@@ -4,19 +4,29 @@
 """
 Move interactively sprint bounds, and print new pfv values
 Usage : python move_bound.py [param]
+
+The results for the bounds around the automatic ones are computed in a background
+process (bound_lattice.py) : they are displayed while the bounds are dragged.
+
+The figure artists are created once. An update only changes their data, and redraws
+them over the saved background (blitting). Mouse motion is handled at most FRAME_RATE
+times per second.
 """
 # To be improved, using inter-class links ?
 
 import os
 import sys
-import matplotlib.pyplot as plt
+import time
 from sprof.athlete import get_athlete_values
 from sprof.radar_data import build_RD_from_file
 from sprof.sprint import Sprint
-from sprof.pfv import PFV
+from sprof.utils import get_pyplot
+from sprof.bound_lattice import BoundLattice, VALUES, get_index, get_values
 
 class MoveBound:
 
+    FRAME_RATE = 30 # max number of redraws per second, while dragging
+
     def __init__(self, t_bound_min, t_bound_max, t_min, t_max, radar_data):
     
         self.t_bound_min = t_bound_min
@@ -30,94 +40,184 @@ class MoveBound:
         self.r=radar_data
         
         # fin athlete, mass and stature
-        (mass,stature)=get_athlete_values(r.title)
+        (mass,stature)=get_athlete_values(radar_data.title)
         self.mass=mass
         self.stature=stature
         
-        (Tsprint,Vsprint)=r.extract_sprint()
+        (Tsprint,Vsprint)=radar_data.extract_sprint()
         #self.s = Sprint(Tsprint, Vsprint, r.title, outliers=False)
-        self.s = Sprint(Tsprint, Vsprint, r.title)
-        self.p = PFV(v_max=self.s.v_max, tau=self.s.tau, duration=self.s.duration, mass=self.mass, stature=self.stature)
+        self.s = Sprint(Tsprint, Vsprint, radar_data.title)
+        
+        # current values : v_max, tau, V0, F0_kg, Pmax_kg, sfv. Same PFV parameters as the
+        # lattice and the updates : no variation at the initial bounds
+        self.values=get_values(self.s, mass, stature)
+        self.first_values=dict(self.values)
+        print(f"first svf : {self.first_values['sfv']}")
         
-        self.first_vmax=self.s.v_max
-        self.first_tau=self.s.tau
-        self.first_V0=self.p.V0
-        self.first_F0_kg=self.p.F0_kg
-        self.first_Pmax_kg=self.p.Pmax_kg
-        self.first_sfv=self.p.sfv
-        print(f"first svf : {self.first_sfv}")
+        # current bounds, as lattice keys (radar data indexes, None : computed end)
+        self.i_start=radar_data.i_start_sprint
+        self.k_end=None
         
+        # results for the bounds around, computed in a background process
+        self.lattice=BoundLattice(radar_data, get_index(radar_data.T, self.s.T_sprint[self.s.i_end_acc]), mass, stature)
+        self.lattice.start()
+        
+        self.active_line=None
+        self.last_motion=0
+        self.last_x=None
+        self.background=None
         self._init_figure()
         
+    def get_ratio(self, name, values=None):
+        """ Variation (%) of a value since the previous update
+        """
+        values = values or self.values
+        return round((values[name]-self.first_values[name])*100/self.first_values[name],2)
+        
     @property
     def vmax_ratio(self):
-        return round((self.s.v_max-self.first_vmax)*100/self.first_vmax,2)
+        return self.get_ratio('v_max')
 
     @property
     def tau_ratio(self):
-        return round((self.s.tau-self.first_tau)*100/self.first_tau,2)    
+        return self.get_ratio('tau')
 
     @property
     def V0_ratio(self):
-        return round((self.p.V0-self.first_V0)*100/self.first_V0 ,2)
+        return self.get_ratio('V0')
 
     @property
     def F0_ratio(self):
-        return round((self.p.F0_kg-self.first_F0_kg)*100/self.first_F0_kg ,2)
+        return self.get_ratio('F0_kg')
         
     @property
     def Pmax_ratio(self):
-        return round((self.p.Pmax_kg-self.first_Pmax_kg)*100/self.first_Pmax_kg,2)
+        return self.get_ratio('Pmax_kg')
        
     @property
     def sfv_ratio(self):
-        print("Calcul sfv ratio")
-        print(f"first sfv : {self.first_sfv}")
-        print(f"sfv : {self.p.sfv}")
-        return round((self.p.sfv-self.first_sfv)*100/self.first_sfv,2)
+        return self.get_ratio('sfv')
+    
+    def get_ratios_text(self, values, exact=True):
+        """ Text displayed on the figure : variation of the values
+        """
+        approx = "" if exact else "~ "
+        names = {'v_max':'v max', 'tau':'tau', 'V0':'V0', 'F0_kg':'F0', 'Pmax_kg':'Pmax', 'sfv':'sfv'}
+        return "\n".join(f"{names[name]} : {approx}{self.get_ratio(name, values):+.2f} %" for name in VALUES)
     
     def _init_figure(self):
+        plt = get_pyplot()
+        self.fig = plt.figure(1)
+        self.canvas = self.fig.canvas
+        ax = self.fig.gca()
 
+        # static artists, in the saved background
+        ax.plot(self.r.T, self.r.V, alpha=0.5)
         # pour info, on affiche toujours les valeurs initiales
-        plt.axvline(x=self.t_bound_min_initial, linewidth=1)
-        plt.axvline(x=self.t_bound_max_initial, linewidth=1)
+        ax.axvline(x=self.t_bound_min_initial, linewidth=1)
+        ax.axvline(x=self.t_bound_max_initial, linewidth=1)
 
-        t_sprint_acc_end = self.s.T_sprint[self.s.i_end_acc]
-        self.t_bound_max = t_sprint_acc_end
+        # artists updated with the bounds, drawn over the background
+        self.plot(ax)
+        self.line_min = ax.axvline(x=self.t_bound_min, linewidth=1,picker=5, linestyle='--', color='black', animated=True)
+        self.line_max = ax.axvline(x=self.t_bound_max, linewidth=1,picker=5, linestyle='--', color='black', animated=True)
 
-        self.line_min = plt.axvline(x=self.t_bound_min, linewidth=1,picker=5, linestyle='--', color='black')
-        self.line_max = plt.axvline(x=self.t_bound_max, linewidth=1,picker=5, linestyle='--', color='black')    
-    
-        #self.canvas=self.line.get_figure().canvas
-        self.canvas=plt.figure(1).canvas
+        # variations, updated while dragging
+        self.text = self.fig.text(0.01, 0.99, "", va='top', fontsize=8, animated=True)
+        self.artists += [self.line_min, self.line_max, self.text]
+        self._update_artists()
+
+        self.canvas.mpl_connect('draw_event', self.on_draw)
         self.canvas.mpl_connect('pick_event', self.onpick)
-        self.canvas.draw()
-        
-        self.active_line=None
- 
+        self.canvas.mpl_connect('motion_notify_event', self.follow_mouse)
+        self.canvas.mpl_connect('button_release_event', self.release_mouse)
+
+    def on_draw(self, event):
+        """ Full draw (first draw, resize ...) : save the background, without the
+            animated artists
+        """
+        if self.canvas.supports_blit:
+            self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_artists()
+
+    def _draw_artists(self):
+        for artist in self.artists:
+            self.fig.draw_artist(artist)
+
+    def _blit(self):
+        """ Redraw the animated artists only
+        """
+        if self.background is None:
+            # no background yet, or blitting not supported by the backend
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self.background)
+        self._draw_artists()
+        self.canvas.blit(self.fig.bbox)
+
+    def _update_artists(self):
+        """ Set the data of the animated artists from the current sprint and values
+        """
+        s = self.s
+        self.line_sprint.set_data(s.T_sprint, s.V_sprint)
+        self.line_model.set_data(s.T_sprint_acc, s.V_model)
+        self.line_smooth.set_data(s.T_sprint, s.V_smooth)
+        self.line_v_max.set_ydata([s.v_max, s.v_max])
+        self.line_vs_max.set_ydata([s.vs_max, s.vs_max])
+        for (line, i) in ((self.line_i_vs_max, s.i_vs_max), (self.line_start_plateau, s.i_start_plateau),
+                          (self.line_end_plateau, s.i_end_plateau)):
+            line.set_xdata([s.T_sprint[i], s.T_sprint[i]])
+
+        self.t_bound_max = s.T_sprint[s.i_end_acc]
+        self.line_min.set_xdata([self.t_bound_min, self.t_bound_min])
+        self.line_max.set_xdata([self.t_bound_max, self.t_bound_max])
+        self.text.set_text(self.get_ratios_text(self.values))
+
     def onpick(self, event):
         artist = event.artist
         #print(artist)
         
         if (self.line_min == artist):
             self.active_line = self.line_min
-        else:
+        elif (self.line_max == artist):
             self.active_line = self.line_max
         
-        self.follower = self.canvas.mpl_connect("motion_notify_event", self.follow_mouse)
-        self.releaser = self.canvas.mpl_connect("button_release_event", self.release_mouse)
-        #print(releaser)
-        
     def follow_mouse(self,event):
         # delclanche pour chaque line
+        if self.active_line is None or event.xdata is None:
+            return
+        self.last_x = event.xdata
+        # no more than FRAME_RATE redraws per second : the other events are dropped
+        now = time.perf_counter()
+        if now-self.last_motion < 1/self.FRAME_RATE:
+            return
+        self.last_motion = now
+
         self.active_line.set_xdata([event.xdata, event.xdata])
-        #self.line.set_xdata([event.xdata, event.xdata])
-        self.canvas.draw_idle()
+        
+        # values from the lattice, for the dragged bound
+        (values, exact) = self.lattice.lookup(*self._get_keys(event.xdata))
+        if values:
+            self.text.set_text(self.get_ratios_text(values, exact))
+        self._blit()
+        
+    def _get_keys(self, x):
+        """ Lattice keys if the active line is moved to x
+        """
+        if self.active_line == self.line_min:
+            x=self._check_new_value(x, self.t_min, self.t_middle)
+            return (get_index(self.r.T, x), None)
+        x=self._check_new_value(x, self.t_middle, self.t_max)
+        return (self.i_start, get_index(self.r.T, x))
         
     def release_mouse(self,event):
-        #self.line= event.artist
-        #line = event.artist
-        x=event.xdata
+        if self.active_line is None:
+            return
+        # released outside of the axes : last position
+        x=event.xdata if event.xdata is not None else self.last_x
+        if x is None:
+            self.active_line=None
+            return
         print(f" event data : {x}")
         #new_t = self._check_new_value(x)
         
@@ -127,19 +227,17 @@ class MoveBound:
         else:
             x=self._check_new_value(x, self.t_middle, self.t_max)
             self._update_upper(x)
-            
-        self.canvas.mpl_disconnect(self.releaser)
-        self.canvas.mpl_disconnect(self.follower)
     
-        #self.active_line.set_xdata([x, x])
-        fig.canvas.draw_idle()
         self.active_line=None
+        self.last_x=None
    
     def _update_lower(self,new_t_sprint_start):
         print("---------- Update sprint lower bound ----------")
         #self.r.set_sprint_bounds(t_start=new_t_sprint_start)
         self.r.set_sprint_start(t_start=new_t_sprint_start)
         self.t_bound_min=new_t_sprint_start
+        self.i_start=self.r.i_start_sprint
+        self.k_end=None
 
         (Tsprint,Vsprint) = self.r.extract_sprint()
         self.s = Sprint(Tsprint, Vsprint, self.r.title)
@@ -153,6 +251,7 @@ class MoveBound:
         self.t_bound_max=new_t_sprint_end
         
         self.s.set_end_acc(new_t_sprint_end)
+        self.k_end=get_index(self.r.T, new_t_sprint_end)
         
 
         self._update_data()
@@ -166,23 +265,21 @@ class MoveBound:
         print(f"\tv max = {self.s.v_max:.2f}, tau = {self.s.tau:.2f}, delay = {self.s.delay:.2f}, duration = {self.s.duration:.2f}")
 
         #self.p = PFV(v_max=self.s.v_max, tau=self.s.tau, duration=self.s.duration, mass=self.mass, stature=self.stature, pression=760)
-        self.p = PFV(v_max=self.s.v_max, tau=self.s.tau, duration=4, mass=self.mass, stature=self.stature, pression=760)
-        
+        # PFV values from the lattice if available, else computed (and kept)
+        (values, exact) = self.lattice.lookup(self.i_start, self.k_end)
+        if not exact:
+            values = get_values(self.s, self.mass, self.stature)
+            self.lattice.add(self.i_start, self.k_end, values)
+            # outside of the lattice : compute the bounds around
+            self.lattice.refine(self.i_start, get_index(self.r.T, self.s.T_sprint[self.s.i_end_acc]))
+        self.values = values
         
         self.print_infos()      
         
-        plt.clf()
-        self.plot()
-        self._init_figure()
-        self.canvas.draw()
-        
         # Si on veut calculer les ratio par rapport à la valeur précédent
-        self.first_vmax=self.s.v_max
-        self.first_tau=self.s.tau
-        self.first_V0=self.p.V0
-        self.first_F0_kg=self.p.F0_kg
-        self.first_Pmax_kg=self.p.Pmax_kg
-        self.first_sfv=self.p.sfv
+        self.first_values=dict(self.values)
+        self._update_artists()
+        self._blit()
 
     def _check_new_value(self, new_value, min, max):
         if (new_value):
@@ -193,17 +290,20 @@ class MoveBound:
 
         return new_value
             
-    def plot(self):
+    def plot(self, ax):
+        """ Creates the sprint artists (animated), data set by _update_artists
+        """
         #self.r.plot_bounds()
-        plt.plot(self.r.T, self.r.V, alpha=0.5)
-        plt.plot(self.s.T_sprint, self.s.V_sprint, alpha=0.5)
-        plt.plot(self.s.T_sprint_acc, self.s.V_model,color='r')#, alpha=0.5)
-        plt.plot(self.s.T_sprint, self.s.V_smooth,color='g')
-        plt.axhline(y=self.s.v_max, linewidth=1,linestyle='--',color='r')
-        plt.axhline(y=self.s.vs_max, linewidth=1,linestyle='--', color='g')
-        plt.axvline(x=self.s.T_sprint[self.s.i_vs_max], linewidth=1, alpha=0.5)
-        plt.axvline(x=self.s.T_sprint[self.s.i_start_plateau], linewidth=1,alpha=0.5) 
-        plt.axvline(x=self.s.T_sprint[self.s.i_end_plateau], linewidth=1,alpha=0.5)       
+        (self.line_sprint,) = ax.plot(self.s.T_sprint, self.s.V_sprint, alpha=0.5, animated=True)
+        (self.line_model,) = ax.plot(self.s.T_sprint_acc, self.s.V_model,color='r', animated=True)#, alpha=0.5)
+        (self.line_smooth,) = ax.plot(self.s.T_sprint, self.s.V_smooth,color='g', animated=True)
+        self.line_v_max = ax.axhline(y=self.s.v_max, linewidth=1,linestyle='--',color='r', animated=True)
+        self.line_vs_max = ax.axhline(y=self.s.vs_max, linewidth=1,linestyle='--', color='g', animated=True)
+        self.line_i_vs_max = ax.axvline(x=self.s.T_sprint[self.s.i_vs_max], linewidth=1, alpha=0.5, animated=True)
+        self.line_start_plateau = ax.axvline(x=self.s.T_sprint[self.s.i_start_plateau], linewidth=1,alpha=0.5, animated=True) 
+        self.line_end_plateau = ax.axvline(x=self.s.T_sprint[self.s.i_end_plateau], linewidth=1,alpha=0.5, animated=True)
+        self.artists = [self.line_sprint, self.line_model, self.line_smooth, self.line_v_max, self.line_vs_max,
+                        self.line_i_vs_max, self.line_start_plateau, self.line_end_plateau]
     
     def print_infos(self):
         #v_smooth=self.r.V_smooth[self.r.i_end_sprint]
@@ -242,13 +342,12 @@ if __name__ == "__main__":
         t_max=r.T[-1]
         #print(f"\tt start = { t_sprint_min:.2f}, t end = {t_sprint_max:.2f}")
         move = MoveBound(t_sprint_min, t_sprint_max,t_min,t_max, r) 
-        move.plot()
         #v_line=DraggableLine(line_start,line_stop,r)
       
-        fig = plt.figure(1)
-        fig.canvas.draw()
+        fig = move.fig
         strTitle=r.title#+' '+r.file_ext
         fig.suptitle(strTitle, fontsize=16)
         
         #fig.title(f"{r.title}, format : {r.file_ext}")
-        plt.show()
+        get_pyplot().show()
+        move.lattice.stop()
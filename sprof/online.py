@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*
+# python3
+# Author : LJK - Laboratoire Jean Kuntzmann - C. Bligny
+"""
+Online sprint detection : the radar samples are given one by one, as they arrive (pipe,
+serial port, replay of a file), and the detector emits events without waiting for the
+end of the recording.
+
+The state kept is the same for each sample (no data array) :
+    - smoothed velocity : same butterworth filter as RadarData.V_smooth, but causal
+      (filtfilt needs the whole data), so a bit late
+    - rest level : mean velocity while at rest
+    - sprint : start time, max smoothed velocity, distance from the start
+
+Events, as dictionnaries {'event', 'time', 'sample', ...} :
+    start : the smoothed velocity goes above REST_SPEED (cf segmentation.py). t_start :
+        last sample at rest level, before
+    top_speed : the max velocity was not exceeded during TOP_SPEED_DELAY, and is a
+        sprint velocity (RadarData.SPRINT_VMAX_MIN, SPRINT_VMAX_MAX)
+    end : the smoothed velocity falls below the plateau (RadarData.PLATEAU_RATIO, as
+        RadarData.find_sprint_end)
+    cancel : back to rest, without a sprint velocity
+top_speed and end give provisional parameters of the velocity model
+v(t) = v_max*(1-exp(-(t-t_start)/tau)) : v_max is the max smoothed velocity, and tau
+comes from the distance, d(t) = v_max*(t-t_start-tau) once the acceleration is over.
+The final values are given by the analyse of the recording (Sprint) : on the test
+files, the provisional tau is ~0.3 s lower.
+
+    detector = OnlineDetector(sample_rate, callback=print)
+    for (t, v) in samples:
+        detector.feed(t, v)
+"""
+
+from sprof.radar_data import RadarData
+from sprof.segmentation import REST_SPEED
+from sprof.utils import get_butter
+
+REST_NOISE = 0.5 # m/s, above the rest level : the athlete moves
+REST_TIME = 2.0 # s, rest level time constant
+TOP_SPEED_DELAY = 0.5 # s
+
+# states
+REST = 0
+ACCELERATION = 1
+PLATEAU = 2
+DECELERATION = 3
+
+# ------ OnlineDetector Class -----------------------------------------------------------
+
+class OnlineDetector:
+
+    def __init__(self, sample_rate=46.875, callback=None):
+        """ callback : function called with each event (dictionnary)
+        """
+        self.sample_rate = sample_rate
+        self.callback = callback
+        (self.b, self.a) = (list(c) for c in get_butter(2, RadarData.SMOOTH_CUTOFF))
+        self.rest_alpha = 1/(REST_TIME*sample_rate)
+        self.reset()
+
+    def reset(self):
+        # smoothing filter state (transposed direct form II)
+        self.z = None
+        self.v_smooth = 0.0
+        self.rest_level = None
+        self.state = REST
+        self.i = -1 # last sample index
+        self.t = None # last sample time
+        self._init_sprint()
+        self._t_rest = None # last time at rest level
+        self._d_rest = 0.0 # distance since _t_rest
+
+    def _init_sprint(self):
+        self.t_start = None
+        self.distance = 0.0 # from the last time at rest
+        self.vs_max = 0.0
+        self.t_vs_max = None
+        self.d_vs_max = 0.0 # distance at t_vs_max
+        self.t_top = None
+
+    # ------ Samples ----------------------------------------------------------------------
+
+    def feed(self, t, v):
+        """ Add a sample (time s, velocity m/s). Returns the list of the events
+        """
+        dt = 0.0 if self.t is None else t-self.t
+        self.i += 1
+        self.t = t
+        self._smooth(v)
+        events = []
+
+        # rest level, and last time at rest : start of the next sprint
+        if self.state == REST:
+            if self.rest_level is None:
+                self.rest_level = v
+            self.rest_level += self.rest_alpha*(min(self.v_smooth, v)-self.rest_level)
+        if self.state in (REST, ACCELERATION) and v <= self.rest_level+REST_NOISE and self.v_smooth < REST_SPEED:
+            (self._t_rest, self._d_rest) = (t, 0.0)
+        else:
+            self._d_rest += v*dt
+
+        if self.state == REST:
+            if self.v_smooth >= REST_SPEED:
+                self.state = ACCELERATION
+                self._init_sprint()
+                events.append(self._event('start', t_start=self._t_rest if self._t_rest is not None else t))
+        else:
+            self.distance = self._d_rest
+            if self.v_smooth > self.vs_max:
+                (self.vs_max, self.t_vs_max, self.d_vs_max) = (self.v_smooth, t, self._d_rest)
+
+            if self.state == ACCELERATION:
+                if (t-self.t_vs_max >= TOP_SPEED_DELAY and
+                        RadarData.SPRINT_VMAX_MIN <= self.vs_max <= RadarData.SPRINT_VMAX_MAX):
+                    self.state = PLATEAU
+                    self.t_top = t
+                    events.append(self._event('top_speed', **self.params))
+            elif self.state == PLATEAU:
+                if self.v_smooth < self.vs_max*(1-RadarData.PLATEAU_RATIO):
+                    self.state = DECELERATION
+                    events.append(self._event('end', t_end=t, **self.params))
+
+            if self.v_smooth < REST_SPEED:
+                if self.state == ACCELERATION:
+                    events.append(self._event('cancel', v_max=self.vs_max))
+                self.state = REST
+                self._t_rest = t
+
+        if self.callback:
+            for event in events:
+                self.callback(event)
+        return events
+
+    def feed_many(self, T, V):
+        """ Add the samples (T, V arrays). Returns the list of the events
+        """
+        events = []
+        for (t, v) in zip(T, V):
+            events += self.feed(float(t), float(v))
+        return events
+
+    def _smooth(self, v):
+        (b, a) = (self.b, self.a)
+        if self.z is None:
+            # steady state for the first value : v_smooth starts at v (as scipy
+            # lfilter_zi(b, a)*v, filter with unit gain)
+            self.z = [v*(1-b[0]), v*(b[2]-a[2])]
+        y = b[0]*v+self.z[0]
+        self.z[0] = b[1]*v-a[1]*y+self.z[1]
+        self.z[1] = b[2]*v-a[2]*y
+        self.v_smooth = y
+
+    # ------ Provisional parameters -------------------------------------------------------
+
+    @property
+    def params(self):
+        """ Provisional parameters of the current sprint : v_max, tau, t_start, t_vs_max
+        """
+        if self.t_vs_max is None:
+            return {}
+        # d = v_max*(t-t_start-tau) after the acceleration, at the max velocity time
+        tau = (self.t_vs_max-self.t_start)-self.d_vs_max/self.vs_max
+        return {'v_max':round(self.vs_max, 2), 'tau':round(tau, 2), 't_start':self.t_start,
+                't_vs_max':self.t_vs_max}
+
+    def close(self):
+        """ End of the data. Returns the events : end, if the sprint was not over
+        """
+        events = []
+        if self.state == PLATEAU:
+            self.state = DECELERATION
+            events.append(self._event('end', t_end=self.t, **self.params))
+        if self.callback:
+            for event in events:
+                self.callback(event)
+        return events
+
+    def _event(self, name, **values):
+        if name == 'start':
+            self.t_start = values['t_start']
+        return dict({'event':name, 'time':self.t, 'sample':self.i}, **values)
+
+# ------ Streams ------------------------------------------------------------------------
+
+def read_samples(lines, sample_rate=46.875):
+    """ Generator of the samples (t, v) of text lines :
+            - one velocity per line (time from the sample rate)
+            - time and velocity
+            - .rda or .rad files content (header lines skipped)
+        The lines which are not numbers are ignored
+    """
+    from sprof.radar_file import RadarFile
+    i = 0
+    columns = (0, 1) # time and velocity columns, if several values
+    lines = iter(lines)
+    for line in lines:
+        line = line.strip()
+        # STALKER header : skipped
+        if line == RadarFile.RDA_FIRST_LINE:
+            for k in range(RadarFile.RDA_START_IDX-1):
+                next(lines, None)
+            continue
+        if line == RadarFile.RAD_FIRST_LINE:
+            for k in range(RadarFile.RAD_START_IDX-1):
+                next(lines, None)
+            columns = (1, 2)
+            continue
+        try:
+            values = [float(x) for x in line.replace(',', '.').split()]
+        except ValueError:
+            continue
+        if len(values) == 1:
+            yield (round(i/sample_rate, 2), values[0])
+        elif len(values) > max(columns):
+            yield (values[columns[0]], values[columns[1]])
+        else:
+            continue
+        i += 1
+
+# ------ Main ---------------------------------------------------------------------------
+if __name__ == "__main__":
+    # events of a synthetic session, compared to the parameters
+    # python online.py [n_sprints]
+    import sys
+    import time
+    import numpy as np
+    from sprof.synthetic import generate_session
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    (T, V, params) = generate_session(n, interval=60, seed=0)
+    detector = OnlineDetector()
+    start_time = time.perf_counter()
+    events = detector.feed_many(T, V)+detector.close()
+    duration = time.perf_counter()-start_time
+    print(f"{len(T)} points, {duration/len(T)*1e6:.1f} µs par point")
+
+    # smoothing : same values as scipy lfilter from the steady state, stream not at 0
+    from scipy.signal import lfilter, lfilter_zi
+    V_check = V[:2000]+5
+    detector = OnlineDetector()
+    V_smooth = []
+    for (t, v) in zip(T[:2000], V_check):
+        detector.feed(float(t), float(v))
+        V_smooth.append(detector.v_smooth)
+    (b, a) = get_butter(2, RadarData.SMOOTH_CUTOFF)
+    V_ref = lfilter(b, a, V_check, zi=lfilter_zi(b, a)*V_check[0])[0]
+    print(f"Lissage causal : écart max à lfilter {np.max(np.abs(np.array(V_smooth)-V_ref)):.1e} m/s")
+
+    tops = [e for e in events if e['event'] == 'top_speed']
+    print(f"Evènements : {len(tops)} sprints pour {n}, "
+          f"{sum(e['event'] == 'cancel' for e in events)} annulés")
+    for e in events[:4]:
+        print(e)
+    if len(tops) == n:
+        starts = np.array([e['t_start'] for e in tops])
+        print(f"Ecart moyen (max) : début {np.mean(np.abs(starts-params['delay'])):.2f} s "
+              f"({np.max(np.abs(starts-params['delay'])):.2f}), "
+              f"v_max {np.mean([abs(e['v_max']-v) for (e, v) in zip(tops, params['v_max'])]):.2f} m/s, "
+              f"tau {np.mean([abs(e['tau']-tau) for (e, tau) in zip(tops, params['tau'])]):.2f} s")
@@ -14,8 +14,6 @@ Sources for the calculus : The excel spreashit build by Pierre Samozino
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.stats import linregress
 import logging
 from sprof.sprint import build_sprint_from_file
 from sprof.athlete import get_athlete_values
@@ -250,6 +248,7 @@ class PFV:
 
     def compute_PFV_values(self, t_start=None, t_end = None):
     #def extract_values(self, t_start=0.199, t_end = 4.5):
+        from scipy.stats import linregress
 
         # NB : function force(vitesse) contains also air friction, which is not linear.
         # --> t_start et t_end impacts the computed slope
@@ -5,23 +5,239 @@
 Manage several pfv profiling , save the result to csv file
 """
 import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-import pandas as pd
+from functools import partial
 from sprof.radar_file import params_get_files
-from sprof.analyse import build_analyse_from_file
+from sprof.analyse import build_analyse_from_file, build_analyse_from_RF, analyse_file, AnalyseResult
 from sprof.settings import PFV_ANALYSE_DIR
-from sprof.settings import EXPORT_CSV_DECIMAL, EXPORT_CSV_SEPARATOR
+from sprof.settings import EXPORT_CSV_DECIMAL, EXPORT_CSV_SEPARATOR, EXPORT_TABLE_FORMAT
 from sprof.settings import EXPORT_TIMES, EXPORT_DISTANCES
 
+# batch_fit option : number of sprints fitted together
+BATCH_SIZE = 256
+
+# binary export : formats, and acceleration segment of the sprints (list columns)
+TABLE_FORMATS = ('parquet', 'feather', 'npz')
+SEGMENT_COLS = ('T_sprint', 'V_sprint', 'V_model')
+
 # ------ PFV Dataset Class Builder ------------------------------------------------------
 
-def build_PFV_DS_from_files(files, name="", auto=True, outliers=True):
+def build_PFV_DS_from_files(files, name="", auto=True, outliers=True, workers=None, batch_fit=False,
+                            segments=False, low_memory=False):
+    """ Build a dataset from radar files.
+        workers : number of processes running the analyses (None or 1 : no process)
+        batch_fit : the sprints models are fitted together, by batches of files (cf
+        batch_fit.py)
+        segments : the sprints acceleration segments are kept (export_table)
+        low_memory : the analyses are reduced to compact results (AnalyseResult) as soon
+        as they are built : no arrays kept (not with segments)
+    """
+    if segments and low_memory:
+        raise ValueError("build_PFV_DS_from_files : segments et low_memory incompatibles")
+    ds=PFVDataset(name=name, segments=segments)
+    if batch_fit:
+        ds.add_rows(get_batch_rows(analyse_files_rows, files, workers, auto=auto, outliers=outliers, segments=segments,
+                                   low_memory=low_memory))
+        if files:
+            ds.data_dir=os.path.dirname(files[-1])
+    elif workers and workers > 1:
+        ds.add_rows(get_rows(analyse_file_row, files, workers, auto=auto, outliers=outliers, segments=segments,
+                             low_memory=low_memory))
+        if files:
+            ds.data_dir=os.path.dirname(files[-1])
+    elif low_memory:
+        ds.add_rows(analyse_file_row(file, auto=auto, outliers=outliers, low_memory=True) for file in files)
+        if files:
+            ds.data_dir=os.path.dirname(files[-1])
+    else:
+        for file in files:
+            ds.add_row_from_file(file, auto=auto, outliers=outliers)
+    return ds
+
+def build_PFV_DS_from_RFs(rfs, name="", auto=True, outliers=True, workers=None, batch_fit=False,
+                          segments=False):
+    """ Build a dataset from already loaded RadarFile instances.
+        workers : number of processes running the analyses (None or 1 : no process)
+        batch_fit : the sprints models are fitted together (cf build_PFV_DS_from_files)
+        segments : the sprints acceleration segments are kept (export_table)
+    """
+    ds=PFVDataset(name=name, segments=segments)
+    if batch_fit:
+        ds.add_rows(get_batch_rows(analyse_RFs_rows, rfs, workers, auto=auto, outliers=outliers, segments=segments))
+    elif workers and workers > 1:
+        ds.add_rows(get_rows(analyse_RF_row, rfs, workers, auto=auto, outliers=outliers, segments=segments))
+    else:
+        for rf in rfs:
+            ds.add_row_from_analyse(build_analyse_from_RF(rf, auto=auto, outliers=outliers))
+    return ds
 
-    ds=PFVDataset(name=name)
+def build_PFV_DS_from_sessions(files, name="", auto=True, outliers=True, chunk_size=None, segments=False):
+    """ Build a dataset from long recordings with several sprints (cf segmentation.py) :
+        one row per sprint.
+        chunk_size : the files are read by chunks of chunk_size points (bounded memory)
+        segments : the sprints acceleration segments are kept (export_table)
+    """
+    from sprof.radar_file import RadarFile
+    from sprof.analyse import iter_analyses_from_segments
+    ds=PFVDataset(name=name, segments=segments)
     for file in files:
-        ds.add_row_from_file(file, auto=auto, outliers=outliers)
+        rf = RadarFile(file, load_data=not chunk_size)
+        ds.add_rows(get_row_values(a, segments) for a in iter_analyses_from_segments(rf, auto=auto, outliers=outliers, chunk_size=chunk_size))
+        ds.data_dir=os.path.dirname(file)
     return ds
 
+# ------ Parallel analyses --------------------------------------------------------------
+# module level functions : run in the worker processes
+
+# dataset used to get the row values, one per process
+_row_ds = None
+
+def get_row_values(a, segments=False):
+    """ Row values of the analyse a. segments : with the acceleration segment
+        (SEGMENT_COLS arrays)
+    """
+    global _row_ds
+    if _row_ds is None:
+        _row_ds = PFVDataset()
+    row = _row_ds.get_row_values(a)
+    if row and segments:
+        row.update(get_segment_values(a.sprint))
+    return row
+
+def get_segment_values(s):
+    """ Acceleration segment of the Sprint s : {T_sprint, V_sprint, V_model}
+    """
+    return {'T_sprint':np.asarray(s.T_sprint_acc, dtype=float), 'V_sprint':np.asarray(s.V_sprint_acc, dtype=float),
+            'V_model':np.asarray(s.V_model, dtype=float)}
+
+def analyse_file_row(file, auto=True, outliers=True, segments=False, low_memory=False):
+    """ Returns the dataset row values of a radar file. None if the analyse failed
+    """
+    if low_memory:
+        return get_row_values(analyse_file(file, auto=auto, outliers=outliers))
+    return get_row_values(build_analyse_from_file(file, auto=auto, outliers=outliers), segments)
+
+def analyse_RF_row(rf, auto=True, outliers=True, segments=False):
+    """ Returns the dataset row values of a RadarFile. None if the analyse failed
+    """
+    return get_row_values(build_analyse_from_RF(rf, auto=auto, outliers=outliers), segments)
+
+def analyse_files_rows(files, auto=True, outliers=True, segments=False, low_memory=False):
+    """ Returns the dataset row values of radar files, with the sprints fitted together
+    """
+    if low_memory:
+        from sprof.batch_fit import build_results_from_files
+        return [get_row_values(r) for r in build_results_from_files(files, auto=auto, outliers=outliers)]
+    from sprof.radar_file import RadarFile
+    return analyse_RFs_rows([RadarFile(file) for file in files], auto=auto, outliers=outliers, segments=segments)
+
+def analyse_RFs_rows(rfs, auto=True, outliers=True, segments=False):
+    """ Returns the dataset row values of RadarFiles, with the sprints fitted together
+    """
+    from sprof.batch_fit import build_analyses_from_RFs
+    return [get_row_values(a, segments) for a in build_analyses_from_RFs(rfs, auto=auto, outliers=outliers)]
+
+def get_batch_rows(func, items, workers, batch_size=BATCH_SIZE, **kwargs):
+    """ Run func(batch, **kwargs) for batches of items, in a pool of processes if
+        workers > 1. Returns the rows, in the items order
+    """
+    items = list(items)
+    batches = [items[i:i+batch_size] for i in range(0, len(items), batch_size)]
+    if workers and workers > 1:
+        # batches small enough to keep all the processes busy
+        size = max(1, min(batch_size, -(-len(items)//(workers*2))))
+        batches = [items[i:i+size] for i in range(0, len(items), size)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(partial(func, **kwargs), batches))
+    else:
+        results = [func(batch, **kwargs) for batch in batches]
+    return [row for rows in results for row in rows]
+
+def get_rows(func, items, workers, **kwargs):
+    """ Run func(item, **kwargs) for all the items in a pool of processes.
+        Returns the results, in the items order
+    """
+    items = list(items)
+    chunksize = max(1, len(items)//(workers*4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(partial(func, **kwargs), items, chunksize=chunksize))
+
+# ------ Binary tables ------------------------------------------------------------------
+# typed columns : float, int, str, and list columns (arrays of floats) ; with pyarrow
+# (parquet, feather), else npz (each list column : values and offsets arrays)
+
+def has_pyarrow():
+    import importlib.util
+    return importlib.util.find_spec('pyarrow') is not None
+
+def get_table_format(filename=None):
+    """ Format given by the filename extension, else EXPORT_TABLE_FORMAT. npz if
+        pyarrow is not installed
+    """
+    ext = os.path.splitext(filename or "")[1][1:].lower()
+    fmt = ext if ext in TABLE_FORMATS else EXPORT_TABLE_FORMAT
+    if fmt != 'npz' and not has_pyarrow():
+        if ext == fmt:
+            raise ImportError(f"pyarrow est nécessaire pour le format {fmt} (pip install pyarrow)")
+        fmt = 'npz'
+    return fmt
+
+def write_table(df, filename, fmt=None):
+    """ Write the dataframe df : columns of numbers, strings, or arrays (list columns)
+    """
+    fmt = fmt or get_table_format(filename)
+    if fmt == 'npz':
+        arrays = {'columns':np.array(df.columns, dtype=str)}
+        for (k, col) in enumerate(df.columns):
+            values = df[col].to_numpy()
+            if values.dtype == object and len(values) and isinstance(values[0], np.ndarray):
+                arrays[f'c{k}'] = np.concatenate(values) if len(values) else np.empty(0)
+                arrays[f'c{k}_offsets'] = np.cumsum([0]+[len(v) for v in values])
+            elif values.dtype == object:
+                arrays[f'c{k}'] = values.astype(str)
+            else:
+                arrays[f'c{k}'] = values
+        # file name kept (np.savez adds .npz)
+        with open(filename, 'wb') as f:
+            np.savez(f, **arrays)
+        return
+    import pyarrow as pa
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(table, filename)
+    else:
+        import pyarrow.feather as feather
+        feather.write_feather(table, filename)
+
+def read_table(filename, columns=None):
+    """ Returns the dataframe of a file written by write_table (list columns : arrays).
+        columns : only these columns
+    """
+    import pandas as pd
+    fmt = get_table_format(filename)
+    if fmt == 'npz':
+        with np.load(filename, allow_pickle=False) as data:
+            values = {}
+            for (k, col) in enumerate(data['columns']):
+                if columns is not None and col not in columns:
+                    continue
+                if f'c{k}_offsets' in data:
+                    (v, offsets) = (data[f'c{k}'], data[f'c{k}_offsets'])
+                    values[col] = [v[offsets[i]:offsets[i+1]] for i in range(len(offsets)-1)]
+                else:
+                    values[col] = data[f'c{k}']
+        return pd.DataFrame(values)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        table = pq.read_table(filename, columns=columns)
+    else:
+        import pyarrow.feather as feather
+        table = feather.read_table(filename, columns=columns)
+    return table.to_pandas()
+
 # ------ PFV Dataset Class --------------------------------------------------------------
 
 class PFVDataset():
@@ -62,11 +278,20 @@ class PFVDataset():
                      }
 
     # compare 2 dataframes
-    COMPARE_COLS = ['V0 (m/s)','F0 (N)','P max (W)','Force-Velocity profile','RF peak','DRF (%)','top speed (m/s)', 'Acceleration constant']
-
-    def __init__(self,name=""):
+    COMPARE_COLS = ['V0 (m/s)','F0 (N)','P max (W)','Force-Velocity profile','RF peak','DRF (%)','top speed (m/s)', 'Acc. constant']
+    # column titles used by the manual analyses
+    COMPARE_TITLES = {'Acceleration constant':'Acc. constant'}
+
+    def __init__(self,name="", segments=False):
+        """ segments : the acceleration segments of the sprints are kept (SEGMENT_COLS),
+            by row (index of self.datas : two sprints can have the same title), for
+            export_table
+        """
+        import pandas as pd
 
         self.name=name
+        self.keep_segments = segments
+        self.segments = {} # self.datas index : (T_sprint, V_sprint, V_model)
 
         # Init the column and column title list
         self.export_cols = self.EXPORT_MAIN_COLS+self._get_optional_export_cols()+self.EXPORT_CHECK_COLS
@@ -115,17 +340,74 @@ class PFVDataset():
         """
         # On teste pas si c'est au bon format, si ya les bonne colonnes
         # --> réservé à data_watcher, et pas très robuste
+        import pandas as pd
         decimal = EXPORT_CSV_DECIMAL
         sep = EXPORT_CSV_SEPARATOR
         if os.path.exists(filename):
             try:
                 df=pd.read_csv(filename, decimal=decimal,sep=sep)#,header=True)
                 self.datas=df
+                self.segments = {}
             except:
                 print(f"Impossible de récupérer des données à partir du fichier {filename}")
         else:
             print(f"Read CSV - fichier {filename} non trouvé")
 
+    def export_table(self, filename=None, segments=None):
+        """ Save datas into a binary file, with typed columns : parquet or feather (if
+            pyarrow is installed), else npz. Format given by the file extension, else
+            EXPORT_TABLE_FORMAT.
+            segments : adds the acceleration segments (SEGMENT_COLS list columns). Default :
+            if kept by the dataset
+            Returns the file name, None if not exported
+        """
+        if self.datas.empty:
+            print("Le dataset est vide, pas d'export")
+            return None
+        fmt = get_table_format(filename)
+        if not(filename):
+            filename = os.path.splitext(self.export_file)[0]+'.'+fmt
+        elif os.path.splitext(filename)[1][1:].lower() != fmt:
+            filename += '.'+fmt
+        df = self.get_typed_datas()
+        if segments is None:
+            segments = bool(self.segments)
+        if segments:
+            # df : same rows order as self.datas
+            empty = np.empty(0)
+            for (k, col) in enumerate(SEGMENT_COLS):
+                df[col] = [self.segments.get(index, (empty,)*3)[k] for index in self.datas.index]
+        write_table(df, filename, fmt)
+        print(f"Données exportées dans le fichier : {filename}")
+        return filename
+
+    def read_table(self, filename):
+        """ Read dataset from a file written by export_table. The segments columns, if
+            any, are read into self.segments (by row)
+        """
+        if not os.path.exists(filename):
+            print(f"Read table - fichier {filename} non trouvé")
+            return
+        df = read_table(filename).reset_index(drop=True)
+        cols = [col for col in SEGMENT_COLS if col in df.columns]
+        self.segments = {}
+        if cols == list(SEGMENT_COLS):
+            self.segments = {k:tuple(np.asarray(v, dtype=float) for v in values)
+                             for (k, values) in enumerate(zip(*(df[col] for col in SEGMENT_COLS)))}
+        self.datas = df.drop(columns=cols)
+
+    def get_typed_datas(self):
+        """ Copy of the datas, with number columns (the empty values : NaN)
+        """
+        import pandas as pd
+        df = self.datas.copy()
+        for col in df.columns:
+            if col == 'Sprint title':
+                df[col] = df[col].astype(str)
+            else:
+                df[col] = pd.to_numeric(df[col].replace("", np.nan), errors='coerce')
+        return df.reset_index(drop=True)
+
     def add_row(self,attr_dict):
         """ Add a raw to the dataset.
             A raw is the data resulting of the analyse of a sprint.
@@ -142,20 +424,10 @@ class PFVDataset():
             dict.update({title:value})
 
         #print(dict)
-        # on met à jour ['Sprint title'] pour que le premier caractere soit en majuscule
-        # bah, faudrait faire ça mieux et le mettre dans utils ?
-        title=dict['Sprint title'].rstrip()
-        if len(title) > 1:
-            title = title[0].upper() + title[1:]
-            title=title.lstrip().lstrip("Juillet").lstrip()
-            if (title[-1].isnumeric() and title[-2].isalpha()):
-                title=title[0:-2]+' '+title[-1]
-            dict['Sprint title']=title
+        dict['Sprint title']=self.normalize_title(dict['Sprint title'])
 
         # on ajoute aux données et on trie par ordre alphabétique
-        self.datas = self.datas.append(dict, ignore_index=True)
-        self.datas=self.datas.sort_values(by=['Sprint title'])
-        self.datas =self.datas.reset_index(drop=True)
+        self._append(dict, [self._get_segment(attr_dict)])
         #self.data=self.datas.set_index('Sprint title')
         #print(self.datas)
         # rechercher du cote de df.loc['new titlte']=['liste',2,'des','valeurs']
@@ -163,36 +435,82 @@ class PFVDataset():
         nb_row_add=self.datas.shape[0]-nb_rows_ini
         return nb_row_add
 
-    def add_row_from_analyse(self, a):
-        """ Add a raw to the dataset.
+    def add_rows(self, rows):
+        """ Add several rows to the dataset, at once.
+            rows : list of dictionnaries, as returned by get_row_values. None values
+            (analyse not complete) are ignored.
+            Returns the number of rows added
+        """
+        import pandas as pd
+        rows = [row for row in rows if row]
+        if not rows:
+            return 0
+        df = pd.DataFrame([{self.export_col_titles[key]:row[key] for key in self.export_cols} for row in rows])
+        df['Sprint title'] = df['Sprint title'].map(self.normalize_title)
+        self._append(df, [self._get_segment(row) for row in rows])
+        return len(rows)
+
+    def _append(self, rows, segments):
+        """ Appends the rows (dataframe, or dictionnary for one row) to the datas, sorted
+            by title. segments : acceleration segment of each row (None : not kept),
+            kept with their row
+        """
+        segments = [self.segments.get(index) for index in self.datas.index]+list(segments)
+        self.datas = self.datas.append(rows, ignore_index=True)
+        self.datas = self.datas.sort_values(by=['Sprint title'], kind='stable')
+        self.segments = {k:segments[index] for (k, index) in enumerate(self.datas.index)
+                         if segments[index] is not None}
+        self.datas = self.datas.reset_index(drop=True)
+
+    def get_row_values(self, a):
+        """ Returns the values of a dataset row, as a dictionnary {column : value}.
             The input parameter is an sprof object "Analyse"
             This method extract the values to put to the dataset from the Analyse object.
+            Returns None if the analyse is not complete
         """
+        if isinstance(a, AnalyseResult):
+            result = a
+        elif not(a and a.pfv and a.sprint):
+            return None
+        else:
+            result = AnalyseResult(a)
 
-        nb_row_add=0
+        # dictionnaire des attributs simplifiés : sans les arrays, et avec les float à 2
+        # digits, nom (titre du sprint) et infos de qualité des données
+        data_dic=result.values()
 
-        if a and a.pfv and a.sprint:
+        # Ajout des temps par distance.
+        for time in EXPORT_TIMES:
+            data_dic.update({self._get_time_colname(time):result.times[time]})
 
-             # dictionnaire des attributs simplifiés : sans les arrays, et avec les float à 2 digits
-            data_dic=a.pfv.simp_vars()
+        # Ajout des distances pour un temps donné
+        for distance in EXPORT_DISTANCES:
+            data_dic.update({self._get_dist_colname(distance):result.distances[distance]})
 
-            #data_dic.update({'name':sprint_name+" sp"})
-            # on met à jour le nom. Vérifier si c'est nécessaire
-            data_dic.update({'name':a.sprint.title})
+        values = {key:data_dic[key] for key in self.export_cols}
+        if self.keep_segments:
+            if result is a:
+                raise ValueError("Segments non disponibles : résultat compact (low_memory)")
+            values.update(get_segment_values(a.sprint))
+        return values
 
-            # Ajout des temps par distance.
-            for time in EXPORT_TIMES:
-                data_dic.update({self._get_time_colname(time):a.pfv.str_time_distance(time)})
+    def _get_segment(self, row):
+        """ Acceleration segment of the row values, None if not kept
+        """
+        if all(col in row for col in SEGMENT_COLS):
+            return tuple(row[col] for col in SEGMENT_COLS)
+        return None
 
-            # Ajout des distances pour un temps donné
-            for distance in EXPORT_DISTANCES:
-                data_dic.update({self._get_dist_colname(distance):a.pfv.str_distance_time(distance)})
+    def add_row_from_analyse(self, a):
+        """ Add a raw to the dataset.
+            The input parameter is an sprof object "Analyse"
+            This method extract the values to put to the dataset from the Analyse object.
+        """
 
-            # on ajoute les infos de qualité des données
-            data_dic.update({'points_out':a.points_out})
-            data_dic.update({'plateau_duration':a.plateau_duration})
-            data_dic.update({'vmax_diff':a.vmax_diff})
+        nb_row_add=0
 
+        data_dic=self.get_row_values(a)
+        if data_dic:
             # ajoute la ligne au dataset
             nb_row_add=self.add_row(data_dic)
 
@@ -217,15 +535,35 @@ class PFVDataset():
 
         return nb_row_add
 
+    def normalize_title(self, title):
+        """ Returns the sprint title, as displayed in the dataset
+        """
+        # on met à jour ['Sprint title'] pour que le premier caractere soit en majuscule
+        # bah, faudrait faire ça mieux et le mettre dans utils ?
+        title=title.rstrip()
+        if len(title) > 1:
+            title = title[0].upper() + title[1:]
+            title=title.lstrip().lstrip("Juillet").lstrip()
+            if (title[-1].isnumeric() and title[-2].isalpha()):
+                title=title[0:-2]+' '+title[-1]
+        return title
+
     def compare(self,df2):
         """
-        Compare the variation (%) between 2 PFV dataframes
+        Compare the variation (%) between 2 PFV dataframes.
+        Rows are matched on the normalized sprint title : only the sprints found in both
+        dataframes are compared.
         Returns a dataframe
         """
-        df1 = self.datas
-
-        df_diff = round( (df1[self.COMPARE_COLS] - df2[self.COMPARE_COLS])*100/abs(df1[self.COMPARE_COLS]), 1)
-        df_diff['Sprint title']=df1['Sprint title']
+        df1 = self.datas.set_index('Sprint title')
+        df2 = df2.rename(columns=self.COMPARE_TITLES)
+        df2 = df2.set_index(df2['Sprint title'].map(self.normalize_title))
+        titles = df1.index.intersection(df2.index)
+        df1 = df1.loc[titles, self.COMPARE_COLS].astype(float)
+        df2 = df2.loc[titles, self.COMPARE_COLS].astype(float)
+
+        df_diff = round( (df1 - df2)*100/abs(df1), 1)
+        df_diff = df_diff.reset_index().rename(columns={'index':'Sprint title'})
 
         return df_diff
 
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*
+# python3
+# Author : LJK - Laboratoire Jean Kuntzmann - C. Bligny
+"""
+Analyse pipeline with cached stages : when an input changes, only the stages depending
+on it are computed again.
+
+    parse (file) -> detect (auto) -> extract (t_start, t_end) -> sprint (outliers)
+        -> fit (t_end_acc) -> pfv (mass, stature, pression, temp) -> row
+    athlete (file) -> pfv
+
+Each stage result is cached, keyed by the stage inputs and the keys of the stages it
+depends on. So a new mass only computes the pfv and row again, a new sprint end does not
+read the file or smooth the radar data again, and going back to previous values uses
+the cached results.
+
+    p = AnalysePipeline(file)
+    p.analyse           # Analyse instance
+    p.set_mass(80)      # -> pfv, row
+    p.set_bounds(t_end=6.2)
+    p.row               # -> extract, sprint, fit, pfv, row
+"""
+
+import copy
+from collections import OrderedDict
+from sprof.radar_file import RadarFile
+from sprof.radar_data import RadarData
+from sprof.sprint import Sprint
+from sprof.pfv import PFV
+from sprof.analyse import Analyse
+from sprof.athlete import get_athlete_values
+from sprof.instrument import timers
+
+# ------ AnalysePipeline Class ----------------------------------------------------------
+
+class AnalysePipeline:
+
+    # stage : (stages it depends on, inputs)
+    STAGES = OrderedDict((('parse', ((), ('file',))),
+                          ('athlete', ((), ('file',))),
+                          ('detect', (('parse',), ('auto',))),
+                          ('extract', (('detect',), ('t_start', 't_end'))),
+                          ('sprint', (('extract',), ('outliers',))),
+                          ('fit', (('sprint',), ('t_end_acc',))),
+                          ('pfv', (('fit', 'athlete'), ('mass', 'stature', 'pression', 'temp'))),
+                          ('row', (('pfv',), ()))))
+
+    CACHE_SIZE = 8 # results kept for each stage
+
+    def __init__(self, file, auto=True, outliers=True, t_start=None, t_end=None,
+                 t_end_acc=None, mass=None, stature=None, pression=None, temp=None):
+
+        # inputs. None values for the bounds : computed (auto), or all data
+        # None values for mass and stature : from the athlete data file
+        self.inputs = {'file':file, 'auto':auto, 'outliers':outliers,
+                       't_start':t_start, 't_end':t_end, 't_end_acc':t_end_acc,
+                       'mass':mass, 'stature':stature, 'pression':pression, 'temp':temp}
+
+        self._cache = {stage:OrderedDict() for stage in self.STAGES}
+        self.computed = {stage:0 for stage in self.STAGES} # number of computations
+
+    # ------ Setters --------------------------------------------------------------------
+
+    def set(self, **inputs):
+        for (name, value) in inputs.items():
+            if name not in self.inputs:
+                raise KeyError(f"AnalysePipeline : paramètre inconnu {name}")
+            self.inputs[name] = value
+
+    def set_bounds(self, t_start=None, t_end=None):
+        """ Sprint bounds (s). None : computed bound (auto), or first/last point
+        """
+        self.set(t_start=t_start, t_end=t_end)
+
+    def set_end_acc(self, t_end_acc=None):
+        """ End of the acceleration (s). None : computed by Sprint
+        """
+        self.set(t_end_acc=t_end_acc)
+
+    def set_mass(self, mass=None, stature=None):
+        self.set(mass=mass, stature=stature)
+
+    def set_conditions(self, pression=None, temp=None):
+        self.set(pression=pression, temp=temp)
+
+    def set_outliers(self, outliers=True):
+        self.set(outliers=outliers)
+
+    # ------ Results --------------------------------------------------------------------
+
+    @property
+    def radar_file(self):
+        return self.get('parse')
+
+    @property
+    def radar_data(self):
+        return self.get('extract')[0]
+
+    @property
+    def sprint(self):
+        return self.get('fit')
+
+    @property
+    def pfv(self):
+        return self.get('pfv')
+
+    @property
+    def row(self):
+        """ Dataset row values (cf PFVDataset.get_row_values), None if no sprint found
+        """
+        return self.get('row')
+
+    @property
+    def analyse(self):
+        """ Analyse instance, None if no sprint found
+        """
+        s = self.sprint
+        if s is None:
+            return None
+        return Analyse(radar_file=self.radar_file, radar_data=self.radar_data, sprint=s, pfv=self.pfv)
+
+    # ------ Stages ---------------------------------------------------------------------
+
+    def key(self, stage):
+        """ Cache key of a stage : its inputs, and the keys of the stages it depends on
+        """
+        (depends, inputs) = self.STAGES[stage]
+        return (tuple(self.key(d) for d in depends), tuple(self.inputs[i] for i in inputs))
+
+    def get(self, stage):
+        """ Returns the stage result, from the cache if the inputs did not change
+        """
+        key = self.key(stage)
+        cache = self._cache[stage]
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+
+        (depends, inputs) = self.STAGES[stage]
+        args = [self.get(d) for d in depends] + [self.inputs[i] for i in inputs]
+        with timers.stage(stage):
+            result = getattr(self, '_run_'+stage)(*args)
+        self.computed[stage] += 1
+
+        cache[key] = result
+        if len(cache) > self.CACHE_SIZE:
+            cache.popitem(last=False)
+        return result
+
+    def _run_parse(self, file):
+        return RadarFile(file)
+
+    def _run_athlete(self, file):
+        return get_athlete_values(file)
+
+    def _run_detect(self, rf, auto):
+        return RadarData(rf.T, rf.V, rf.title, auto=auto)
+
+    def _run_extract(self, rd, t_start, t_end):
+        """ Returns (radar data with the bounds, T sprint, V sprint), or None
+        """
+        if rd.data_error:
+            return (rd, None, None)
+        # the detect result is shared by all the bounds : set the bounds on a copy
+        rd = copy.copy(rd)
+        if len(rd.V_model_simp) > 0:
+            rd.reset_sprint_bounds()
+        else:
+            rd.set_sprint_total()
+        if t_start is not None:
+            rd.set_sprint_start(t_start)
+        if t_end is not None:
+            rd.set_sprint_end(t_end)
+        (T, V) = rd.extract_sprint()
+        return (rd, T, V)
+
+    def _run_sprint(self, extract, outliers):
+        (rd, T, V) = extract
+        if T is None or len(T) == 0:
+            return None
+        return Sprint(T, V, rd.title, outliers=outliers)
+
+    def _run_fit(self, s, t_end_acc):
+        if s is None or t_end_acc is None:
+            return s
+        # set_end_acc replaces the model arrays : a shallow copy keeps the cached sprint
+        s = copy.copy(s)
+        s.set_end_acc(t_end_acc)
+        return s
+
+    def _run_pfv(self, s, athlete, mass, stature, pression, temp):
+        if s is None:
+            return None
+        (athlete_mass, athlete_stature) = athlete
+        mass = athlete_mass if mass is None else mass
+        stature = athlete_stature if stature is None else stature
+        return PFV(v_max=s.v_max, tau=s.tau, duration=s.duration, mass=mass,
+                   stature=stature, pression=pression, temp=temp)
+
+    def _run_row(self, pfv):
+        from sprof.pfv_dataset import get_row_values
+        return get_row_values(self.analyse) if pfv else None
+
+# ------ Main ---------------------------------------------------------------------------
+if __name__ == "__main__":
+    # python pipeline.py -p alex1
+    from sprof.radar_file import params_get_file
+
+    p = AnalysePipeline(params_get_file())
+
+    def step(title):
+        before = dict(p.computed)
+        row = p.row
+        done = [stage for stage in p.STAGES if p.computed[stage] > before[stage]]
+        print(f"\n== {title} : étapes calculées {done}")
+        if row:
+            print(f"   V0 {row['V0']}, F0 {row['F0']}, Pmax {row['Pmax']}, tau {row['tau']}")
+
+    step("analyse")
+    p.set_mass(80)
+    step("masse 80 kg")
+    p.set_conditions(pression=1000, temp=25)
+    step("pression, température")
+    t_end = p.radar_data.T_sprint[-1]
+    p.set_bounds(t_end=t_end-0.5)
+    step("fin du sprint - 0.5 s")
+    p.set_end_acc(p.sprint.T_sprint[p.sprint.i_end_acc]-0.3)
+    step("fin de l'accélération - 0.3 s")
+    p.set_outliers(False)
+    step("sans enlever les points aberrants")
+    p.set_outliers(True)
+    p.set_end_acc(None)
+    p.set_bounds()
+    p.set_mass()
+    p.set_conditions()
+    step("retour aux valeurs initiales (cache)")
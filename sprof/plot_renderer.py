@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*
+# python3
+# Author : LJK - Laboratoire Jean Kuntzmann - C. Bligny
+"""
+Background plot rendering, used by the radar watcher.
+
+Analyses are sent to a separate process (matplotlib Agg backend) through a queue, which
+saves the sprint image (Analyse.plot_normalize) as a png, and optionally a thumbnail.
+The numeric results never wait for the rendering :
+    - the analyse is pickled and sent by the queue feeder thread
+    - if several analyses of the same file are waiting, only the last one is rendered
+    - the same figure is reused for all the images
+"""
+
+import multiprocessing
+import queue
+
+# ------ Rendering process --------------------------------------------------------------
+
+def render_loop(jobs, thumbnail_dpi=None):
+    """ Rendering process main loop. jobs is a queue of (img_file, analyse) tuples.
+        None stops the process.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure(figsize=PlotRenderer.FIGSIZE)
+    stop = False
+
+    while not stop:
+        pending = [jobs.get()]
+        # coalesce : get all the waiting jobs, keep only the last one for each image
+        while True:
+            try:
+                pending.append(jobs.get_nowait())
+            except queue.Empty:
+                break
+
+        analyses = {}
+        for job in pending:
+            if job is None:
+                stop = True
+            else:
+                (img_file, a) = job
+                analyses[img_file] = a
+
+        for (img_file, a) in analyses.items():
+            try:
+                fig.clf()
+                plt.figure(fig.number) # plot_normalize uses the current figure
+                a.plot_normalize()
+                plt.legend(('V mesure','V sprint','V smooth', 'V model'))
+                fig.savefig(img_file)
+                if thumbnail_dpi:
+                    fig.savefig(get_thumbnail_file(img_file), dpi=thumbnail_dpi)
+            except Exception as error:
+                print(f"ERREUR lors de la sauvegarde de l'image {img_file} : {error!r}")
+
+    plt.close(fig)
+
+def get_thumbnail_file(img_file):
+    return img_file[:-4]+'_thumb.png'
+
+# ------ PlotRenderer Class -------------------------------------------------------------
+
+class PlotRenderer:
+
+    FIGSIZE = (9, 7)
+    THUMBNAIL_DPI = 20 # 180 x 140 pixels for the default figure size
+
+    def __init__(self, thumbnails=False):
+
+        # spawn : same behaviour on windows and linux, no copy of the parent state
+        ctx = multiprocessing.get_context('spawn')
+        self.jobs = ctx.Queue()
+        thumbnail_dpi = self.THUMBNAIL_DPI if thumbnails else None
+        self.process = ctx.Process(target=render_loop, args=(self.jobs, thumbnail_dpi), daemon=True)
+
+    def start(self):
+        self.process.start()
+
+    def render(self, analyse, img_file):
+        """ Ask for the rendering of an analyse into img_file. Does not wait.
+        """
+        self.jobs.put((img_file, analyse))
+
+    def stop(self, timeout=10):
+        """ Stop the rendering process, once the waiting images are saved
+        """
+        if self.process.is_alive():
+            self.jobs.put(None)
+            self.process.join(timeout)
+
+# ------ Main ---------------------------------------------------------------------------
+if __name__ == "__main__":
+    # render all the radar files found with the command line parameters
+    # python plot_renderer.py -p alex
+    import time
+    from sprof.radar_file import params_get_files
+    from sprof.analyse import build_analyse_from_file
+
+    renderer = PlotRenderer(thumbnails=True)
+    renderer.start()
+    start_time = time.time()
+    for file in params_get_files():
+        a = build_analyse_from_file(file)
+        if a:
+            renderer.render(a, file[:-4]+'.png')
+    print(f"Analyses terminées en {time.time()-start_time:.2f} s, sauvegarde des images ...")
+    renderer.stop()
+    print(f"Images sauvegardées en {time.time()-start_time:.2f} s")
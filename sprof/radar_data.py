@@ -10,10 +10,10 @@ The velocity fonction f, related to time t during the sprint acceleration is :
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy import signal
 import logging
 from sprof.utils import lissage, sum_distances, bisect_left, bisect_right, print_obj_attr, get_iprevious, get_inext
+from sprof.kernels import score_sprint_starts
+from sprof.utils import get_butter, get_pyplot, read_only
 from sprof.radar_file import RadarFile, build_RF_from_pattern
 
 
@@ -41,6 +41,13 @@ class RadarData:
     PLATEAU_RATIO = 0.2
     SPRINT_VMAX_MIN = 6
     SPRINT_VMAX_MAX = 11
+    SMOOTH_CUTOFF = 0.018 # butterworth cutoff (normalized) for V smooth
+    TAU_GEN = 0.8 # tau of the model velocity used to find the sprint start
+
+    # no instance dict : many RadarData are kept by the dataset builders
+    __slots__ = ('T', 'V', 'title', 'V_smooth', 'vs_max', 'i_vs_max', 'data_error',
+                 'i_start_sprint', 'i_end_sprint', 'i_start_plateau', 'i_end_plateau',
+                 'V_model_simp', 'i_start_v_model', 'i_end_v_model')
     
     def __init__(self, T, V, title="", auto=True):
         """ init Class Attributes. 
@@ -50,13 +57,10 @@ class RadarData:
             - search most accurate sprint start
             - set sprint end when v = vmax * plateau ratio. A more accurate value for
               sprint ent time is computed by the Sprint class
+           T and V are not copied (float arrays) : they must not be modified afterwards
         """
 
-        # input Datas
-        # input T and V
-        self.T_in = np.array([],dtype='float') # float np array 1D
-        self.V_in = np.array([],dtype='float') # float np array  1D
-        # T and V potentially without outliers
+        # input Datas : read only views of T and V (T_in, V_in : same arrays)
         self.T = np.array([],dtype='float') # float np array 1D
         self.V = np.array([],dtype='float') # float np array  1D
         self.title=title
@@ -86,10 +90,8 @@ class RadarData:
             print("ERREUR : les données sont vides")
         else:
             # Datas
-            self.T_in = np.array(T,dtype='float') # Time array
-            self.V_in = np.array(V,dtype='float') # Velocity array   
-            self.T = np.copy(self.T_in)
-            self.V = np.copy(self.V_in)
+            self.T = read_only(T) # Time array
+            self.V = read_only(V) # Velocity array
             
             self._init_Vsmooth()
             
@@ -119,8 +121,9 @@ class RadarData:
         
         # first pass, to detect vmesure max
         # on filtre pas mal les hautes fréquences pour lisser les anomalies.
-        b, a = signal.butter(2, 0.018, 'low', analog=False)
-        self.V_smooth = signal.filtfilt(b, a, self.V)
+        from scipy.signal import filtfilt
+        b, a = get_butter(2, self.SMOOTH_CUTOFF)
+        self.V_smooth = filtfilt(b, a, self.V)
         # extraction de la vitesse max mesurée
         self.i_vs_max = np.argmax(self.V_smooth)
         self.vs_max = self.V_smooth[self.i_vs_max]
@@ -151,6 +154,14 @@ class RadarData:
     @property
     def n(self):
         return len(self.T) # Points number (arrays size)
+
+    @property
+    def T_in(self):
+        return self.T # input times (no outlier removed in RadarData)
+
+    @property
+    def V_in(self):
+        return self.V
     
     @property
     def T_sprint(self):
@@ -263,7 +274,9 @@ class RadarData:
     
         # Calcul de la somme des carré des distance aux courbes pour chaque point de la zone à chercher
         # sum of the square distances to mean and V_model_simp for start acc points
-        l1 = np.array(tuple(self._get_sum_mean_distance(i) + self._get_sum_Vmodel_distance(i) for i in range(i_start,i_end)))
+        # (all the candidates at once, cf kernels.py. Old way, one by one :
+        # self._get_sum_mean_distance(i) + self._get_sum_Vmodel_distance(i))
+        l1 = score_sprint_starts(self.T, self.V, i_start, i_end, self.i_end_v_model, self.TAU_GEN)
 
         # get i start theorical that minimise this sum
         # this is t0 for the generic velocity function.
@@ -287,7 +300,8 @@ class RadarData:
         Suppose that i_start and i_end have been adjusted, using set_i_start() or 
         find_sprint_start and set_i_end() or find_sprint_end
         
-        Array data are copied, in case we want to recalculate time using :
+        T sprint is a read only view of T, V sprint a copy (its last value is replaced).
+        To recalculate time, make a new array :
             self.T_sprint = self.T_sprint - self.T_sprint[0] (-self.delay ?)
         """ 
 
@@ -306,7 +320,7 @@ class RadarData:
 
         if self.i_end_sprint > 0:        
             Vsprint = np.copy(self.V_sprint)
-            Tsprint = np.copy(self.T_sprint)
+            Tsprint = self.T_sprint
 
             # replace last value by V_smooth value - condition limites pour la suite
             Vsprint[-1] = self.V_smooth[self.i_end_sprint]
@@ -402,6 +416,7 @@ class RadarData:
 
     def plot_plateau(self):
     
+        plt = get_pyplot()
         # V lissée pour la détection de v mesure max
         #plt.plot(self.T,self.V_smooth)
         plt.axhline(y=self.vs_max, linewidth=1,linestyle='--')
@@ -414,6 +429,7 @@ class RadarData:
    
     def plot_sprint(self):
     
+        plt = get_pyplot()
         plt.plot(self.T_sprint, self.V_sprint, alpha=0.5)
         # plot i_start et i_end
         plt.axvline(x=self.T[self.i_end_sprint], linewidth=1)
@@ -421,6 +437,7 @@ class RadarData:
         
     def plot_all(self):
         
+        plt = get_pyplot()
         # donnnées brutes
         #plt.plot(self.T_in, self.V_in, alpha=0.3)
         plt.plot(self.T, self.V, alpha=0.5)
@@ -477,7 +494,7 @@ class RadarData:
         TODO : faire les tests avec une v_model plus proche de la fonction visée, soit v_max(1-np.exp((t_start + delay - t)/tau))
            cf classe Sprint.
         """
-        tau_gen = 0.8 # un peu plus raide que la moyenne pour être sur de ne pas rater le démarrage
+        tau_gen = self.TAU_GEN # un peu plus raide que la moyenne pour être sur de ne pas rater le démarrage
         vmax_gen = 0
 
         T_sprint = self.T[idx:self.i_end_v_model+1]
@@ -524,6 +541,7 @@ if __name__ == "__main__":
     # execute only if run as a script : python radar_data.py
     # load file
     from radar_file import params_get_file
+    plt = get_pyplot()
 
     # measure execution time
     import time
@@ -14,17 +14,22 @@
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
 import logging
 import os
 from datetime import datetime
-from sprof.utils import str_simplify, print_obj_attr
+from itertools import islice
+from sprof.utils import str_simplify, print_obj_attr, get_pyplot
+from sprof import archive
 from sprof.settings import RADAR_DATA_DIR
 
 RAD_FILE_EXTENSION = ".rad"
 RDA_FILE_EXTENSION = ".rda"
 DEFAULT_EXTENSION = RDA_FILE_EXTENSION
 
+CHUNK_SIZE = 65536 # points, RadarFile.iter_chunks
+HEADER_SIZE = 1024 # bytes read by RadarFile header_only mode
+PREVIEW_STEP = 100 # points, RadarFile.get_preview
+
 # ------ Decorator ----------------------------------------------------------------------
 
 def scan_dir(max_file=5):
@@ -84,16 +89,33 @@ def search_radar_files(dir=".", pattern="",ext=""):
 
     # ATTENTION : default data dir ici est le rep courant . - mais dans get param on utilise les DATA_DIR. A voir
 
+    # on vérifie l'extension, on récupère celle par défaut
+    required_ext = check_radar_ext(ext)
+
+    # réponse du catalogue (sprof.catalog) : le répertoire n'est relu que s'il a changé.
+    # Numéro d'essai de plusieurs chiffres possible. Pas de catalogue pour les archives
+    from sprof.catalog import get_catalog
+    catalog = get_catalog() if os.path.isdir(dir) else None
+    if catalog is not None:
+        import sqlite3
+        try:
+            catalog.refresh(dir, recursive=False)
+            files = catalog.search(pattern, ext=required_ext, root=dir, recursive=False)
+        except (sqlite3.Error, OSError) as error:
+            print(f"WARNING : catalogue non utilisé ({error!r})")
+        else:
+            for file in files:
+                yield os.path.join(dir, os.path.basename(file))
+            return
+
     sprint_number=""
     if pattern:
         if pattern[-1].isdigit():
             sprint_number=pattern[-1]
             pattern = pattern[0:-1] # on enlève le dernier caractère au pattern
 
-    # on vérifie l'extension, on récupère celle par défaut
-    required_ext = check_radar_ext(ext)
-
-    for file in os.listdir(dir):
+    # dir : répertoire, ou archive zip/tar (sprof.archive)
+    for file in archive.listdir(dir):
         # check the hidden files. there are some with windows
         # or problem with unclosed files?
         if not(file.startswith('.')):
@@ -168,6 +190,21 @@ def check_radar_ext(ext):
     return ext
 
 
+def read_metadata(files, workers=None):
+    """ Returns the metadata (RadarFile.metadata) of the files, read in header only
+        mode. workers : number of threads reading the files (None or 1 : no thread)
+    """
+    def read(files):
+        return [RadarFile(file, header_only=True).metadata for file in files]
+    files = list(files)
+    if workers and workers > 1 and len(files) > 1:
+        # one slice of files per thread (one task per file : slower than the reads)
+        from concurrent.futures import ThreadPoolExecutor
+        step = -(-len(files)//workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return [m for ms in executor.map(read, [files[k:k+step] for k in range(0, len(files), step)]) for m in ms]
+    return read(files)
+
 # ------ RadarFile Class ----------------------------------------------------------------
 
 def build_RF_from_pattern(dir="", pattern="", ext=""):
@@ -193,6 +230,7 @@ class RadarFile:
     RAD_FIRST_LINE = "STALKER Version 5.020 using ATS II"
     RAD_BEFORE_LAST_LINE = "END OF FILE"
     RAD_COLUMN_LINE = "  Sample   Time   Speed   Accel     Dist"
+    RAD_N_COLUMNS = 5
     RAD_COLUMN_LINE_IDX = 16 # Line number for columns names
     RAD_SPEED_UNIT_IDX = 11	 # Line number for speed unit
     RAD_NAME_IDX = 2         # Line number for data name (usually, athlete name)
@@ -210,10 +248,15 @@ class RadarFile:
     DEF_SAMPLE_RATE = 46.875 # Hertz. Number of events (here, measures) in one second.
     DEF_SPEED_UNITS = ('meters/sec','m/s','mètres/seconde')
 
-    def __init__(self, filename = None, debug=False):
+    def __init__(self, filename = None, debug=False, load_data=True, header_only=False):
         """Class Attributes.
            Convention : for velocity (v, V) and time (T, t), Arrays/Vectors starts
            with uppercase, scalar with lowercase
+           load_data=False : only the header is loaded. The data can then be read by
+           chunks (iter_chunks), for recordings too long to be loaded at once
+           header_only=True : only the first HEADER_SIZE bytes are read, without
+           message (files listings, catalog). n_estimate : points number estimated
+           from the file size
         """
 
         # input file
@@ -228,12 +271,15 @@ class RadarFile:
         self.date = ""
         self.sample_rate = 0.0 # replace by a get_sample_rate
         self.speed_unit=""
+        self.n_estimate = 0 # Points number estimated from the file size (header_only)
+
+        load_data = load_data and not header_only
 
         # get the file extension of the input file
         if filename:
 
             # test if file exists
-            if not(os.path.isfile(filename)):
+            if not(archive.isfile(filename)):
                 print(f"Erreur : le fichier {filename} n'existe pas")
             else:
                 ext=filename[-4:]
@@ -242,11 +288,15 @@ class RadarFile:
                 else:
                     self.file_ext = filename[-4:] # file extention
                     self._load_header()
-                    self._load_data()
+                    if load_data:
+                        self._load_data()
+                    elif header_only:
+                        self.n_estimate = self._estimate_n()
         else :
         	print("Il faut donner en paramètre un fichier radar")
 
-        print(f"Fichier {self.filename} : {self.n} points chargés")
+        if load_data:
+            print(f"Fichier {self.filename} : {self.n} points chargés")
 
 
     def print_attr(self):
@@ -259,10 +309,10 @@ class RadarFile:
         return self.filename[:-4] + RDA_FILE_EXTENSION
 
     def _exists_rad_file(self):
-        return os.path.exists(self._get_rad_file())
+        return archive.isfile(self._get_rad_file())
 
     def _exists_rda_file(self):
-        return os.path.exists(self._get_rda_file())
+        return archive.isfile(self._get_rda_file())
 
     def _load_header(self):
         """
@@ -276,10 +326,12 @@ class RadarFile:
         logging.debug(f"Chargement de l'entête")
 
         if self._exists_rad_file():
-            rad_file = open(self._get_rad_file(),'r')
+            rad_file = archive.open_file(self._get_rad_file(),'r')
+            # l'entête est dans le premier Ko
+            lines = rad_file.read(HEADER_SIZE).split('\n')+['']*12
             # boucle sur les lignes. check la premiere, get name, date, sample_rate, speed unit (11 si on part à 0)
             for i in range(0,12):
-                line=rad_file.readline().rstrip('\n')
+                line=lines[i]
                 if i==0:
                     # check first tile
                     if not(line == self.RAD_FIRST_LINE):
@@ -311,99 +363,186 @@ class RadarFile:
             # sample_rate = default sample rate
             self.sample_rate=self.DEF_SAMPLE_RATE
             # date = date of unix timestamp of file last modification
-            ts = os.path.getmtime(self.filename)
+            ts = archive.getmtime(self.filename)
             self.date=datetime.utcfromtimestamp(ts)
             self.speed_unit=self.DEF_SPEED_UNITS[0]
 
 
-    def _load_data(self):
-
-        file_radar=open(self.filename,'r')
+    def _estimate_n(self):
+        """
+        Points number, estimated from the file size and the length of the first data
+        lines (read in the first HEADER_SIZE bytes). Exact for the files shorter than
+        HEADER_SIZE, and for the .rda files (same length for all the lines)
+        """
+        with archive.open_file(self.filename,'rb') as file_radar:
+            head = file_radar.read(HEADER_SIZE)
+        size = archive.getsize(self.filename)
+        start = self.RDA_START_IDX if self.file_ext == RDA_FILE_EXTENSION else self.RAD_START_IDX
+        end_line = self.RAD_BEFORE_LAST_LINE.encode()
+        lines = head.split(b'\n')
+        if size <= HEADER_SIZE:
+            return len([line for line in lines[start:] if line.strip() and not line.startswith(end_line)])
+        # last line of the head not complete
+        data_lines = lines[start:-1]
+        if not data_lines:
+            return 0
+        header_size = sum(len(line)+1 for line in lines[:start])
+        footer_size = len(end_line)+2 if self.file_ext == RAD_FILE_EXTENSION else 0
+        line_size = sum(len(line)+1 for line in data_lines)/len(data_lines)
+        return max(0, round((size-header_size-footer_size)/line_size))
+
+    @property
+    def metadata(self):
+        """ Header values, and points number (loaded, or estimated)
+        """
+        return {'file':self.filename, 'title':self.title, 'date':self.date,
+                'sample_rate':self.sample_rate, 'speed_unit':self.speed_unit,
+                'n_points':self.n or self.n_estimate}
 
-		# Load all file lines at once into an array - OK for a reasonable file size
-        all_lines=file_radar.read()
-        file_radar.close()
-        all_lines=all_lines.split('\n')
+    def _load_data(self):
 
-        if self.file_ext == RDA_FILE_EXTENSION:
-            self._load_rda_data(all_lines)
-        elif self.file_ext == RAD_FILE_EXTENSION:
-            self._load_rad_data(all_lines)
-        else:
-            print("Le fichier fourni ne semble pas être un fichier radar")
+        # file read by chunks of lines : no copy of the whole file content in memory
+        chunks = list(self.iter_chunks())
+        if chunks:
+            self.V = np.concatenate([V for (T, V) in chunks])
+            self.n = len(self.V)
+            if self.file_ext == RDA_FILE_EXTENSION:
+                end_time=(self.n-1)/self.sample_rate # c'est mieux self.n-1 - mais un peu empirique
+                # on arrondis à 2 chiffes après la virgule
+                self.T = np.around(np.linspace(0,end_time,self.n),decimals=2)
+            else:
+                self.T = np.concatenate([T for (T, V) in chunks])
 
         logging.debug(f"{self.n} points de mesure chargés")
         if self.n>0:
             logging.debug(f"Tmin = {self.T[0]} Tmax = {self.T[-1]} , Vmin = {self.V[0]} Vmax = {self.V[-1]}")
 
-
-    def _load_rad_data(self,lines):
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
         """
-        Read the input radar file and fill class attributes
-        Returns the number of lines loaded.
+        Generator of the radar data by chunks of chunk_size points : (T, V) arrays.
+        The file is read line by line, so the memory used depends on the chunk size,
+        not on the recording duration.
+        .rda : times computed from the sample rate, i/sample_rate rounded to 0.01 s
+        (_load_data : same values, except for the rounding of some sample rates)
         """
-        logging.debug(f"Chargement des données au format rad")
+        if self.file_ext not in (RAD_FILE_EXTENSION, RDA_FILE_EXTENSION):
+            print("Le fichier fourni ne semble pas être un fichier radar")
+            return
 
-        # Some checks
+        with archive.open_file(self.filename,'r') as file_radar:
+            if self.file_ext == RDA_FILE_EXTENSION:
+                logging.debug(f"Chargement des données au format rda")
+                if not self._check_rda_header(list(islice(file_radar, self.RDA_START_IDX))):
+                    return
+            else:
+                logging.debug(f"Chargement des données au format rad")
+                if not self._check_rad_header(list(islice(file_radar, self.RAD_START_IDX))):
+                    return
+
+            i = 0
+            end = False
+            while not end:
+                lines = list(islice(file_radar, chunk_size))
+                end = len(lines) < chunk_size
+                if self.file_ext == RAD_FILE_EXTENSION:
+                    # data lines until "END OF FILE"
+                    k = next((k for (k, line) in enumerate(lines) if line.startswith(self.RAD_BEFORE_LAST_LINE)), None)
+                    if k is not None:
+                        (lines, end) = (lines[:k], True)
+                    elif end:
+                        logging.warning("Attention : la lignes de fin du fichier n'est pas du format attendu")
+                        logging.warning(f"Format attendu : '{self.RAD_BEFORE_LAST_LINE}'")
+                    # no empty line (file being written)
+                    lines = [line for line in lines if line.strip()]
+                else:
+                    # no empty last line
+                    while lines and not lines[-1].strip():
+                        lines.pop()
+                if not lines:
+                    continue
+                (T, V) = self._parse_lines(lines, i)
+                i += len(V)
+                if len(V):
+                    yield (T, V)
+
+    def _parse_lines(self, lines, i_first):
+        """ Returns the (T, V) arrays of data lines. i_first : index of the first line
+        """
+        # Build the data arrays, converting string to float
+        if self.file_ext == RAD_FILE_EXTENSION:
+            datas = []
+            for line in lines:
+                values = line.split()
+                try:
+                    if len(values) != self.RAD_N_COLUMNS:
+                        raise ValueError
+                    datas.append([float(x.replace(',','.')) for x in values])
+                except ValueError:
+                    # partial line of a file being written : ignored
+                    logging.warning(f"Attention : ligne ignorée, format inattendu : '{line.rstrip()}'")
+            datas = np.array(datas, dtype=float).reshape(-1, self.RAD_N_COLUMNS)
+            return (datas[:,1], datas[:,2])
+        V = np.array([float(x.replace(',','.')) for x in lines])
+        T = np.around(np.arange(i_first, i_first+len(V))/self.sample_rate, decimals=2)
+        return (T, V)
+
+    def _check_rad_header(self, lines):
+        """ Checks the header lines of a .rad file. Returns False if the format is not
+            the expected one
+        """
+        lines = [line.rstrip('\n') for line in lines]+['']*self.RAD_START_IDX
         if not(lines[0] == self.RAD_FIRST_LINE):
             logging.warning("Attention : la première ligne n'est pas du format attendu")
             logging.warning(f"Format attendu : '{self.RAD_FIRST_LINE}'")
             logging.warning(f"Valeur de la première ligne : '{lines[0]}'")
-            return 0
+            return False
 
-        if not(lines[16] == self.RAD_COLUMN_LINE):
+        if not(lines[self.RAD_COLUMN_LINE_IDX] == self.RAD_COLUMN_LINE):
             logging.warning("Attention : la lignes des nom de colonnes n'est pas du format attendu")
             logging.warning(f"Format attendu : '{self.RAD_COLUMN_LINE}'")
             logging.warning(f"Valeur de la ligne d'indice {self.RAD_COLUMN_LINE_IDX} : '{lines[self.RAD_COLUMN_LINE_IDX]}'")
-            return 0
+            return False
+        return True
 
-        if not(lines[-2] == self.RAD_BEFORE_LAST_LINE):
-            logging.warning("Attention : la lignes de fin du fichier n'est pas du format attendu")
-            logging.warning(f"Format attendu : '{self.RAD_BEFORE_LAST_LINE}'")
-            logging.warning(f"Valeur de la ligne d'indice 16 : '{lines[-2]}'")
-            return 0
-
-        data_lines=lines[self.RAD_START_IDX:self.RAD_END_IDX] # Last line is empty, before last = "end of file"
-
-        # Build the data arrays, converting string to float
-        datas = np.array([[float(x.replace(',','.')) for x in line.split()] for line in data_lines])
-
-        # init some class attributs
-        self.n = datas.shape[0]
-        self.T = datas[:,1]
-        self.V = datas[:,2]
-
-        logging.debug(f"{self.n} points de mesure chargés - format rad")
-
-        return self.n
-
-    def _load_rda_data(self, lines):
-
-        logging.debug(f"Chargement des données au format rda")
-
-        # Some checks
-        if not(lines[0] == self.RDA_FIRST_LINE):
+    def _check_rda_header(self, lines):
+        """ Checks the header lines of a .rda file. Returns False if the format is not
+            the expected one
+        """
+        first_line = lines[0].rstrip('\n') if lines else ''
+        if not(first_line == self.RDA_FIRST_LINE):
             logging.warning("Attention : la première ligne n'est pas du format attendu")
             logging.warning(f"Format attendu : '{self.RDA_FIRST_LINE}'")
-            logging.warning(f"Valeur de la première ligne : '{lines[0]}'")
-            return 0
-
-        # Build the data arrays, converting string to float
-        self.V = np.array([float(x.replace(',','.')) for x in lines[self.RDA_START_IDX:self.RDA_END_IDX]])
-
-        # init some class attributs
-        self.n = len(self.V)
+            logging.warning(f"Valeur de la première ligne : '{first_line}'")
+            return False
+        return True
 
-        end_time=(self.n-1)/self.sample_rate # c'est mieux self.n-1 - mais un peu empirique
-        self.T = np.linspace(0,end_time,self.n)
-
-        # on arrondis à 2 chiffes après la virgule
-        self.T=np.around(self.T,decimals=2)
-
-        return self.n
+    def get_preview(self, step=PREVIEW_STEP, chunk_size=CHUNK_SIZE):
+        """
+        Returns (T, V) arrays to plot a long recording : min and max velocity of each
+        step points, in time order. Read by chunks if the data are not loaded.
+        """
+        # chunks of a multiple of step points : no step across two chunks
+        chunks = [(self.T, self.V)] if self.n > 0 else self.iter_chunks(max(step, chunk_size-chunk_size%step))
+        T_preview = []
+        V_preview = []
+        for (T, V) in chunks:
+            T = np.asarray(T)
+            V = np.asarray(V)
+            # last step of the chunk completed with its last point
+            m = -(-len(V)//step)*step
+            Ts = np.pad(T, (0, m-len(T)), mode='edge').reshape(-1, step)
+            Vs = np.pad(V, (0, m-len(V)), mode='edge').reshape(-1, step)
+            idx = np.sort(np.column_stack((np.argmin(Vs, axis=1), np.argmax(Vs, axis=1))), axis=1)
+            rows = np.arange(len(Vs))[:,None]
+            T_preview.append(Ts[rows, idx].ravel())
+            V_preview.append(Vs[rows, idx].ravel())
+        if not V_preview:
+            return (np.array([]), np.array([]))
+        return (np.concatenate(T_preview), np.concatenate(V_preview))
 
 if __name__ == "__main__":
 
+    plt = get_pyplot()
 
     def test_get_file_params():
         """
@@ -509,11 +648,63 @@ if __name__ == "__main__":
         #plt.close()
         plt.show()
 
+    def plot_preview():
+        """
+        Long recordings : plot without loading the data
+        python radar_file.py -f "session.rda"
+        """
+        print("\n ===== Preview radar file =====")
+        f1=RadarFile(params_get_file(), load_data=False)
+        (T, V) = f1.get_preview()
+        print(f"{len(T)} points affichés")
+        plt.plot(T, V, color='b', linewidth=0.5)
+        plt.title(f1.title+" "+f1.file_ext)
+        plt.show()
+
+    def list_files():
+        """
+        Files listing : headers only
+        python radar_file.py -p ma1 -e rad
+        """
+        print("\n ===== List radar files =====")
+        import time
+        files = list(params_get_files())
+        start_time = time.perf_counter()
+        for m in read_metadata(files, workers=8):
+            print(f"{os.path.basename(m['file']):40s} {m['date']} {m['sample_rate']:7.3f} Hz {m['n_points']:7d} points")
+        print(f"{len(files)} fichiers en {(time.perf_counter()-start_time)*1000:.1f} ms")
+
+    def test_partial_rad():
+        """
+        .rad files still being written (no END OF FILE) : trailing empty lines, last
+        line cut. The points before are loaded, as the complete file
+        python radar_file.py -f "../test/Juillet Alexandre 1.rad"
+        """
+        print("\n ===== test partial .rad =====")
+        import tempfile
+        file = params_get_file()
+        full = RadarFile(file)
+        with open(file, newline='') as f:
+            content = f.read()
+        body = content[:content.index(RadarFile.RAD_BEFORE_LAST_LINE)]
+        cases = {'lignes vides':body+"\n\n", 'ligne coupée':body[:-20]}
+        with tempfile.TemporaryDirectory() as dir:
+            for (name, text) in cases.items():
+                partial_file = os.path.join(dir, os.path.basename(file))
+                with open(partial_file, 'w', newline='') as f:
+                    f.write(text)
+                rf = RadarFile(partial_file)
+                same = np.array_equal(rf.V, full.V[:rf.n]) and np.array_equal(rf.T, full.T[:rf.n])
+                print(f"{name} : {rf.n} points sur {full.n}, mêmes valeurs {same}")
+
     #test_radar_file()
+    #test_partial_rad()
+    #list_files()
     #test_get_file_params()
     #test_check_radar_ext()
     #test_params_get_files()
     #test_params_get_file()
+    #plot_preview()
     plot_radar_file()
 
 
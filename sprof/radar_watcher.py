@@ -8,30 +8,49 @@ some datas:
 v max, 30 m time (based on acceleration mesured, not "real time"), power / kg
 V max mesured (souvent > vmax - je pense que c'est l'effet 'ligne d'arrivée') 
 Also display the sprint image
+Each new analyse is also pushed to the local subscribers (dashboards), cf result_publisher
 
-usage : python radar_watcher.py dir_to_watch
+Several dirs can be watched by the same process (one radar per dir) : each dir gets its 
+own dataset and export file, but the observer, the analyses worker pool and the caches 
+(athletes, filters) are shared.
+
+usage : python radar_watcher.py dir_to_watch [other_dir_to_watch ...]
 """
 import sys
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import os
-import matplotlib.pyplot as plt
-from PIL import Image
 
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
 from sprof.analyse import build_analyse_from_file
 from sprof.pfv_dataset import PFVDataset
+from sprof.athlete import get_athlete_ds
+from sprof.result_publisher import ResultPublisher
+from sprof.plot_renderer import PlotRenderer
+from sprof.settings import WATCHER_PUBLISH_PORT, WATCHER_WORKERS
+from sprof.settings import WATCHER_SAVE_PLOTS, WATCHER_THUMBNAILS, HEADLESS
 
 class RadarDataHandler(FileSystemEventHandler):
 
-    def __init__(self,dir):
+    def __init__(self,dir,publisher=None,pool=None,name="data_watcher",renderer=None):
         self.last_modified = datetime.now() - timedelta(seconds=10)
         self.last_file = 'None Yet'
         #print (self.last_modified)
-        self.dataset=PFVDataset("data_watcher")
+        self.dataset=PFVDataset(name)
         self.dir=dir
+        # push the results to the subscribers
+        self.publisher=publisher
+        # background process saving the sprint images
+        self.renderer=renderer
+        # worker pool shared by all the watched dirs. If None, analyses are run in the
+        # observer thread
+        self.pool=pool
+        # the dataset and the "already done" patch are shared by the workers
+        self.lock=threading.Lock()
         
         dt=datetime.today()
         strDate=dt.strftime("%y%m%d")
@@ -52,7 +71,17 @@ class RadarDataHandler(FileSystemEventHandler):
                 ext = os.path.splitext(event.src_path)[-1]
                 if (ext==".rda"): 
                     print(f"On create Data Watcher - Analyse du fichier {event.src_path}")
-                    self._run_sprint_analyse(event.src_path)
+                    if self.pool:
+                        future=self.pool.submit(self._run_sprint_analyse, event.src_path)
+                        future.add_done_callback(self._check_analyse_error)
+                    else:
+                        self._run_sprint_analyse(event.src_path)
+
+    def _check_analyse_error(self, future):
+        # errors in the workers are not raised : print them
+        error=future.exception()
+        if error:
+            print(f"ERREUR pendant l'analyse : {error!r}")
     
     '''   
     # genere des doublons avec windows      
@@ -74,11 +103,15 @@ class RadarDataHandler(FileSystemEventHandler):
         # Patch windows - prevent from running twice
         # for creation. set to 6 seconds after test
         # site effects : wait 6 seconds between analyses for same files
-        if ( (datetime.now() - self.last_modified < timedelta(seconds=6)) and (self.last_file == file) ):
+        with self.lock:
+            already_done = (datetime.now() - self.last_modified < timedelta(seconds=6)) and (self.last_file == file)
+            if not already_done:
+                self.last_modified = datetime.now()
+                self.last_file=file
+
+        if already_done:
             print("Fichier déjà traité.")
         else:
-            self.last_modified = datetime.now()
-            self.last_file=file
             # Windows patch : wait until the file is fully copied
             copying = True
             size_past = -1
@@ -103,56 +136,67 @@ class RadarDataHandler(FileSystemEventHandler):
                 a.print_analyse()
                 print()
                 
-                n=self.dataset.add_row_from_analyse(a)
-                if n>0:
-                    self.dataset.export_csv() # save to default analyse datadir
-                    self.dataset.export_csv(self.export_file) # export to data watcher dir 
-                               
-            '''
-            a=build_analyse_from_file(file)
-        
-            if a:
-                # print pfv values
-                a.print_analyse()
-                print()
-            
-                # save data into csv file
-                self.dataset.add_row_from_pfv(a.pfv, a.radar_data.title)
-                self.dataset.export_csv() # save to default analyse datadir
-                self.dataset.export_csv(self.export_file) # export to data watcher dir
-                        
-                # save img with plot
-                plt.figure(figsize = (9, 7))
-                a.plot_normalize()
-                img_file=file[:-4]+'.png' # remove .rda and add .png
-                plt.savefig(img_file)
-                plt.close()
-        
-                # show imgae
-                # image = Image.open(img_file)
-                # image.show(title='test') # titre marche pas
-            '''
+                values=self.dataset.get_row_values(a)
+                if values:
+                    # subscribers first : they don't wait for the csv export
+                    if self.publisher:
+                        message=dict(values, name=self.dataset.normalize_title(values['name']))
+                        # file relative to the parent dir : tells which radar
+                        self.publisher.publish(message, file=os.path.relpath(file, os.path.dirname(self.dir)))
+                    with self.lock:
+                        n=self.dataset.add_row(values)
+                        if n>0:
+                            self.dataset.export_csv() # save to default analyse datadir
+                            self.dataset.export_csv(self.export_file) # export to data watcher dir 
+
+                # save img with plot, in the background : numeric results don't wait
+                if self.renderer:
+                    img_file=file[:-4]+'.png' # remove .rda and add .png
+                    self.renderer.render(a, img_file)
         
         print("\nWaiting .......")
     
     
 if __name__ == "__main__":
 
-    # get dir to watch. If not provided : watch current dir
-    rd_path = sys.argv[1] if len(sys.argv) > 1 else '.'
+    # get dirs to watch. If not provided : watch current dir
+    rd_paths = sys.argv[1:] if len(sys.argv) > 1 else ['.']
     
     # get abspath - and check dir
-    abspath = os.path.abspath(rd_path)
-    if not os.path.isdir(abspath):
-        print(f"Erreur : le répertoire {abspath} n'existe pas")
+    abspaths = [os.path.abspath(rd_path) for rd_path in rd_paths]
+    missing = [abspath for abspath in abspaths if not os.path.isdir(abspath)]
+    if missing:
+        for abspath in missing:
+            print(f"Erreur : le répertoire {abspath} n'existe pas")
     else :
         
-        print(f"Start watching dir {abspath}")
+        for abspath in abspaths:
+            print(f"Start watching dir {abspath}")
         print("Pour quitter, taper CTR c ou fermer cette fenêtre")
+
+        # warm caches, paid once for all the dirs
+        get_athlete_ds()
     
-        rd_handler = RadarDataHandler(abspath)
+        publisher=None
+        if WATCHER_PUBLISH_PORT:
+            publisher = ResultPublisher()
+            publisher.start()
+            print(f"Résultats publiés sur {publisher.url}")
+
+        renderer=None
+        if WATCHER_SAVE_PLOTS and not HEADLESS:
+            renderer = PlotRenderer(thumbnails=WATCHER_THUMBNAILS)
+            renderer.start()
+
+        pool = ThreadPoolExecutor(max_workers=WATCHER_WORKERS)
         rd_observer = Observer()
-        rd_observer.schedule(rd_handler, abspath, recursive=True)
+        for abspath in abspaths:
+            # one dataset (and default export file) per dir
+            name = "data_watcher"
+            if len(abspaths) > 1:
+                name += "_" + os.path.basename(abspath)
+            rd_handler = RadarDataHandler(abspath, publisher, pool=pool, name=name, renderer=renderer)
+            rd_observer.schedule(rd_handler, abspath, recursive=True)
         rd_observer.start()
         print("Waiting .....")
         try:
@@ -160,5 +204,10 @@ if __name__ == "__main__":
                 time.sleep(1)
         except KeyboardInterrupt:
             rd_observer.stop()
+            pool.shutdown(wait=False)
+            if publisher:
+                publisher.stop()
+            if renderer:
+                renderer.stop()
         
         rd_observer.join()
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*
+# python3
+# Author : LJK - Laboratoire Jean Kuntzmann - C. Bligny
+"""
+Result publisher : push the radar watcher analyses to local subscribers (pitch side
+dashboards), without any file polling.
+
+Each new analyse is published as a compact json message, using server-sent events (SSE)
+on a lightweight http server listening on localhost.
+When a subscriber connects, all the messages already published during the session are
+sent first (replay), then the new ones as soon as they are published.
+
+Urls :
+    /events  : event stream (Content-Type text/event-stream)
+    /session : all the messages of the session, as a json list
+
+Message format (one json object by event) :
+    {"id":3,"time":1571408123.123,"file":"Juillet Alexandre 1.rda","values":{"name":..,"V0":..}}
+time is the publication timestamp (time.time()), used by the test client to measure the
+end-to-end latency. See scripts/sprof_subscribe.py
+"""
+
+import json
+import math
+import queue
+import socket
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from sprof.settings import WATCHER_PUBLISH_HOST, WATCHER_PUBLISH_PORT
+
+# ------ Utils --------------------------------------------------------------------------
+
+def to_json_value(value):
+    """ Returns a value that can be serialized in json : numpy scalars are converted to
+        python values, and NaN to None (NaN is not valid json for a browser)
+    """
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        value = None
+    return value
+
+def build_message(msg_id, values, file=""):
+    """ Returns the json message for an analyse (values dictionnary)
+    """
+    msg = {'id':msg_id,
+           'time':time.time(),
+           'file':file,
+           'values':{k:to_json_value(v) for (k,v) in values.items()}}
+    return json.dumps(msg, separators=(',',':'), default=str)
+
+# ------ ResultPublisher Class ----------------------------------------------------------
+
+class ResultPublisher:
+
+    EVENTS_PATH = "/events"
+    SESSION_PATH = "/session"
+    KEEP_ALIVE = 15 # s. Comment sent to the subscribers if nothing is published
+
+    def __init__(self, host=WATCHER_PUBLISH_HOST, port=WATCHER_PUBLISH_PORT):
+
+        self.host = host
+        self.port = port
+        self.messages = [] # all the messages published during the session (replay)
+        self.subscribers = [] # one queue per connected subscriber
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}{self.EVENTS_PATH}"
+
+    def start(self):
+        """ Start the http server in a background thread
+        """
+        handler = type('PublisherRequestHandler', (_PublisherRequestHandler,), {'publisher':self})
+        self.server = ThreadingHTTPServer((self.host, self.port), handler)
+        self.server.daemon_threads = True
+        # port 0 : a free port is chosen by the system
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.server:
+            # None : end of stream for the subscribers
+            with self.lock:
+                for q in self.subscribers:
+                    q.put(None)
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def publish(self, values, file=""):
+        """ Publish the values of an analyse (dictionnary) to all the subscribers
+            Returns the message sent.
+        """
+        with self.lock:
+            data = build_message(len(self.messages)+1, values, file)
+            self.messages.append(data)
+            for q in self.subscribers:
+                q.put(data)
+        return data
+
+    def subscribe(self):
+        """ Returns a new subscriber queue, already filled with the session messages
+        """
+        q = queue.Queue()
+        with self.lock:
+            for data in self.messages:
+                q.put(data)
+            self.subscribers.append(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            if q in self.subscribers:
+                self.subscribers.remove(q)
+
+
+class _PublisherRequestHandler(BaseHTTPRequestHandler):
+
+    publisher = None # set by ResultPublisher.start
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == self.publisher.EVENTS_PATH:
+            self._send_events()
+        elif path == self.publisher.SESSION_PATH:
+            with self.publisher.lock:
+                body = ('['+','.join(self.publisher.messages)+']').encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_error(404)
+
+    def _send_events(self):
+        # small messages : send them right away
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+
+        q = self.publisher.subscribe()
+        try:
+            while True:
+                try:
+                    data = q.get(timeout=self.publisher.KEEP_ALIVE)
+                except queue.Empty:
+                    self.wfile.write(b": keep-alive\n\n")
+                    continue
+                if data is None:
+                    break
+                self.wfile.write(f"data: {data}\n\n".encode('utf-8'))
+        except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
+            pass # subscriber gone
+        finally:
+            self.publisher.unsubscribe(q)
+
+    def log_message(self, format, *args):
+        # no log for each request in the watcher console
+        pass
+
+# ------ Main ---------------------------------------------------------------------------
+if __name__ == "__main__":
+    # publish a fake result every 2 seconds. Subscribe with :
+    # curl -N http://127.0.0.1:8765/events
+    # or python scripts/sprof_subscribe.py
+    publisher = ResultPublisher()
+    publisher.start()
+    print(f"Publication des résultats sur {publisher.url}")
+    i = 0
+    try:
+        while True:
+            i += 1
+            publisher.publish({'name':f"Test {i}", 'V0':8.0+i/100}, file=f"test {i}.rda")
+            time.sleep(2)
+    except KeyboardInterrupt:
+        publisher.stop()
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*
+# python3
+# Author : LJK - Laboratoire Jean Kuntzmann - C. Bligny
+"""
+Multi-sprint segmentation of long continuous radar recordings.
+
+A training session can be recorded in one file : several sprints, with rest or walk
+between them. RadarData looks for one sprint in the whole data (the max velocity), so
+the recording is cut first, one segment per sprint.
+
+One pass over the smoothed velocity (same filter as RadarData.V_smooth) gives the
+state of each point :
+    REST : below REST_SPEED
+    ACCELERATION, PLATEAU, DECELERATION : in a run above REST_SPEED, before, inside and
+    after the plateau around the run peak (PLATEAU_RATIO, as RadarData.find_sprint_end)
+The runs whose peak is a sprint velocity (SPRINT_VMAX_MIN, SPRINT_VMAX_MAX) and long
+enough are the sprints. Each segment keeps some rest points before the run (the sprint
+start search needs them), without reaching the neighbouring runs.
+
+The segments T and V are views on the recording arrays (no copy) :
+    for seg in find_segments(rf.T, rf.V, rf.title):
+        rd = seg.radar_data()
+For the recordings too long to be loaded, iter_segments reads them by chunks :
+    rf = RadarFile(file, load_data=False)
+    for seg in iter_segments(rf.iter_chunks(), rf.title):
+An hour of recording (~170000 points) is segmented in a few ms.
+"""
+
+import numpy as np
+from scipy.signal import filtfilt
+from sprof.radar_data import RadarData
+from sprof.utils import get_butter, get_iprevious, get_inext
+
+REST_SPEED = 2.0 # m/s, below : athlete at rest (or walking)
+MIN_SPRINT_DURATION = 2.0 # s, min duration above REST_SPEED
+PRE_START = 3.0 # s, rest kept before the run
+POST_END = 1.0 # s, kept after the run
+STREAM_MARGIN = 30.0 # s, iter_segments : data kept from a chunk to the next one
+
+# point states
+REST = 0
+ACCELERATION = 1
+PLATEAU = 2
+DECELERATION = 3
+
+# ------ Segmentation -------------------------------------------------------------------
+
+def get_V_smooth(V):
+    """ Smoothed velocity, as RadarData.V_smooth
+    """
+    b, a = get_butter(2, RadarData.SMOOTH_CUTOFF)
+    return filtfilt(b, a, V)
+
+def get_runs(V_smooth, speed=REST_SPEED):
+    """ Returns (starts, ends) : index arrays of the first and last points of the runs
+        above speed
+    """
+    above = np.concatenate(([False], V_smooth >= speed, [False]))
+    edges = np.flatnonzero(above[1:] != above[:-1])
+    return (edges[0::2], edges[1::2]-1)
+
+def get_plateau(V_smooth, i_start, i_end):
+    """ Returns (i_peak, i_start_plateau, i_end_plateau) of the run i_start..i_end
+    """
+    i_peak = i_start+int(np.argmax(V_smooth[i_start:i_end+1]))
+    return (i_peak, get_iprevious(V_smooth, i_peak, RadarData.PLATEAU_RATIO),
+            get_inext(V_smooth, i_peak, RadarData.PLATEAU_RATIO))
+
+def get_states(T, V, V_smooth=None):
+    """ Returns the state of each point (REST, ACCELERATION, PLATEAU, DECELERATION)
+    """
+    if V_smooth is None:
+        V_smooth = get_V_smooth(V)
+    states = np.full(len(V), REST, dtype=np.int8)
+    for (i_start, i_end) in zip(*get_runs(V_smooth)):
+        (i_peak, i_start_plateau, i_end_plateau) = get_plateau(V_smooth, i_start, i_end)
+        states[i_start:i_end+1] = ACCELERATION
+        states[i_start_plateau:i_end+1] = DECELERATION
+        states[i_start_plateau:i_end_plateau+1] = PLATEAU
+    return states
+
+def find_segments(T, V, title=""):
+    """ Returns the list of the sprints segments of the recording (T, V arrays)
+    """
+    T = np.asarray(T, dtype=float)
+    V = np.asarray(V, dtype=float)
+    if len(V) == 0 or len(V) != len(T):
+        print("ERREUR segmentation : données vides, ou tableaux de tailles différentes")
+        return []
+    V_smooth = get_V_smooth(V)
+    (starts, ends) = get_runs(V_smooth)
+    # sample period : len(T)-1 intervals
+    timeframe = (T[-1]-T[0])/max(len(T)-1, 1)
+    (pre, post) = (int(PRE_START/timeframe), int(POST_END/timeframe)) if timeframe > 0 else (0, 0)
+
+    segments = []
+    for (k, (i_start, i_end)) in enumerate(zip(starts, ends)):
+        if T[i_end]-T[i_start] < MIN_SPRINT_DURATION:
+            continue
+        (i_peak, i_start_plateau, i_end_plateau) = get_plateau(V_smooth, i_start, i_end)
+        if not RadarData.SPRINT_VMAX_MIN <= V_smooth[i_peak] <= RadarData.SPRINT_VMAX_MAX:
+            continue
+        # margins, not reaching the previous and next runs
+        first = max(i_start-pre, ends[k-1]+1 if k > 0 else 0)
+        last = min(i_end+post, starts[k+1]-1 if k+1 < len(starts) else len(V)-1)
+        seg = Segment(T, V, first, last+1, f"{title} #{len(segments)+1}".strip(),
+                      v_peak=V_smooth[i_peak], t_peak=T[i_peak])
+        seg.i_run_end = i_end
+        segments.append(seg)
+    return segments
+
+def iter_segments(chunks, title="", margin=STREAM_MARGIN):
+    """ Generator of the sprints segments of a recording read by chunks (cf
+        RadarFile.iter_chunks) : same segments as find_segments, in bounded memory.
+        The segments ending in the last margin seconds of the data read are found
+        again with the next chunk (the smoothing is not complete there, and the sprint
+        may go on) : margin must be longer than a sprint.
+    """
+    T = np.empty(0)
+    V = np.empty(0)
+    n_segments = 0
+    chunks = iter(chunks)
+    chunk = next(chunks, None)
+    while chunk is not None:
+        T = np.concatenate((T, chunk[0]))
+        V = np.concatenate((V, chunk[1]))
+        chunk = next(chunks, None)
+        if len(T) < 2:
+            continue
+        # segments ending before the margin (all if last chunk)
+        cut = len(T)
+        if chunk is not None:
+            timeframe = (T[-1]-T[0])/(len(T)-1)
+            cut = max(0, len(T)-int(margin/timeframe)) if timeframe > 0 else 0
+        # next data : from the end of the last sprint found, and at least the margin
+        i_next = max(0, cut-(len(T)-cut))
+        for seg in find_segments(T, V):
+            if seg.i_end > cut:
+                break
+            n_segments += 1
+            seg.title = f"{title} #{n_segments}".strip()
+            yield seg
+            i_next = max(i_next, seg.i_run_end+1)
+        # copies : the segments keep their views on the data read
+        T = T[i_next:].copy()
+        V = V[i_next:].copy()
+
+# ------ Segment Class ------------------------------------------------------------------
+
+class Segment:
+
+    def __init__(self, T, V, i_first, i_end, title="", v_peak=0.0, t_peak=0.0):
+        """ Points i_first to i_end (excluded) of the recording T, V. T and V of the
+            segment : views on the recording arrays
+        """
+        self.i_first = i_first
+        self.i_end = i_end
+        self.T = T[i_first:i_end]
+        self.V = V[i_first:i_end]
+        self.title = title
+        self.v_peak = v_peak # smoothed velocity max
+        self.t_peak = t_peak
+        self.i_run_end = i_end-1 # last point above REST_SPEED
+
+    def __len__(self):
+        return self.i_end-self.i_first
+
+    def __repr__(self):
+        return (f"Segment({self.title!r}, {self.T[0]:.2f}-{self.T[-1]:.2f} s, "
+                f"v peak {self.v_peak:.2f} m/s)")
+
+    def radar_data(self, auto=True):
+        return RadarData(self.T, self.V, self.title, auto=auto)
+
+# ------ Main ---------------------------------------------------------------------------
+if __name__ == "__main__":
+    # segment a synthetic session of an hour, and analyse each sprint
+    # python segmentation.py [n_sprints]
+    import sys
+    import time
+    import contextlib
+    import io
+    from sprof.synthetic import generate_session
+    from sprof.sprint import Sprint
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    (T, V, params) = generate_session(n, interval=60, seed=0)
+    print(f"Session : {len(T)} points, {T[-1]/60:.1f} min, {n} sprints")
+
+    # first call : includes the kernels loading (numba backend)
+    for k in range(2):
+        start_time = time.perf_counter()
+        segments = find_segments(T, V, "session")
+        print(f"Segmentation : {len(segments)} sprints trouvés en {(time.perf_counter()-start_time)*1000:.1f} ms")
+    start_time = time.perf_counter()
+    states = get_states(T, V)
+    print(f"Etats : {(time.perf_counter()-start_time)*1000:.1f} ms, "
+          f"{np.bincount(states, minlength=4)} points repos/accélération/plateau/décélération")
+    print(f"Vues sur l'enregistrement : {all(np.shares_memory(seg.V, V) for seg in segments)}")
+
+    errors = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for (seg, v_max, delay) in zip(segments, params['v_max'], params['delay']):
+            rd = seg.radar_data()
+            s = Sprint(*rd.extract_sprint(), rd.title)
+            errors.append((s.v_max-v_max, rd.T[rd.i_start_sprint]-delay))
+    errors = np.abs(errors)
+    print(f"Ecart max aux paramètres : v_max {errors[:,0].max():.3f} m/s, début {errors[:,1].max():.3f} s")
+    print(segments[0])
+
+    # dataset : one row per sprint
+    import os
+    import tempfile
+    from sprof.synthetic import format_rda
+    from sprof.pfv_dataset import build_PFV_DS_from_sessions
+    with tempfile.TemporaryDirectory() as dir:
+        file = os.path.join(dir, "Session 1.rda")
+        with open(file, 'w', newline='') as f:
+            f.write(format_rda(V))
+        start_time = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            ds = build_PFV_DS_from_sessions([file], "session")
+        print(f"Dataset : {ds.datas.shape[0]} lignes en {time.perf_counter()-start_time:.2f} s")
+        print(ds.datas.iloc[:3, :6])
+
+        # file read by chunks
+        from sprof.radar_file import RadarFile
+        with contextlib.redirect_stdout(io.StringIO()):
+            rf = RadarFile(file, load_data=False)
+        start_time = time.perf_counter()
+        chunked = list(iter_segments(rf.iter_chunks(4096), "session"))
+        print(f"Lecture par blocs : {len(chunked)} sprints en {(time.perf_counter()-start_time)*1000:.1f} ms, "
+              f"mêmes segments : {[(s.T[0], len(s)) for s in chunked] == [(s.T[0], len(s)) for s in segments]}")
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*
 # python3
 # Project local settings
+import os
 from os.path import dirname, realpath, join
 
 # project dir - do not update
@@ -19,16 +20,51 @@ PFV_ANALYSE_DIR = join(PROJECT_DIR,'test')
 
 EXPORT_CSV_DECIMAL='.'
 EXPORT_CSV_SEPARATOR=';'
+# binary export of the datasets (PFVDataset.export_table) : 'parquet' or 'feather' if
+# pyarrow is installed, else 'npz'
+EXPORT_TABLE_FORMAT='parquet'
 CSV_ATHLETE_SEPARATOR=';'
 
 # if debug = true, show more messages on execution.
 # Partially used
 DEBUG = False
 
+# Headless mode : matplotlib.pyplot is never imported (servers, workers, batch analyses).
+# Plot methods are then not available.
+# Can also be set for one command with the environment variable SPROF_HEADLESS=1
+HEADLESS = False
+
+# Instrumentation of the analyse pipeline : per stage timers and counters (sprof.instrument)
+# Near zero cost when disabled. Can also be set for one command with SPROF_INSTRUMENT=1
+INSTRUMENT = False
+
+# Numeric kernels backend (sprof.kernels) : 'numpy' (default, reference results),
+# 'numba' (compiled, if numba is installed), or 'auto' (numba if installed, else numpy).
+# numba is opt-in : on whole recordings (auto=False) its fit can stop at other values.
+# Can also be set for one command with SPROF_KERNEL_BACKEND=numba
+KERNEL_BACKEND = 'numpy'
+
+# Persistent catalog of the radar files (sprof.catalog), used by the files searches.
+# "" : sprof/catalog.sqlite in the user cache directory (LOCALAPPDATA on windows, else
+# XDG_CACHE_HOME or ~/.cache). None : no catalog (directory listed at each search)
+CATALOG_FILE = ""
+
 # List of exported time and distance values
 EXPORT_TIMES=(5,10,20,30)
 EXPORT_DISTANCES=(2,4)
 
+# Radar watcher : push each new analyse to the local subscribers (server-sent events)
+# http://WATCHER_PUBLISH_HOST:WATCHER_PUBLISH_PORT/events
+# set WATCHER_PUBLISH_PORT to None to disable
+WATCHER_PUBLISH_HOST = '127.0.0.1'
+WATCHER_PUBLISH_PORT = 8765
+# Radar watcher : number of analyses run at the same time (all watched dirs)
+WATCHER_WORKERS = 4
+# Radar watcher : save the sprint image (png) next to the radar file, in a background
+# process. Optionally with a thumbnail (..._thumb.png)
+WATCHER_SAVE_PLOTS = True
+WATCHER_THUMBNAILS = False
+
 # local values overwrites default values
 #from sprof.settings_local import *
 try:
@@ -36,6 +72,17 @@ try:
 except ImportError:
     pass
 
+if CATALOG_FILE == "":
+    CATALOG_FILE = join(os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME')
+                        or join(os.path.expanduser('~'), '.cache'), 'sprof', 'catalog.sqlite')
+
+if os.environ.get('SPROF_HEADLESS', '') not in ('', '0'):
+    HEADLESS = True
+if os.environ.get('SPROF_INSTRUMENT', '') not in ('', '0'):
+    INSTRUMENT = True
+if os.environ.get('SPROF_KERNEL_BACKEND'):
+    KERNEL_BACKEND = os.environ['SPROF_KERNEL_BACKEND']
+
 '''
 def get_logger():
     mpl_logger = logging.getLogger('matplotlib')
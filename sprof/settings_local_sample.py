@@ -29,6 +29,24 @@ EXPORT_CSV_SEPARATOR=';'
 #EXPORT_TIMES=()
 #EXPORT_DISTANCES=(10,20,24,30,35)
 
+# radar watcher : port used to push the results to the dashboards. None to disable
+#WATCHER_PUBLISH_PORT = 8765
 
 # if debug = true, show more messages on execution.
 #DEBUG = True
+
+# headless mode : never import matplotlib.pyplot, no plot
+#HEADLESS = True
+
+# per stage timers of the analyse pipeline (cf scripts/sprof_timing.py)
+#INSTRUMENT = True
+
+# numeric kernels : numpy (default), numba (compiled, if installed), or auto
+#KERNEL_BACKEND = 'numba'
+
+# catalog of the radar files (sprof.catalog) : default in the user cache directory,
+# None to list the directories at each search
+#CATALOG_FILE = None
+
+# binary export of the datasets : parquet or feather (pyarrow), npz without pyarrow
+#EXPORT_TABLE_FORMAT = 'feather'
@@ -12,13 +12,11 @@
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.optimize import leastsq
-from scipy import signal
 from sprof.radar_data import build_RD_from_file, build_RD_from_pattern
-import pandas as pd
 import logging
-from sprof.utils import print_obj_attr, get_iprevious, get_inext, bisect_left
+from sprof.utils import print_obj_attr, get_iprevious, get_inext, bisect_left, get_butter, get_pyplot, read_only
+from sprof.instrument import timers
+from sprof.kernels import fit_velocity
 
 def build_sprint_from_file(filename, outliers=True, auto=True):
     """
@@ -50,6 +48,16 @@ def build_sprint_from_RD(radar_data, outliers=True, auto=True):
                 s.reset_end_acc()
     return s
 
+def run_fit_steps(steps, fit):
+    """ Run the fit steps of a sprint (Sprint.fit_steps) : fit(T, V) -> (v_max, tau, delay)
+    """
+    try:
+        (T, V) = next(steps)
+        while True:
+            (T, V) = steps.send(fit(T, V))
+    except StopIteration:
+        pass
+
 class Sprint:
   
     # Computation constants. empirical values, tests on july data
@@ -58,17 +66,30 @@ class Sprint:
     VMAX_DIFF_RATIO = 0.5 # %
     TAU_DIFF_RATIO = 2.5 # %
     PLATEAU_RATIO = 0.02
+    SMOOTH_GAP_LIMIT = 3 # first outliers pass : v diff with v smooth
+    SMOOTH_CUTOFF_1 = 0.036 # butterworth cutoff (normalized), first smooth pass
+    SMOOTH_CUTOFF_2 = 0.05 # second smooth pass
+
+    # no instance dict : many Sprint are kept by the dataset builders
+    __slots__ = ('T_sprint_in', 'V_sprint_in', 'title', 'outliers', 'V_smooth', 'i_end_acc',
+                 'T_sprint', 'V_sprint', 'n_out', 'v_max', 'tau', 'delay', 'V_model',
+                 'converged', 'i_start_plateau', 'i_end_plateau')
     
-    def __init__(self, T_sprint, V_sprint, title="", outliers=True):
+    def __init__(self, T_sprint, V_sprint, title="", outliers=True, fit=True):
         """Class Attributes. 
            Convention : for velocity (v, V) and time (T, t), Arrays/Vectors starts 
            with uppercase, scalar with lowercase
+           fit=False : the model is not computed (v_max, tau ... not set), to fit many
+           sprints at once with fit_steps (cf batch_fit.py)
+           T_sprint and V_sprint are not copied (float arrays, ex views of RadarData) :
+           they must not be modified afterwards
         """
 
         # input Datas
         self.T_sprint_in = np.array([],dtype='float')# np array
         self.V_sprint_in = np.array([],dtype='float') # np array    
         self.title=title
+        self.outliers=outliers
         
         #Calculated datas
         self.V_smooth=np.array([],dtype='float')
@@ -84,6 +105,7 @@ class Sprint:
         self.tau = 0.0 
         self.delay = 0.0    # TIme delay before first sprint data
         self.V_model = np.array([],dtype='float') # Theorical velocity for the sprint 
+        self.converged = False # the last model fit converged
 
         # Check input datas
         if len(V_sprint)!=len(T_sprint):
@@ -92,15 +114,17 @@ class Sprint:
             print("Erreur : les données sont vides")
         else:
             # Datas
-            # _in as input : unchanged arrays.
-            self.T_sprint_in = np.array(T_sprint, dtype='float') # Time array
-            self.V_sprint_in = np.array(V_sprint,dtype='float') # Velocity array 
-            self.T_sprint = np.copy(self.T_sprint_in)
-            self.V_sprint = np.copy(self.V_sprint_in)
+            # _in as input : unchanged arrays, read only views.
+            self.T_sprint_in = read_only(T_sprint) # Time array
+            self.V_sprint_in = read_only(V_sprint) # Velocity array
+            # same arrays, until the outliers are removed (np.delete : new arrays)
+            self.T_sprint = self.T_sprint_in
+            self.V_sprint = self.V_sprint_in
             self.i_end_acc = self.n-1
             self._init_V_smooth(outliers)
             #self._init_params(outliers)
-            self._init_V_model(outliers)
+            if fit:
+                self._init_V_model(outliers)
             
         logging.debug(f"Sprint initialisé avec {self.n} points")
 
@@ -175,7 +199,7 @@ class Sprint:
         # calcul de V smooth, en enlevant/remplaçant les points aberrants par défaut
         # c'est à dire ceux éloignés de plus de 3 de v_smooth
 
-        limit=3 # empirique. On peut affiner 
+        limit=self.SMOOTH_GAP_LIMIT # empirique. On peut affiner 
 
         if outliers:
             V_smooth = self._smooth(self.V_sprint)
@@ -257,11 +281,26 @@ class Sprint:
         self.i_end_acc=self.i_end_plateau
     
     def _init_V_model(self, outliers=True):
+        """ Fit the model and remove the outliers, one fit after the other
+        """
+        run_fit_steps(self.fit_steps(outliers), self._fit)
+
+    def _fit(self, T, V):
+        (v_max, tau, delay, self.converged) = self.fit_velocity_params(T, V)
+        return (v_max, tau, delay)
+
+    def fit_steps(self, outliers=True):
+        """ Model fit and outliers removal, as a generator : yields the (T, V) arrays to
+            fit, and receives the fitted (v_max, tau, delay). Each fit depends on the
+            outliers removed after the previous one.
+            Run by _init_V_model for this sprint, or with the steps of other sprints, to
+            fit them all at once (batch_fit.py)
+        """
     
         logging.debug(f"Sprint - Init V model")
     
         # premier calcul des param et vmodel
-        self._set_V_model()
+        self._set_V_model((yield (self.T_sprint_acc, self.V_sprint_acc)))
 
         # remove outliers --> mise à jour éventuelle des attributs T_sprint et V_sprint
         
@@ -276,7 +315,7 @@ class Sprint:
             n_vgap_out = self._remove_outliers_abs(self.V_sprint_acc, self.V_model, self.VGAP_LIMIT)
             if n_vgap_out>0:
                 self._set_V_smooth()
-                self._set_V_model()
+                self._set_V_model((yield (self.T_sprint_acc, self.V_sprint_acc)))
             
             # Compare V_sprint and V_model, but weighted by the slope
             n_weigthed_vgap_out=0
@@ -285,7 +324,7 @@ class Sprint:
             n_weigthed_vgap_out = self._remove_outliers_weighted(self.V_sprint_acc, self.V_model, self.T_sprint_acc, self.WEIGHTED_VGAP_LIMIT)
             if n_weigthed_vgap_out>0:
                 self._set_V_smooth()
-                self._set_V_model()
+                self._set_V_model((yield (self.T_sprint_acc, self.V_sprint_acc)))
             
             
             '''
@@ -315,12 +354,15 @@ class Sprint:
         print(f"{self.n_out} points enlevé(s), durée plateau : {self.plateau_duration:.2f} s")
 
 
-    def _set_V_model(self):
+    def _set_V_model(self, params=None):
         """
         init attributs v_max, tau, delay, V_model from T_sprint and V_sprint
+        params : (v_max, tau, delay) if already fitted
         """
         #logging.debug(f"Sprint - Set V model")
-        (v_max, tau, delay) = self.compute_f_velocity_params(self.T_sprint_acc, self.V_sprint_acc)
+        if params is None:
+            params = self.compute_f_velocity_params(self.T_sprint_acc, self.V_sprint_acc)
+        (v_max, tau, delay) = params
         self.v_max = v_max
         self.tau = tau
         self.delay = delay
@@ -331,13 +373,15 @@ class Sprint:
         # tests. get erreur python, calcule la distance
 
     def _smooth(self, V):
+        from scipy.signal import filtfilt
         # lissage moins lisse, pour garder la chute, au plus proche de _lissage
-        b2, a2 = signal.butter(1, 0.036, 'low', analog=False)
+        b2, a2 = get_butter(1, self.SMOOTH_CUTOFF_1)
         # pour lisser le lissage moins lisse
-        b3, a3 = signal.butter(2, 0.05, 'low', analog=False)
-        V_smooth = signal.filtfilt(b2, a2, V,padlen=25) 
-        # padlen : 1er et derniere valeur non lissée (pas parfait pour la dernière)
-        V_smooth = signal.filtfilt(b3, a3, V_smooth) #method='gust'
+        b3, a3 = get_butter(2, self.SMOOTH_CUTOFF_2)
+        with timers.stage('smooth'):
+            V_smooth = filtfilt(b2, a2, V,padlen=25) 
+            # padlen : 1er et derniere valeur non lissée (pas parfait pour la dernière)
+            V_smooth = filtfilt(b3, a3, V_smooth) #method='gust'
         return V_smooth
      
     def _remove_point(self,i_remove):
@@ -474,26 +518,27 @@ class Sprint:
         
     def compute_f_velocity_params(self,T,V):
         """
-        Returns the velocity function params, using the scipy leastsq methods
+        Returns the velocity function params, using the scipy leastsq methods (or the
+        compiled fit, cf kernels.py)
         Inpus are the measured time and velocity arrays for the sprint.
         """
+        return self.fit_velocity_params(T, V)[:3]
+
+    def fit_velocity_params(self, T, V):
+        """ As compute_f_velocity_params, returns (v_max, tau, delay, converged)
+        """
         # initial values
         v_max = 8.0
         tau = 1.0
         delay = 0.0 # en seconde
-        p_initial=np.array([v_max, tau, delay],dtype=float)
-        t_start = T[0]
         
         # get optimum params
-        F = lambda p, t : p[0] * (1-np.exp((t_start + p[2] - t)/p[1]))
-        F_err = lambda p, t, v: F(p, t)-v
-        p_final, success = leastsq(F_err,p_initial[:],args=(T,V))
-
-        v_max = p_final[0]
-        tau = p_final[1]
-        delay = p_final[2]   
+        with timers.stage('fit'):
+            (v_max, tau, delay, nfev, converged) = fit_velocity(T, V, v_max, tau, delay)
+        if timers.enabled:
+            timers.count('fit', 'nfev', nfev)
         
-        return(v_max, tau, delay)
+        return(v_max, tau, delay, converged)
  
     def print_attr(self):
         print_obj_attr(self)
@@ -519,6 +564,7 @@ class Sprint:
 
     def plot_outliers(self):
     
+        plt = get_pyplot()
         # plot vmesure, vmodel et pareil pour self.
         plt.plot(self.T_sprint_in, self.V_sprint_in, alpha=0.3)
         plt.plot(self.T_sprint, self.V_sprint, alpha=0.5)
@@ -551,6 +597,7 @@ class Sprint:
         Compute v_max and tau variation when removing each points.
         Returns a pandas dataframe containg the variations for each points.
         """   
+        import pandas as pd
         # objectif de variation max en quelque sorte.
         #vmax_diff_lim = 0.5
         #tau_diff_lim = 2.5
@@ -609,6 +656,7 @@ class Sprint:
 
     def plot_points_impact(self):
     
+        plt = get_pyplot()
         impacts=self.get_points_impact()
         
         '''
@@ -660,6 +708,7 @@ if __name__ == "__main__":
     # execute only if run as a script : python radar_data.py
     # load file
     from radar_file import params_get_file #, scan_dir
+    plt = get_pyplot()
     import time
     
     file = params_get_file()   
@@ -710,11 +759,41 @@ if __name__ == "__main__":
         s_auto.plot_outliers()
         
         plt.show()
-    
+
+    def sprints_memory():
+        """ Memory kept by the RadarData and Sprint of the files (radar files arrays not
+        counted) : T and V owned once, sprint arrays are views, copied only when the
+        outliers are removed
+        python sprint.py -p ju
+        """
+        import contextlib
+        import io
+        import tracemalloc
+        from radar_file import params_get_files
+        from sprof.radar_file import RadarFile
+        from sprof.radar_data import RadarData
+        with contextlib.redirect_stdout(io.StringIO()):
+            rfs = [RadarFile(f) for f in params_get_files()]
+            build_sprint_from_RD(RadarData(rfs[0].T, rfs[0].V)) # imports and caches, not counted
+            tracemalloc.start()
+            kept = []
+            for rf in rfs:
+                rd = RadarData(rf.T, rf.V, rf.title)
+                kept.append((rd, build_sprint_from_RD(rd)))
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+        raw = sum(rf.T.nbytes+rf.V.nbytes for rf in rfs)
+        print(f"{len(kept)} fichiers : {memory/1000/max(1, len(kept)):.1f} Ko par sprint "
+              f"(données brutes {raw/1000/max(1, len(kept)):.1f} Ko, non copiées)")
+        (rd, s) = kept[0]
+        print(f"{s.title} : T sprint vue de RadarData {np.shares_memory(s.T_sprint_in, rd.T)}, "
+              f"V sans points aberrants copié {not np.shares_memory(s.V_sprint, rd.V)}")
+
     view_auto()
     #view_manual()
     #view_points_impact()
     #compare()
+    #sprints_memory()
 
     
     # Debut du decompte du temps
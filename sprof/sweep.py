@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*
+# python3
+# Author : LJK - Laboratoire Jean Kuntzmann - C. Bligny
+"""
+Parameter sweep : error compared to the manual analyses, for a grid of values of the
+computation constants of RadarData and Sprint (empirical values, tests on july data).
+
+    python sweep.py --grid RadarData.PLATEAU_RATIO=0.1,0.2,0.3 --grid Sprint.VGAP_LIMIT=2,3,4
+
+Each combination of the grid is evaluated with subclasses of RadarData and Sprint having
+the combination constants : the classes are not modified.
+To avoid computing again what does not depend on a parameter :
+    - the radar files are read, and the athletes found, once. The recordings are sent
+      once to each worker process (pool initializer)
+    - the RadarData (smoothing, sprint bounds) are computed once for each combination of
+      the RadarData constants, in each worker, then shared by all the Sprint combinations
+    - the PFV are computed again only if the sprint results (v_max, tau, duration) change
+The result is a dataframe : one row per combination, with the mean error (%) of each
+metric and the global score (mean of the metrics errors), best first.
+"""
+
+import contextlib
+import io
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from sprof.settings import RADAR_DATA_DIR, PFV_ANALYSE_DIR
+from sprof.radar_data import RadarData
+from sprof.sprint import Sprint
+from sprof.pfv import PFV
+from sprof.analyse import Analyse
+from sprof.athlete import get_athlete_values
+from sprof.pfv_dataset import PFVDataset, get_row_values
+from sprof.manual_compare import read_manual, load_radar_files, error_stats
+
+SWEEP_CLASSES = {'RadarData':RadarData, 'Sprint':Sprint}
+
+# default grid : values around the current constants
+DEFAULT_GRID = {'RadarData.PLATEAU_RATIO':(0.15, 0.2, 0.25),
+                'RadarData.SMOOTH_CUTOFF':(0.014, 0.018, 0.022),
+                'Sprint.VGAP_LIMIT':(2, 2.5, 3, 4),
+                'Sprint.WEIGHTED_VGAP_LIMIT':(2, 2.5, 3, 4),
+                'Sprint.SMOOTH_CUTOFF_1':(0.03, 0.036, 0.042)}
+
+# ------ Grid ---------------------------------------------------------------------------
+
+def parse_grid(specs):
+    """ Returns the grid from command line values : ["Class.CONSTANT=v1,v2,...", ...]
+    """
+    grid = {}
+    for spec in specs:
+        (name, values) = spec.split('=')
+        (class_name, constant) = name.strip().split('.')
+        if class_name not in SWEEP_CLASSES or not hasattr(SWEEP_CLASSES[class_name], constant):
+            raise ValueError(f"Constante inconnue : {name}")
+        grid[name.strip()] = tuple(float(v) for v in values.split(','))
+    return grid
+
+def expand_grid(grid):
+    """ Returns the list of the grid combinations : dictionnaries {name : value}
+    """
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+
+def split_params(params):
+    """ Split a combination into (RadarData constants, Sprint constants), as sorted tuples
+        of (constant, value) : used as keys
+    """
+    rd_params = tuple(sorted((k.split('.')[1], v) for (k,v) in params.items() if k.startswith('RadarData.')))
+    s_params = tuple(sorted((k.split('.')[1], v) for (k,v) in params.items() if k.startswith('Sprint.')))
+    return (rd_params, s_params)
+
+@lru_cache(maxsize=None)
+def get_class(class_name, params):
+    """ Returns a subclass of RadarData or Sprint, with the constants params
+    """
+    cls = SWEEP_CLASSES[class_name]
+    return type(cls.__name__, (cls,), dict(params)) if params else cls
+
+# ------ Worker process -----------------------------------------------------------------
+
+# recordings of the worker : list of (RadarFile, mass, stature)
+_recordings = None
+
+def init_worker(recordings):
+    global _recordings
+    _recordings = recordings
+
+@lru_cache(maxsize=8)
+def get_sprints_in(rd_params, auto):
+    """ Returns the extracted sprint of each recording for the RadarData constants :
+        list of (T, V, title), None if there is a data error
+    """
+    RD = get_class('RadarData', rd_params)
+    sprints_in = []
+    for (rf, mass, stature) in _recordings:
+        rd = RD(rf.T, rf.V, rf.title, auto=auto)
+        sprints_in.append(None if rd.data_error else rd.extract_sprint()+(rd, ))
+    return sprints_in
+
+@lru_cache(maxsize=4096)
+def get_pfv(i, v_max, tau, duration):
+    (rf, mass, stature) = _recordings[i]
+    return PFV(v_max=v_max, tau=tau, duration=duration, mass=mass, stature=stature)
+
+def run_combinations(rd_params, s_params_list, auto=True, outliers=True):
+    """ Returns the dataset rows of all the recordings, for each Sprint constants of
+        s_params_list (and the RadarData constants rd_params)
+    """
+    results = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        sprints_in = get_sprints_in(rd_params, auto)
+        for s_params in s_params_list:
+            S = get_class('Sprint', s_params)
+            rows = []
+            for (i, sprint_in) in enumerate(sprints_in):
+                if sprint_in is None:
+                    continue
+                (T, V, rd) = sprint_in
+                s = S(T, V, rd.title, outliers=outliers)
+                pfv = get_pfv(i, s.v_max, s.tau, s.duration)
+                a = Analyse(radar_file=_recordings[i][0], radar_data=rd, sprint=s, pfv=pfv)
+                rows.append(get_row_values(a))
+            results.append(rows)
+    return results
+
+# ------ Sweep --------------------------------------------------------------------------
+
+def run_sweep(rfs, grid, df_man, workers=None, auto=True, outliers=True):
+    """ Evaluate all the combinations of grid on the RadarFile list rfs.
+        Returns the results dataframe, sorted by score (best first)
+    """
+    import pandas as pd
+
+    workers = workers or os.cpu_count()
+    with contextlib.redirect_stdout(io.StringIO()):
+        recordings = [(rf,)+get_athlete_values(rf.filename) for rf in rfs]
+
+    # group the combinations by RadarData constants, then split the groups in tasks
+    combos = expand_grid(grid)
+    groups = {}
+    for params in combos:
+        (rd_params, s_params) = split_params(params)
+        groups.setdefault(rd_params, []).append(s_params)
+    chunk = max(1, len(combos)//(workers*4))
+    tasks = [(rd_params, s_list[i:i+chunk]) for (rd_params, s_list) in groups.items()
+             for i in range(0, len(s_list), chunk)]
+
+    rows = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(recordings,)) as executor:
+        futures = [(task, executor.submit(run_combinations, *task, auto, outliers)) for task in tasks]
+        for ((rd_params, s_list), future) in futures:
+            for (s_params, combo_rows) in zip(s_list, future.result()):
+                rows[(rd_params, s_params)] = combo_rows
+
+    results = []
+    for params in combos:
+        ds = PFVDataset()
+        ds.add_rows(rows[split_params(params)])
+        stats = error_stats(ds.compare(df_man))
+        result = dict(params)
+        result['n'] = int(stats['n'].min()) if len(stats) else 0
+        result.update(stats['mean'].to_dict())
+        result['score'] = round(stats['mean'].mean(), 3)
+        results.append(result)
+    return pd.DataFrame(results).sort_values(by='score').reset_index(drop=True)
+
+# ------ Main ---------------------------------------------------------------------------
+if __name__ == "__main__":
+    import argparse
+    import warnings
+    import pandas as pd
+    from datetime import datetime
+
+    parser = argparse.ArgumentParser(description="Erreur par rapport aux analyses manuelles, pour une grille de constantes")
+    parser.add_argument('--dir', '-d', default=RADAR_DATA_DIR, help='Répertoire contenant les données')
+    parser.add_argument('--ext', '-e', default='rda', help='Extention des fichiers (rad ou rda)')
+    parser.add_argument('--grid', '-g', action='append', help='Classe.CONSTANTE=v1,v2,... (défaut : DEFAULT_GRID)')
+    parser.add_argument('--workers', type=int, default=None, help='Nombre de process')
+    parser.add_argument('--no-auto', dest='auto', action='store_false', help='Bornes du sprint non calculées')
+    parser.add_argument('--no-outliers', dest='outliers', action='store_false', help='Sans enlever les points aberrants')
+    args = parser.parse_args()
+
+    # DataFrame.append, utilisé par PFVDataset
+    warnings.simplefilter('ignore', FutureWarning)
+
+    grid = parse_grid(args.grid) if args.grid else DEFAULT_GRID
+    ext = '.'+args.ext.lstrip('.')
+    rfs = load_radar_files(args.dir, exts=(ext,))[ext]
+    n_combos = len(expand_grid(grid))
+
+    start_time = time.perf_counter()
+    df = run_sweep(rfs, grid, read_manual(), workers=args.workers, auto=args.auto, outliers=args.outliers)
+    print(f"{n_combos} combinaisons x {len(rfs)} fichiers en {time.perf_counter()-start_time:.1f} s")
+
+    with pd.option_context('display.max_columns', None, 'display.width', 200):
+        print(df.head(20))
+    file = os.path.join(PFV_ANALYSE_DIR, datetime.now().strftime("%y%m%d")+'_sweep.csv')
+    df.to_csv(file, index=None)
+    print(f"Résultats sauvegardés : {file}")
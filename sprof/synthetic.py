@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*
+# python3
+# Author : LJK - Laboratoire Jean Kuntzmann - C. Bligny
+"""
+Synthetic radar recordings, with known parameters (ground truth).
+
+Used for benchmarks and accuracy checks of the analyse at scale : the recordings follow
+the sprint velocity model used by Sprint, v(t) = v_max * (1-exp(-(t-delay)/tau)), with :
+    - delay : time before the athlete starts (s). Before, the radar measures noise
+      around a low speed (pre_level, pre_noise)
+    - a plateau, sprint_duration seconds after the start, followed by a linear
+      deceleration (decel, m/s²) down to the walking speed
+    - gaussian noise on the sprint (noise) and outliers (outlier_rate : ratio of points
+      moved by +/- outlier_amp)
+Speeds are rounded to 0.01 m/s, as in the STALKER files.
+
+All the recordings of a batch are computed at once (numpy arrays, one row per recording),
+and the files are written using preformatted strings, so a large corpus is built
+in seconds :
+    files = write_corpus("/tmp/synth", 1000, seed=0)
+The ground truth is saved in the same dir (TRUTH_FILE), cf read_truth.
+"""
+
+import csv
+import os
+from datetime import datetime
+from functools import lru_cache
+import numpy as np
+
+# Default values, STALKER ATS II
+SAMPLE_RATE = 46.875 # Hz
+DURATION = 10.0 # s, recording duration
+
+TRUTH_FILE = "synthetic_truth.csv"
+TRUTH_COLUMNS = ('title', 'file', 'v_max', 'tau', 'delay', 'sprint_duration', 'decel',
+                 'noise', 'pre_level', 'pre_noise', 'outlier_rate', 'n_outliers', 'sample_rate')
+
+# Parameters : (low, high) range for random values
+PARAMS_RANGE = {'v_max':(7.0, 10.5),
+                'tau':(0.9, 1.6),
+                'delay':(1.0, 3.0),
+                'sprint_duration':(4.0, 5.5),
+                'decel':(1.5, 3.0),
+                'noise':(0.05, 0.15),
+                'pre_level':(0.3, 0.8),
+                'pre_noise':(0.1, 0.3),
+                'outlier_rate':(0.0, 0.01)}
+OUTLIER_AMP = 3.0 # m/s
+WALK_SPEED = 1.0 # m/s, speed at the end of the deceleration
+
+# ------ Parameters ---------------------------------------------------------------------
+
+def random_params(n, seed=None, **fixed):
+    """ Returns a dictionnary of n random values for each parameter of PARAMS_RANGE.
+        fixed : parameters with a given value, ex random_params(100, noise=0)
+    """
+    rng = np.random.default_rng(seed)
+    params = {}
+    for (name, (low, high)) in PARAMS_RANGE.items():
+        if name in fixed:
+            params[name] = np.full(n, fixed[name], dtype=float)
+        else:
+            params[name] = rng.uniform(low, high, n)
+    return params
+
+# ------ Velocity generation ------------------------------------------------------------
+
+def generate(params, duration=DURATION, sample_rate=SAMPLE_RATE, seed=None):
+    """ Compute the recordings for the params (cf random_params), all at once.
+        Returns (T, V, outliers) :
+            T : time array (n points), common to all the recordings
+            V : velocity, one row per recording
+            outliers : boolean array, same shape as V, True for the outliers points
+    """
+    rng = np.random.default_rng(seed)
+    p = {k:np.asarray(v, dtype=float)[:,None] for (k,v) in params.items()}
+    m = len(params['v_max'])
+    n = int(duration*sample_rate)+1
+
+    T = np.around(np.arange(n)/sample_rate, decimals=2)
+    t = T[None,:] - p['delay'] # time since start
+
+    # acceleration, model used by Sprint
+    V = p['v_max']*(1-np.exp(-np.maximum(t, 0)/p['tau']))
+    # deceleration after the plateau
+    t_end = p['sprint_duration']
+    v_end = p['v_max']*(1-np.exp(-t_end/p['tau']))
+    V_decel = np.maximum(v_end - p['decel']*(t-t_end), np.minimum(WALK_SPEED, v_end))
+    V = np.where(t > t_end, V_decel, V)
+    V += rng.normal(0, 1, (m,n))*p['noise']
+
+    # before start : noise around a low speed
+    V_pre = np.abs(p['pre_level'] + rng.normal(0, 1, (m,n))*p['pre_noise'])
+    V = np.where(t < 0, V_pre, V)
+
+    # outliers, on the sprint only
+    outliers = (rng.random((m,n)) < p['outlier_rate']) & (t > 0)
+    V = np.where(outliers, V + rng.uniform(-OUTLIER_AMP, OUTLIER_AMP, (m,n)), V)
+
+    V = np.around(np.maximum(V, 0), decimals=2)
+    return (T, V, outliers)
+
+def generate_one(v_max=9.0, tau=1.2, delay=2.0, sprint_duration=5.0, decel=2.0, noise=0.1,
+                 pre_level=0.5, pre_noise=0.2, outlier_rate=0.0, duration=DURATION,
+                 sample_rate=SAMPLE_RATE, seed=None):
+    """ Returns the T, V arrays of one recording, ex : RadarData(*generate_one(), "synth")
+    """
+    params = {k:[v] for (k,v) in locals().items() if k in PARAMS_RANGE}
+    (T, V, outliers) = generate(params, duration, sample_rate, seed)
+    return (T, V[0])
+
+def generate_session(n_sprints, interval=60.0, sample_rate=SAMPLE_RATE, seed=None, **fixed):
+    """ One long recording of a repeated sprints session : n_sprints recordings of
+        interval seconds (sprint, deceleration, then walk until the next start), one after
+        the other. Returns (T, V, params) : params of each sprint (cf random_params), the
+        delays from the session start
+    """
+    params = random_params(n_sprints, seed=seed, **fixed)
+    (T, V, outliers) = generate(params, duration=interval, sample_rate=sample_rate, seed=seed)
+    n = V.shape[1]-1 # last point : first point of the next sprint
+    T = np.around(np.arange(n_sprints*n)/sample_rate, decimals=2)
+    params = dict(params, delay=params['delay']+np.arange(n_sprints)*n/sample_rate)
+    return (T, V[:,:n].ravel(), params)
+
+# ------ STALKER format -----------------------------------------------------------------
+
+@lru_cache(maxsize=32)
+def _format_table(low, high, width):
+    """ Preformatted strings of the values low/100 ... high/100, STALKER format
+        (comma decimal, right aligned on width characters)
+    """
+    return np.array([f"{c/100:{width}.2f}".replace('.', ',') for c in range(low, high+1)], dtype=object)
+
+def _format_values(X, width):
+    """ Returns an array of formatted strings, for the values of X
+    """
+    C = np.rint(np.asarray(X)*100).astype(int)
+    low = min(int(C.min()), 0)
+    high = max(int(C.max()), 0)
+    # table bounds rounded, to reuse the cached tables
+    low = -((-low)//10000+1)*10000 if low < 0 else 0
+    high = (high//10000+1)*10000
+    return _format_table(low, high, width)[C-low]
+
+def format_rda(V):
+    """ Returns the content of a .rda file, V : velocity array
+    """
+    n = len(V)
+    lines = ["STALKER Version 5.020 using ATS II radar gun"]
+    lines += list(_format_values((3, 4, n-3), 12))
+    lines += list(_format_values(V, 12))
+    return "\r\n".join(lines)+"\r\n"
+
+def format_rad(title, date, T, V, sample_rate=SAMPLE_RATE):
+    """ Returns the content of a .rad file. date : datetime
+    """
+    n = len(V)
+    A = np.gradient(V, T) if n > 1 else np.zeros(n)
+    D = np.concatenate(([0], np.cumsum(V[1:]*np.diff(T))))
+    rate = f"{sample_rate:.3f}".replace('.', ',')
+    header = ["STALKER Version 5.020 using ATS II", "",
+              f"TRIAL NAME  : {title}",
+              date.strftime("%m/%d/%Y %H:%M:%S (mm/dd/yyyy)"), "0", "",
+              f"SAMPLE RATE :  {rate}",
+              f"SAMPLES     : {n-1:7d}", "",
+              "DATA TYPE   :      4 : Raw Data",
+              "UNITS       :      3 : SI",
+              "Speed Units : meters/sec",
+              "Accel Units : meters/s/s",
+              "Dist  Units : meters", "", "",
+              "  Sample   Time   Speed   Accel     Dist", ""]
+    samples = np.array([f"{i:7d}" for i in range(n)], dtype=object)
+    rows = samples + _format_values(T, 8) + _format_values(V, 8) + _format_values(A, 8) + _format_values(D, 9)
+    return "\r\n".join(header + list(rows) + ["END OF FILE"])+"\r\n"
+
+# ------ Corpus -------------------------------------------------------------------------
+
+def write_corpus(dir, n, prefix="Synthetic", seed=None, ext=('.rda', '.rad'), duration=DURATION,
+                 sample_rate=SAMPLE_RATE, batch_size=1000, **fixed):
+    """ Write n synthetic recordings in dir, and the ground truth (TRUTH_FILE).
+        File names : "prefix 000001 1.rda" ... (title + trial number, as the radar files)
+        fixed : parameters with a given value, cf random_params
+        Returns the list of the data files (.rda if written, else .rad)
+    """
+    os.makedirs(dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    date = datetime.now().replace(microsecond=0)
+    files = []
+
+    with open(os.path.join(dir, TRUTH_FILE), 'w', newline='') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(TRUTH_COLUMNS)
+
+        for start in range(0, n, batch_size):
+            m = min(batch_size, n-start)
+            params = random_params(m, seed=rng, **fixed)
+            (T, V, outliers) = generate(params, duration, sample_rate, seed=rng)
+            n_outliers = outliers.sum(axis=1)
+            values = np.around(np.column_stack([params[k] for k in TRUTH_COLUMNS[2:-2]]), 4).tolist()
+
+            for i in range(m):
+                title = f"{prefix} {start+i+1:06d} 1"
+                basefile = os.path.join(dir, title)
+                if '.rda' in ext:
+                    with open(basefile+'.rda', 'w', newline='') as f_data:
+                        f_data.write(format_rda(V[i]))
+                if '.rad' in ext:
+                    with open(basefile+'.rad', 'w', newline='') as f_data:
+                        f_data.write(format_rad(title, date, T, V[i], sample_rate))
+                file = basefile + ('.rda' if '.rda' in ext else '.rad')
+                files.append(file)
+                writer.writerow([title, os.path.basename(file)] + values[i] + [n_outliers[i], sample_rate])
+    return files
+
+def read_truth(dir):
+    """ Read the ground truth of a synthetic corpus. Returns a dictionnary title : params
+    """
+    truth = {}
+    with open(os.path.join(dir, TRUTH_FILE), newline='') as f:
+        for row in csv.DictReader(f, delimiter=';'):
+            title = row.pop('title')
+            file = row.pop('file')
+            truth[title] = {k:float(v) for (k,v) in row.items()}
+            truth[title]['file'] = file
+    return truth
+
+# ------ Main ---------------------------------------------------------------------------
+if __name__ == "__main__":
+    # python synthetic.py [n] [dir] : write a corpus, and compare a few analyses to
+    # the ground truth
+    import sys
+    import tempfile
+    import time
+    from sprof.radar_file import RadarFile
+    from sprof.radar_data import RadarData
+    from sprof.sprint import Sprint
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    dir = sys.argv[2] if len(sys.argv) > 2 else tempfile.mkdtemp(prefix="sprof_synth_")
+
+    start_time = time.time()
+    files = write_corpus(dir, n, seed=0)
+    print(f"{n} enregistrements écrits dans {dir} en {time.time()-start_time:.2f} s")
+
+    truth = read_truth(dir)
+    print(f"\n{'titre':<22}{'v_max':>7}{'calc':>7}{'tau':>7}{'calc':>7}")
+    for file in files[:5]:
+        rf = RadarFile(file)
+        rd = RadarData(rf.T, rf.V, rf.title)
+        (T, V) = rd.extract_sprint()
+        s = Sprint(T, V, rd.title)
+        t = truth[rf.title]
+        print(f"{rf.title:<22}{t['v_max']:>7.2f}{s.v_max:>7.2f}{t['tau']:>7.2f}{s.tau:>7.2f}")